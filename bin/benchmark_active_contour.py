@@ -0,0 +1,235 @@
+#!/usr/bin/python
+#
+# -----------------------------------------------------------------------------
+# Copyright * 2014, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration. All
+# rights reserved.
+#
+# The Crisis Mapping Toolkit (CMT) v1 platform is licensed under the Apache
+# License, Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+# -----------------------------------------------------------------------------
+
+import logging
+logging.basicConfig(level=logging.ERROR)
+try:
+    import cmt.radar.active_contour
+except ImportError:
+    import sys
+    import os.path
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+    import cmt.radar.active_contour
+
+import sys
+import time
+import optparse
+import resource
+
+import numpy
+
+from cmt.local_ee_image import LocalEEImage
+from cmt.radar.active_contour import Snake, run_snake, run_snake_tiled, MAX_STEPS
+
+'''
+Offline benchmark for the active contour algorithm.
+
+Generates synthetic speckled SAR scenes with known water bodies, runs the snake
+on them without any Earth Engine access, and reports timing, memory and accuracy.
+'''
+
+
+# --------------------------------------------------------------
+# Synthetic scenes
+
+WATER_BACKSCATTER = 60.0  # Mean amplitude of calm water
+LAND_BACKSCATTER  = 400.0 # Mean amplitude of land
+
+def generate_scene(size, seed, looks=4):
+    '''Generate a speckled single band SAR-like image and the matching water mask.
+       - Returns (image, water_mask) with image as uint16.'''
+
+    rng = numpy.random.RandomState(seed)
+    (rows, cols) = numpy.mgrid[0:size, 0:size].astype(numpy.float64)
+
+    # A few elliptical lakes plus a meandering river
+    water = numpy.zeros((size, size), dtype=bool)
+    for i in range(rng.randint(2, 5)):
+        (r0, c0) = rng.uniform(0.2, 0.8, 2) * size
+        (a,  b ) = rng.uniform(0.05, 0.15, 2) * size
+        water |= ((rows - r0) / a) ** 2 + ((cols - c0) / b) ** 2 < 1.0
+    river_center = size * (0.5 + 0.15 * numpy.sin(cols / size * 2 * numpy.pi * rng.uniform(0.5, 1.5)))
+    water |= numpy.abs(rows - river_center) < size * 0.02
+
+    # Multiplicative gamma distributed speckle with the given number of looks
+    mean    = numpy.where(water, WATER_BACKSCATTER, LAND_BACKSCATTER)
+    speckle = rng.gamma(looks, 1.0 / looks, (size, size))
+    image   = numpy.clip(mean * speckle, 1, 65535).astype(numpy.uint16)
+    return (image, water)
+
+class SyntheticImage(LocalEEImage):
+    '''A LocalEEImage built from in-memory arrays instead of an Earth Engine download.'''
+
+    def __init__(self, images, bands, scale=25):
+        (h, w) = images[bands[0]].shape
+        degrees = scale / 111320.0 # Rough meters to degrees conversion, only used for output
+        self.images          = images
+        self.bands           = bands
+        self.image_name      = 'synthetic'
+        self.scale           = scale
+        self.transform       = [degrees, 0.0, 0.0, -degrees, 0.0, 0.0]
+        self.bbox            = (0.0, -h * degrees, w * degrees, 0.0)
+        self.log10_images    = dict()
+        self.integral_images = dict()
+
+def compute_synthetic_statistics(image, water, image_is_log_10):
+    '''Compute the band statistics from a training scene, like compute_band_statistics does.'''
+    ALLOWED_DEVIATIONS = 2.5
+    values = image[water].astype(numpy.float64)
+    if image_is_log_10:
+        values = numpy.log10(values)
+    return [(values.mean(), values.std(), ALLOWED_DEVIATIONS)]
+
+def initial_loops(w, h, border, cell_size=20):
+    '''Same initial grid of loops as initialize_active_contour'''
+    loops = []
+    for i in range(border, w - border, cell_size):
+        for j in range(border, h - border, cell_size):
+            nextj = min(j + cell_size, h - border)
+            nexti = min(i + cell_size, w - border)
+            loops.append([(i, j), (i, nextj), (nexti, nextj), (nexti, j)])
+    return loops
+
+
+# --------------------------------------------------------------
+# Timing
+
+class TimedSnake(object):
+    '''Wraps a Snake and accumulates the time spent in each step function.'''
+
+    TIMED_FUNCTIONS = ['shift_nodes', 'respace_nodes', 'fix_geometry']
+
+    def __init__(self, snake):
+        object.__setattr__(self, 'snake',  snake)
+        object.__setattr__(self, 'times',  dict([(f, 0.0) for f in self.TIMED_FUNCTIONS]))
+        object.__setattr__(self, 'counts', dict([(f, 0)   for f in self.TIMED_FUNCTIONS]))
+
+    def __getattr__(self, name):
+        value = getattr(self.snake, name)
+        if name not in self.TIMED_FUNCTIONS:
+            return value
+        def timed(*args, **kwargs):
+            t = time.time()
+            result = value(*args, **kwargs)
+            self.times [name] += time.time() - t
+            self.counts[name] += 1
+            return result
+        return timed
+
+    def __setattr__(self, name, value):
+        setattr(self.snake, name, value)
+
+def compute_iou(mask, truth):
+    '''Intersection over union of two boolean masks'''
+    union = numpy.logical_or(mask, truth).sum()
+    if union == 0:
+        return 1.0
+    return numpy.logical_and(mask, truth).sum() / float(union)
+
+def peak_memory_mb():
+    '''Peak resident memory of this process (Linux reports kilobytes)'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def run_benchmark(size, seed, image_is_log_10, max_steps, num_processes):
+    '''Run the snake on one synthetic scene and return a dictionary of results'''
+
+    BAND = 'hh'
+    (train_image, train_water) = generate_scene(size, seed + 1000)
+    (image,       water      ) = generate_scene(size, seed)
+    band_statistics = compute_synthetic_statistics(train_image, train_water, image_is_log_10)
+
+    local_image = SyntheticImage({BAND: image}, [BAND])
+    if image_is_log_10:
+        local_image.build_derived_planes(log10=True)
+    (w, h) = local_image.size()
+    border = max(1, min(w, h) / 25)
+
+    start = time.time()
+    snake = Snake(local_image, initial_loops(w, h, border), band_statistics, image_is_log_10)
+    snake.respace_nodes()
+    if num_processes > 1:
+        snake = run_snake_tiled(local_image, snake, num_processes, max_steps=max_steps)
+        timed = None
+    else:
+        timed = TimedSnake(snake)
+        run_snake(timed, max_steps)
+    elapsed = time.time() - start
+
+    results = {'size'      : size,
+               'seed'      : seed,
+               'seconds'   : elapsed,
+               'loops'     : len(snake.loops),
+               'nodes'     : sum([len(l.nodes) for l in snake.loops]),
+               'iou'       : compute_iou(snake.to_mask().astype(bool), water),
+               'memory_mb' : peak_memory_mb()}
+    if timed:
+        steps = timed.counts['shift_nodes']
+        results['steps']         = steps
+        results['steps_per_sec'] = steps / elapsed if elapsed > 0 else 0.0
+        for f in TimedSnake.TIMED_FUNCTIONS:
+            count = timed.counts[f]
+            results[f + '_ms'] = 1000.0 * timed.times[f] / count if count else 0.0
+    return results
+
+def print_results(all_results):
+    '''Print one line of results per scene'''
+    columns = ['size', 'seed', 'seconds', 'steps', 'steps_per_sec', 'shift_nodes_ms',
+               'fix_geometry_ms', 'respace_nodes_ms', 'loops', 'nodes', 'memory_mb', 'iou']
+    print ' '.join(['%16s' % c for c in columns])
+    for r in all_results:
+        line = []
+        for c in columns:
+            v = r.get(c, '-')
+            line.append(('%16.4f' % v) if isinstance(v, float) else ('%16s' % str(v)))
+        print ' '.join(line)
+
+
+# --------------------------------------------------------------
+def main(argsIn):
+
+    usage = "usage: benchmark_active_contour.py [--help]\n  "
+    parser = optparse.OptionParser(usage=usage)
+
+    parser.add_option("--size", dest="sizes", default="256",
+                      help="Comma separated list of scene sizes in pixels.")
+    parser.add_option("--seeds", dest="numSeeds", default=1, type="int",
+                      help="Number of random scenes to run for each size.")
+    parser.add_option("--max-steps", dest="maxSteps", default=MAX_STEPS, type="int",
+                      help="Maximum number of snake steps.")
+    parser.add_option("--processes", dest="numProcesses", default=1, type="int",
+                      help="Use the tiled mode with this many processes.")
+    parser.add_option("--linear", dest="linear", action="store_true", default=False,
+                      help="Run on linear values instead of log10 values.")
+
+    (options, args) = parser.parse_args(argsIn)
+
+    sizes = [int(s) for s in options.sizes.split(',')]
+    all_results = []
+    for size in sizes:
+        for seed in range(options.numSeeds):
+            print 'Running ' + str(size) + ' pixel scene with seed ' + str(seed) + '...'
+            all_results.append(run_benchmark(size, seed, not options.linear,
+                                             options.maxSteps, options.numProcesses))
+    print_results(all_results)
+    return 0
+
+
+# Call main() when run from command line
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -40,6 +40,8 @@ import cmt.modis.flood_algorithms
 import cmt.radar.flood_algorithms
 import cmt.util.landsat_functions
 import cmt.util.miscUtilities
+import cmt.util.ee_trace
+import cmt.util.ee_request_pool
 
 from cmt.util.imageRetrievalFunctions import getCloudFreeModis, getCloudFreeLandsat, getNearestSentinel1
 
@@ -337,6 +339,13 @@ def main(argsIn):
 
           parser.add_option("--max-cloud-percentage", dest="maxCloudPercentage",  default=0.05, type="float",
                           help="Only allow images with this percentage of cloud cover.")
+
+          parser.add_option("--cassette", dest="cassetteDir", default=None,
+                          help="Record Earth Engine responses in this folder and replay them on later runs.")
+
+          parser.add_option("--cassette-mode", dest="cassetteMode", default=None,
+                          choices=['record', 'replay', 'passthrough'],
+                          help="One of record (default), replay (never contact Earth Engine) or passthrough.")
           
           (options, args) = parser.parse_args(argsIn)
 
@@ -347,7 +356,7 @@ def main(argsIn):
     except optparse.OptionError, msg:
         raise Usage(msg)
 
-    cmt.ee_authenticate.initialize()
+    cmt.ee_authenticate.initialize(cassette_dir=options.cassetteDir, cassette_mode=options.cassetteMode)
 
     # Grab positional arguments
     outputFolder = args[0]
@@ -368,61 +377,60 @@ def main(argsIn):
     #  a SensorObservation object that we can feed into a domain
   
     print 'Loading sensors...'
-    modisSensor     = None
-    landsatSensor   = None
-    sentinel1Sensor = None
-    sensorList = []
-    
-    try:
-        #print 'Fetching MODIS data...'
+    cmt.util.ee_trace.set_stage('Loading sensors')
+
+    def loadModis():
         modisImage  = getCloudFreeModis(eeBounds, eeDate, options.searchRangeDays, options.maxCloudPercentage)
         modisSensor = cmt.domain.SensorObservation()
         modisSensor.init_from_image(modisImage, 'modis')
-        sensorList.append(modisSensor)
-        #print modisSensor   
-        #print 'Loaded MODIS sensor observation!'
-    except Exception as e:
-        print 'Unable to load a MODIS image in this date range!'
-        print str(e)
-    try:
-        #print 'Fetching Landsat data...'
+        return modisSensor
+    def loadLandsat():
         landsatImage  = getCloudFreeLandsat(eeBounds, eeDate, options.searchRangeDays, options.maxCloudPercentage)
         landsatName   = cmt.util.landsat_functions.get_landsat_name(landsatImage)
         landsatSensor = cmt.domain.SensorObservation()
         landsatSensor.init_from_image(landsatImage, landsatName)
-        sensorList.append(landsatSensor)
-        #print landsatSensor
-        #print 'Loaded Landsat sensor observation!'
-    except Exception as e:
-        print 'Unable to load a Landsat image in this date range!'
-        print str(e)
-    try:
-        #print 'Fetching Sentinel1 data...'
+        return landsatSensor
+    def loadSentinel1():
         sentinel1Image  = getNearestSentinel1(eeBounds, eeDate, options.searchRangeDays)
         sentinel1Sensor = cmt.domain.SensorObservation()
         sentinel1Sensor.init_from_image(sentinel1Image, 'sentinel1')
-        sensorList.append(sentinel1Sensor)
-        #print 'Loaded Sentinel1 sensor observation!'
-    except Exception as e:
-        print 'Unable to load a Sentinel1 image in this date range!'
-        print str(e)
-
-    # Add DEM data
-    # - TODO: Should this be a function?
-    demSensor = cmt.domain.SensorObservation()
-    if cmt.util.miscUtilities.regionIsInUnitedStates(eeBounds):
-        demName = 'ned13.xml'
-    else:
-        demName = 'srtm90.xml'
-    xmlPath = xmlPath = os.path.join(cmt.domain.SENSOR_SOURCE_DIR, demName)
-    demSensor.init_from_xml(xmlPath)
-    sensorList.append(demSensor)
+        return sentinel1Sensor
+    def loadDem():
+        # TODO: Should this be a function?
+        demSensor = cmt.domain.SensorObservation()
+        if cmt.util.miscUtilities.regionIsInUnitedStates(eeBounds):
+            demName = 'ned13.xml'
+        else:
+            demName = 'srtm90.xml'
+        xmlPath = os.path.join(cmt.domain.SENSOR_SOURCE_DIR, demName)
+        demSensor.init_from_xml(xmlPath)
+        return demSensor
+
+    def tryToLoad(loader):
+        '''Run one of the sensor loaders, a failure only loses that sensor'''
+        (name, function) = loader
+        try:
+            return function()
+        except Exception as e:
+            if name == 'DEM': # No DEM is a fatal error
+                raise
+            print 'Unable to load a ' + name + ' image in this date range!'
+            print str(e)
+            return None
+
+    # The sensor searches are independent so they are run concurrently on the shared
+    #  EE request pool, which keeps the total number of requests in flight bounded.
+    loaders = [('MODIS', loadModis), ('Landsat', loadLandsat), ('Sentinel1', loadSentinel1), ('DEM', loadDem)]
+    pool    = cmt.util.ee_request_pool.get_request_pool()
+    (modisSensor, landsatSensor, sentinel1Sensor, demSensor) = pool.map(tryToLoad, loaders)
+    sensorList = [s for s in [modisSensor, landsatSensor, sentinel1Sensor, demSensor] if s is not None]
 
     if not sensorList:
         print 'Unable to find any sensor data for this date/location!'
         return -1
 
 
+    cmt.util.ee_trace.set_stage('Loading domain')
     domainName = 'domain_' + dateString
     domain = cmt.domain.Domain()
     domain.load_sensor_observations(domainName, [minLon, minLat, maxLon, maxLat], sensorList)
@@ -434,6 +442,7 @@ def main(argsIn):
     print 'Best output resolution = ' + str(outputResolution)
 
     if options.saveInputs:
+        cmt.util.ee_trace.set_stage('Saving inputs')
         inputPathModis     = os.path.join(outputFolder, 'input_modis.tif'    )
         inputPathLandsat   = os.path.join(outputFolder, 'input_landsat.tif'  )
         inputPathSentinel1 = os.path.join(outputFolder, 'input_sentinel1.tif')
@@ -459,6 +468,7 @@ def main(argsIn):
 
 
     print 'Running flood detection!'
+    cmt.util.ee_trace.set_stage('Flood detection')
     (result, cloudCover) = detect_flood(domain)
     #print result.getInfo()
 
@@ -477,6 +487,7 @@ def main(argsIn):
 
     # Vectorize the binary result image
     print 'Extracting flood features...'
+    cmt.util.ee_trace.set_stage('Extracting features')
     resultFeatureInfo = getBinaryFeatures(result,     eeBounds, outputResolution)
     print '\nExtracting cloud features...'
     cloudFeatureInfo  = getBinaryFeatures(cloudCover, eeBounds, outputResolution)
@@ -44,6 +44,7 @@ import cmt.util.processManyLakes
 import cmt.modis.flood_algorithms
 import cmt.util.evaluation
 import cmt.util.miscUtilities
+import cmt.util.ee_trace
 from   cmt.util.processManyLakes import LakeDataLoggerBase
 import cmt.util.imageRetrievalFunctions
 
@@ -285,6 +286,7 @@ def processing_function(bounds, image, image_date, logger):
     rectBounds = cmt.util.miscUtilities.unComputeRectangle(bounds.bounds())
 
     # First check the input image for clouds.  If there are too many just raise an exception.
+    cmt.util.ee_trace.set_stage('Checking input image')
     cloudPercentage = cmt.modis.modis_utilities.getCloudPercentage(image, rectBounds)
     if cloudPercentage > MAX_CLOUD_PERCENTAGE:
         cmt.util.processManyLakes.addLakeToBadList(logger.getLakeName(), logger.getBaseDirectory(), image_date)
@@ -311,11 +313,13 @@ def processing_function(bounds, image, image_date, logger):
     waterMask = ee.Image("MODIS/MOD44W/MOD44W_005_2000_02_24").select(['water_mask'], ['b1'])
 
     # Pick a training image without clouds.  We just use the same lake one year in the past.
+    cmt.util.ee_trace.set_stage('Finding training image')
     dateOneYearPrior = eeDate.advance(-1.0, 'year')
     trainingImage    = imageRetrievalFunctions.getCloudFreeModis(dateOneYearPrior, MAX_CLOUD_PERCENTAGE)
+    training_date    = cmt.util.processManyLakes.get_image_date(trainingImage.getInfo())
 
     # Generate a pair of train/test domain files for this lake
-    training_date = cmt.util.processManyLakes.get_image_date(trainingImage.getInfo())
+    cmt.util.ee_trace.set_stage('Loading domains')
     testDomainPath, trainDomainPath = cmt.util.miscUtilities.writeDomainFilePair(logger.getLakeName(), bounds,
                                           ee.Date(image_date), ee.Date(training_date), logger.getLakeDirectory())
 
@@ -333,6 +337,7 @@ def processing_function(bounds, image, image_date, logger):
 
         try:
             print 'Running algorithm ' + algName
+            cmt.util.ee_trace.set_stage('Algorithm ' + algName)
             # Call function to generate the detected water map
             detectedWater = cmt.modis.flood_algorithms.detect_flood(fakeDomain, a[0])[1]
             # addToMap(detectedWater, {'min': 0, 'max': 1}, a[1], False)
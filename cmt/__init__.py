@@ -13,4 +13,11 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations under
 # the License.
-# -----------------------------------------------------------------------------
\ No newline at end of file
+# -----------------------------------------------------------------------------
+
+# Run against local GeoTIFF archives instead of the Earth Engine servers, this
+#  must happen before any other module imports ee.
+import os as _os
+if _os.environ.get('CMT_LOCAL_EE_DIR'):
+    import cmt.local_ee
+    cmt.local_ee.install(_os.environ['CMT_LOCAL_EE_DIR'])
@@ -18,10 +18,17 @@
 import os, sys
 import xml.etree.ElementTree as ET
 import ee
+import copy
 import json
+import functools
+import threading
 import traceback
 import util.miscUtilities
 import util.imageRetrievalFunctions
+import util.ee_batch
+import cmt.sensor_descriptor
+import cmt.util.ee_metadata_cache
+import cmt.util.ee_request_pool
 
 # Default search path for domain xml files: [root]/config/domains/[sensor_name]/
 DOMAIN_SOURCE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), \
@@ -31,6 +38,48 @@ DOMAIN_SOURCE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), \
 SENSOR_SOURCE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), \
         ".." + os.path.sep + "config" + os.path.sep + "sensors")
 
+# If set, the bands of a sensor are only checked when the sensor is first used instead of when it is
+#  loaded.  Either way all of the bands are checked with one combined request.
+# - In lazy mode a bad band raises at the first use of the sensor, possibly on another thread, so
+#   the error names the sensor and the XML file it was loaded from.
+LAZY_BAND_VALIDATION = os.environ.get('CMT_LAZY_BAND_VALIDATION', '') not in ['', '0']
+
+# Process wide caches of loaded sensors and domains, repeated loads of the same
+#  XML and bounds reuse the already validated objects instead of rebuilding them.
+_sensor_cache = dict()
+_domain_cache = dict()
+_cache_lock   = threading.Lock()
+
+def clear_caches():
+    '''Forget all of the loaded sensors and domains'''
+    with _cache_lock:
+        _sensor_cache.clear()
+        _domain_cache.clear()
+
+def _get_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+# Members which belong to one object and are never copied to or from the caches
+_UNSHARED_STATE = ['_band_lock']
+
+def _copy_state(state):
+    '''Copy an object's member dictionary so that its lists and dictionaries are not shared.
+       - The EE objects and SensorObservations inside are shared, they are not modified after loading.
+       - Locks are left out, each object keeps the one it was created with.'''
+    return dict([(k, copy.copy(v) if isinstance(v, (list, dict)) else v)
+                 for (k, v) in state.items() if k not in _UNSHARED_STATE])
+
+def _get_bounds_key(ee_bounds):
+    '''A hashable description of an EE geometry which does not require a round trip'''
+    if ee_bounds is None:
+        return None
+    if hasattr(ee_bounds, 'serialize'):
+        return ee_bounds.serialize()
+    return json.dumps(ee_bounds.getInfo(), sort_keys=True) # Local backend, no request needed
+
 
 
 class SensorObservation(object):
@@ -57,23 +106,81 @@ class SensorObservation(object):
         self._display_gains = None
         self._mask_info     = None
         self._band_sources  = dict() # Where to get each band from
-
-
-    def init_from_xml(self, xml_source=None, ee_bounds=None, is_domain_file=False, manual_ee_ID=None):
-        '''Initialize the object from XML data and the desired bounding box'''
+        self._xml_source    = None   # The XML file the sensor was loaded from, for error messages
+        self._band_lock     = threading.RLock() # Only one thread validates the bands
+
+    # The image and band list are only complete once the bands have been validated
+
+    @property
+    def image(self):
+        self._validate_bands()
+        return self._image
+
+    @image.setter
+    def image(self, value):
+        self._image = value
+
+    @property
+    def band_names(self):
+        self._validate_bands()
+        return self._band_names
+
+    @band_names.setter
+    def band_names(self, value):
+        self._band_names = value
+
+    def __getattr__(self, name):
+        '''In lazy mode the band member variables are set when the bands are validated'''
+        pending = self.__dict__.get('_pending_bands')
+        if pending and (name in [p[0] for p in pending]):
+            self._validate_bands()
+            if name in self.__dict__:
+                return self.__dict__[name]
+        raise AttributeError(name)
+
+
+    def init_from_xml(self, xml_source=None, ee_bounds=None, is_domain_file=False, manual_ee_ID=None,
+                      source_name=None):
+        '''Initialize the object from XML data and the desired bounding box
+           - source_name is the file named in band errors, it defaults to xml_source if that is a path.'''
                
         # xml_source can be a path to an xml file or a parsed xml object
         try:
-            xml_root = ET.parse(xml_source).getroot()
+            xml_root   = ET.parse(xml_source).getroot()
+            source_key = (os.path.realpath(xml_source), _get_mtime(xml_source))
+            if source_name is None:
+                source_name = xml_source
         except:
-            xml_root = xml_source
+            xml_root   = xml_source
+            source_key = ET.tostring(xml_root)
+
+        # Reuse the sensor if it was already loaded from the same XML with the same bounds
+        key = (source_key, _get_bounds_key(ee_bounds), is_domain_file, manual_ee_ID,
+               self._get_sensor_file_mtime(xml_root))
+        with _cache_lock:
+            state = _sensor_cache.get(key)
+        if state is not None:
+            self.__dict__.update(_copy_state(state))
+            self._xml_source = source_name
+            return
 
         # Parse the xml file to fill in the class variables
+        self._xml_source = source_name
         self._load_xml(xml_root, is_domain_file, manual_ee_ID)
         
         # Set up the EE image object using the band information
         self._load_image(ee_bounds)
 
+        with _cache_lock:
+            _sensor_cache[key] = _copy_state(self.__dict__)
+
+    def _get_sensor_file_mtime(self, xml_root):
+        '''Modification time of the sensor definition file that goes with an XML node'''
+        name = xml_root.find('name')
+        if name is None:
+            return None
+        return _get_mtime(os.path.join(SENSOR_SOURCE_DIR, name.text.lower() + '.xml'))
+
     def init_from_image(self, ee_image, sensor_name):
         '''Init from an already loaded Earth Engine Image'''
         self.sensor_name = sensor_name
@@ -115,185 +222,72 @@ class SensorObservation(object):
         else:
             return None
 
-    def _loadPieceOfSourceInfo(self, source_band, info_name, dictionary):
-        '''Helper function - Look for and load source info about a band'''
-        result = source_band.find(info_name)
-        if result != None:
-            dictionary[info_name] = result.text
-
-    def _load_source(self, source_element):
-        '''load a data source for a band or mask, represented by the <source> tag.'''
-        # A source is stored like this: {'mosaic', 'source', 'eeid'}
-        d = dict()
-        source_band = source_element.find('source')
-        if source_band == None:
-            return d # Source not specified, leave the dictionary empty!
-            
-        # if it's a mosaic, combine the images in an EE ImageCollection
-        mosaic = source_band.get('mosaic')
-        if mosaic != None:
-            if mosaic.lower() == 'true':
-                d['mosaic'] = True
-            elif mosaic.lower() == 'false':
-                d['mosaic'] = False
-            else:
-                raise Exception('Unexpected value of mosaic, %s.' % (source_band.get('mosaic')))
-            
-        # The name of the band in the source data, maybe not what we will call it in the output image.
-        name = source_band.find('name')
-        if name != None:
-            # the name of the band in the original image
-            d['source'] = name.text
-
-        # Load more information about the band source
-        self._loadPieceOfSourceInfo(source_band, 'eeid',       d) # The id of the image to load, if a single image.
-        self._loadPieceOfSourceInfo(source_band, 'collection', d) # The ImageCollection name of the data, if any.
-        self._loadPieceOfSourceInfo(source_band, 'start_date', d)    # Start and end dates used to filter an ImageCollection.
-        self._loadPieceOfSourceInfo(source_band, 'end_date',   d)
-
-        return d
-
-    def _load_distribution(self, root):
-        '''load a probability distribution into a python dictionary, which may, for
-            example, represent the expected distribution of water pixels'''
-        d     = dict()
-        model = root.find('model')
-        if model != None:
-            d['model'] = model.text
-        mode = root.find('mode')
-        if mode != None:
-            d['mode'] = dict()
-            if mode.find('range') != None:
-                (d['mode']['min'], d['mode']['max']) = self._load_range(mode.find('range'))
-        r = root.find('range')
-        if r != None:
-            d['range'] = self._load_range(r)
-        b = root.find('buckets')
-        if b != None:
-            try:
-                d['buckets'] = int(b.text)
-            except:
-                raise Exception('Buckets in distribution must be integer.')
-            
-        #print 'Created water distribution: '
-        #print d
-            
-        return d
-
-    def _load_bands(self, root_element, manual_ee_ID=None):
-        '''Read the band specification and load it into _band_sources and _mask_source.
+    def _apply_descriptor(self, descriptor, manual_ee_ID=None):
+        '''Merge a compiled <sensor> description into the band information.
             Does not load the bands'''
-        # Look for default water distribution info at the top level
-        default_water = dict()
-        for d in root_element.findall('distribution'):
-            if d.get('name').lower() == 'water':
-                default_water = self._load_distribution(d)
-
-        # Read bands, represented by <band> tag
-        bands = root_element.find('bands')
-        if bands == None:
+        if descriptor.minimum_value != None:
+            self.minimum_value = descriptor.minimum_value
+        if descriptor.maximum_value != None:
+            self.maximum_value = descriptor.maximum_value
+        if descriptor.log_scale != None:
+            self.log_scale = descriptor.log_scale
+
+        if not descriptor.has_bands:
             return # Nothing to do if no bands tag!
-        
-        # Look for display bands at the top band level
-        display_bands = bands.find('display_bands')
-        if display_bands != None:
-            display_band_list = display_bands.text.replace(' ','').split(',') # The band names are comma seperated
-            if len(display_band_list) > 3:
-                raise Exception('Cannot have more than three display bands!')
-            self._display_bands = display_band_list
-
-        # Looks for display band gains at the top level
-        display_gains = bands.find('display_gains')
-        if display_gains != None:
-            display_gain_list = display_gains.text.split(',') # The band names are comma seperated
-            if len(display_gain_list) > 3:
-                raise Exception('Cannot have more than three display band gains!')
-            self._display_gains = display_gain_list
 
+        if descriptor.display_bands != None:
+            self._display_bands = list(descriptor.display_bands)
+        if descriptor.display_gains != None:
+            self._display_gains = list(descriptor.display_gains)
 
         # Shared information (e.g., all bands have same eeid) is loaded directly in <bands>
-        default_source = self._load_source(bands) # Located in <bands><source>
+        default_source = descriptor.get_default_source()
         if manual_ee_ID: # Set manual EEID if it was passed in
             default_source['eeid'] = manual_ee_ID
         # If any bands are already loaded (meaning we are in the domain file), apply this source info to them.
-        for b in self.band_names:  
+        for b in self.band_names:
             self._band_sources[b].update(default_source)
         if self._mask_info != None:
             self._mask_info.update(default_source)
-        resolution = bands.find('resolution')
-        if resolution != None: # <bands><resolution>
-            default_resolution = float(resolution.text)
-        else:
-            default_resolution = 10 # Default resolution is 10 meters if not specified!
+        default_resolution = descriptor.default_resolution
+        if default_resolution == None:
+            default_resolution = cmt.sensor_descriptor.DEFAULT_RESOLUTION
 
-
-        # load individual <band> tags
-        for b in bands.findall('band'):
-            try:
-                name = b.find('name').text
-            except:
-                raise Exception('Unnamed band.')
-            #print 'Getting info for band: ' + name
+        default_water = descriptor.get_default_water()
+        for band in descriptor.bands:
+            name = band.name
             if name not in self.band_names: # Only append each band name once
                 self.band_names.append(name)
             if name not in self._band_sources: # Only append each band source once
                 self._band_sources[name] = dict()
             self._band_sources[name].update(default_source) # Start with the default source information
-            self._band_sources[name].update(self._load_source(b)) # Band source information is stored like: {'mosaic', 'source', 'eeid'}
+            self._band_sources[name].update(band.get_source()) # Band source information is stored like: {'mosaic', 'source', 'eeid'}
 
-            #print 'Source for this band = '
-            #print str(self._band_sources[name])
-
-            # Look for water distribution information in this band
+            # Water distribution information for this band
             if name not in self.water_distributions:
                 self.water_distributions[name] = dict()
-            self.water_distributions[name].update(default_water)
-            for d in b.findall('distribution'):
-                if d.get('name').lower() == 'water':
-                    self.water_distributions[name].update(self._load_distribution(d))
-                    
-            # Load resolution for this band
-            resolution = b.find('resolution')
-            if resolution != None:
-                self.band_resolutions[name] = float(resolution.text)
+            self.water_distributions[name].update(copy.deepcopy(default_water))
+            self.water_distributions[name].update(band.get_water())
+
+            if band.resolution != None:
+                self.band_resolutions[name] = band.resolution
             else:
                 self.band_resolutions[name] = default_resolution
-            #print 'For band name ' + name + ' found resolution = ' + str(self.band_resolutions[name])
-                
-                    
-        # read mask, in <mask> tag
-        mask = bands.find('mask')
+
+        mask = descriptor.get_mask()
         if mask != None:
             if self._mask_info == None:
                 self._mask_info = dict()
-            if mask.get('self') == 'true': # Self mask means that zero-valued pixels in the source will be masked out.
-                self._mask_info['self'] = True
-            else: # Otherwise there must be an external source
-                self._mask_info['self'] = False
-                source = mask.find('source')
-                if source == None: # Read in source information about the mask
-                    raise Exception('Mask specified with no source!')
-                else:
-                    self._mask_info.update(self._load_source(mask))
-
-
-    def _getSourceBandName(self, source, image):
-        '''Automatically determines the source band from an image even if one was not specified'''
-        if 'source' in source: # Source band name was specified
-            return source['source']
-        if len(image.getInfo()['bands']) == 1: # Only one input band, just use it.
-            name = image.getInfo()['bands'][0]['id']
-            return name
-        raise Exception('Missing band name for source: ' + str(source))
-            
+            self._mask_info.update(mask)
 
     def _load_image(self, eeBounds):
         '''given band specifications in _band_sources and _mask_source, load them into self.image'''
         # This is setting up an EE object, not actually downloading any data from the web.
         
-        # Load the bands, combine into image
+        # Set up the source image for each band
         missingBands = []
-        for thisBandName in self.band_names:
+        sourceImages = []
+        for thisBandName in self._band_names:
             source       = self._band_sources[thisBandName]
             #print '======================================='
             print 'Loading band: ' + thisBandName
@@ -319,10 +313,8 @@ class SensorObservation(object):
                 else:
                     collection = ee.ImageCollection(source['collection']).filterBounds(eeBounds).filterDate(source['start_date'], source['end_date'])
                 
-                numFound = collection.size().getInfo()
-                if numFound == 0:
-                    raise Exception('Did not find any images for collection ' + source['collection'])
                 # Take the average across all images that we found.
+                # - An empty collection is detected when the bands are validated.
                 im = collection.mean()
                 
                 # TODO: Add special case for Sentinel1 to filter on available bands?
@@ -334,34 +326,107 @@ class SensorObservation(object):
                 missingBands.append(thisBandName)
                 continue # Skip this band
                 
-            #print 'Image info:'
-            #try:
-            #    #print util.miscUtilities.prettyPrintEE(im.getInfo())
-            #    print im.getInfo()
-            #except:
-            #    raise Exception('Failed to retrieve image info!')
-            
-            sourceBandName = self._getSourceBandName(source, im)
-            band = im.select([sourceBandName], [thisBandName])
+            sourceImages.append((thisBandName, source, im))
+
+        for band in missingBands:
+            self._band_names.remove(band)
+
+        # Checking the bands is deferred until they are used in lazy mode
+        self._pending_bands = sourceImages
+        if not LAZY_BAND_VALIDATION:
+            self._validate_bands()
+
+    def _fetch_source_band_names(self, sourceImages):
+        '''Returns the list of band names in each source image, or the exception raised fetching them.
+           - All of the lists are fetched in a single request, or taken from the metadata cache.'''
+        cache   = cmt.util.ee_metadata_cache.get_metadata_cache()
+        batch   = util.ee_batch.EeBatch()
+        lookups = dict() # Each distinct source image is only requested once
+        results = []
+        for (thisBandName, source, im) in sourceImages:
+            key = im.serialize() if hasattr(im, 'serialize') else id(im)
+            if key not in lookups:
+                known = cache.get(im, 'band_names')
+                if known and (source.get('source') in known or (('source' not in source) and len(known) == 1)):
+                    lookups[key] = known # Bands never disappear, but a missing band may have been added
+                else:
+                    lookups[key] = batch.add(im.bandNames())
+            results.append(lookups[key])
+        batch.execute()
+
+        newBandNames = []
+        for (i, (thisBandName, source, im)) in enumerate(sourceImages):
+            if isinstance(results[i], util.ee_batch.EeFuture):
+                future = results[i]
+                if future.exception() is not None:
+                    results[i] = future.exception()
+                else:
+                    results[i] = future.result()
+                    if results[i]: # Don't record empty collections
+                        newBandNames.append((im, 'band_names', results[i]))
+        cache.set_many(newBandNames)
+        return results
+
+    def _validate_bands(self):
+        '''Make sure that each band exists in its source image and build self.image from the ones that do
+           - The results are only stored once all of the bands were checked, so if this raises
+             the bands are checked again on the next call.
+           - Errors name the sensor and its XML file since in lazy mode they are raised far from the load call.'''
+        if '_pending_bands' not in self.__dict__: # Already done
+            return
+        with self._band_lock:
+            sourceImages = self.__dict__.get('_pending_bands')
+            if sourceImages is None: # Another thread finished while we waited
+                return
             try:
-                #print 'band:'
-                temp = band.getInfo()
-            except:
-                print 'Failed to retrieve band, marked as missing.'
+                (image, band_names, band_members) = self._build_image(sourceImages)
+            except Exception as e:
+                message = ('Failed to load the bands of sensor ' + self.sensor_name + ' from '
+                           + str(self._xml_source or 'an XML node') + ': ' + str(e))
+                raise Exception(message), None, sys.exc_info()[2]
+            self.__dict__.update(band_members)
+            self._band_names = band_names
+            self._image      = image
+            del self.__dict__['_pending_bands']
+
+    def _build_image(self, sourceImages):
+        '''Returns (image, band names, band member variables) for the bands which could be loaded'''
+        image        = self._image
+        band_members = dict()
+        missingBands = []
+        for ((thisBandName, source, im), available) in zip(sourceImages, self._fetch_source_band_names(sourceImages)):
+            if isinstance(available, Exception):
+                print 'Failed to retrieve band ' + thisBandName + ', marked as missing.'
                 missingBands.append(thisBandName)
                 continue
-                
-            if self.image == None:
-                self.image = band
+            if (not available) and ('collection' in source):
+                raise Exception('Did not find any images for collection ' + source['collection'])
+
+            # Automatically determine the source band if one was not specified
+            if 'source' in source:
+                sourceBandName = source['source']
+            elif len(available) == 1: # Only one input band, just use it.
+                sourceBandName = available[0]
+            else:
+                raise Exception('Missing band name for source: ' + str(source))
+            if sourceBandName not in available:
+                print 'Failed to retrieve band ' + thisBandName + ', marked as missing.'
+                missingBands.append(thisBandName)
+                continue
+
+            band = im.select([sourceBandName], [thisBandName])
+            if image == None:
+                image = band
             else:
-                self.image = self.image.addBands(band)
+                image = image.addBands(band)
             # set band as member variable, e.g., self.__dict__['hv'] is equivalent to self.hv
-            self.__dict__[thisBandName] = band
+            band_members[thisBandName] = band
         # If any bands failed to load, remove them from the band list!
+        band_names = list(self._band_names)
         for band in missingBands:
-            self.band_names.remove(band)
+            band_names.remove(band)
             
-        if self.image == None:
+        if image == None:
             raise Exception('Failed to load any bands for image!')
             
         #print '---------------------------'
@@ -370,9 +435,9 @@ class SensorObservation(object):
         # Apply mask once all the bands are loaded
         if self._mask_info != None:
             if ('self' in self._mask_info) and self._mask_info['self']:
-                self.image = self.image.mask(self.image) # Apply self-mask
+                image = image.mask(image) # Apply self-mask
             elif 'eeid' in self._mask_info: # Apply a mask from an external source
-                self.image = self.image.mask(ee.Image(self._mask_info['eeid']).select([self._mask_info['source']], ['b1']))
+                image = image.mask(ee.Image(self._mask_info['eeid']).select([self._mask_info['source']], ['b1']))
             else:
                 raise Exception('Not enough mask information specified!')
 
@@ -380,29 +445,12 @@ class SensorObservation(object):
         #if self.minimum_value == None or  self.maximum_value == None:
         #    raise Exception('Minimum and maximum value not specified.')
         if (self.minimum_value != None) and (self.maximum_value != None):
-            self.image = self.image.clamp(self.minimum_value, self.maximum_value)
+            image = image.clamp(self.minimum_value, self.maximum_value)
 
         #print '>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>'
         #print self.image.getInfo()
         #print '\n\n\n'
-
-    def _load_range(self, tag):
-        '''read a <range> tag'''
-        a = None
-        b = None
-        if tag != None:
-            try:
-                a = tag.find('minimum').text
-                b = tag.find('maximum').text
-                try:
-                    a = int(a)
-                    b = int(b)
-                except:
-                    a = float(a)
-                    b = float(b)
-            except:
-                raise Exception('Failed to load range tag.')
-        return (a, b)
+        return (image, band_names, band_members)
 
     def _load_sensor_xml_file(self, sensor_name, manual_ee_ID=None):
         '''Find and load the dedicated sensor XML file'''
@@ -411,40 +459,21 @@ class SensorObservation(object):
         sensor_xml_path = os.path.join(SENSOR_SOURCE_DIR, sensor_name + ".xml")
         if not os.path.exists(sensor_xml_path):
             raise Exception('Could not find sensor file: ' + sensor_xml_path)
-        # Load the XML and recursively call this function to parse it
-        xml_root = ET.parse(sensor_xml_path).getroot()
-        self._load_xml(xml_root, False, manual_ee_ID)
-        #print 'Finished loading sensor file -----------------------'
+        # The sensor files are only parsed once per process
+        descriptor = cmt.sensor_descriptor.get_sensor_descriptor(sensor_xml_path)
+        self.sensor_name = descriptor.name
+        self._apply_descriptor(descriptor, manual_ee_ID)
 
     def _load_xml(self, xml_root, isDomainFile=False, manual_ee_ID=None):
         '''Parse an xml document representing a domain or a sensor'''
 
-        if (xml_root.tag != "sensor"):
-            raise Exception("Sensor XML file required!")
-
-        # Read the sensor name
-        name = xml_root.find('name')
-        if name == None:
-            raise Exception('Sensor name not found!')
-        self.sensor_name = name.text.lower()
+        descriptor = cmt.sensor_descriptor.compile_sensor(xml_root)
+        self.sensor_name = descriptor.name
 
         if isDomainFile: # Load the matching sensor XML file first
-            self._load_sensor_xml_file(self.sensor_name, manual_ee_ID)
-
-        # Search for the min and max values of the sensor
-        (a, b) = self._load_range(xml_root.find('range'))
-        if a != None:
-            self.minimum_value = a
-        if b != None:
-            self.maximum_value = b
-        
-        # If scaling tag with type log10 present, take the log of the image
-        scale = xml_root.find('scaling')
-        if scale != None:
-            self.log_scale = (scale.get('type') == 'log10')
-        
-        # Read data about all the bands
-        self._load_bands(xml_root, manual_ee_ID)
+            self._load_sensor_xml_file(descriptor.name, manual_ee_ID)
+
+        self._apply_descriptor(descriptor, manual_ee_ID)
 
     
     def visualize(self, params = {}, name = None, show=True):
@@ -498,7 +527,7 @@ class Domain(object):
     '''A class representing a problem domain. Loads sensor and location
         information from an xml file. Default information may be specified in a
         file specific to a sensor type, which can be overridden.'''
-    def __init__(self):
+    def __init__(self, xml_file=None, is_training=False):
         
         self.name              = 'Unnamed' # The name assigned to the domain.
         self.bbox              = None      # Bounding box of the domain.
@@ -510,10 +539,14 @@ class Domain(object):
         self.training_features = None      # Training features in EE classifier format
         self.algorithm_params  = {}        # Dictionary of algorithm parameters
         self.sensor_list       = []        # Contains a SensorObservation object for each related sensor.
+        self._source_mtimes    = dict()    # Modification times of the files the domain was loaded from
         
         # You can also access each sensor as a member variable, e.g. self.uavsar
         #   gives access to the sensor named 'uavsar'
 
+        if xml_file:
+            self.load_xml(xml_file, is_training)
+
 
     def __str__(self):
         '''Generate a string overview of the domain'''
@@ -579,7 +612,17 @@ class Domain(object):
 
 
     def load_xml(self, xml_file, is_training=False):
-        '''Load an xml file representing a domain or a sensor'''
+        '''Load an xml file representing a domain or a sensor.
+           - Domains already loaded by this process are reused unless one of their files changed.'''
+
+        key = (os.path.realpath(xml_file), is_training)
+        with _cache_lock:
+            entry = _domain_cache.get(key)
+        if entry and all([_get_mtime(path) == mtime for (path, mtime) in entry['_source_mtimes'].items()]):
+            self.__dict__.update(_copy_state(entry))
+            return
+        self._source_mtimes = {xml_file: _get_mtime(xml_file)}
+
         #print 'Reading file: ' + xml_file
         tree = ET.parse(xml_file)
         root = tree.getroot()
@@ -600,6 +643,10 @@ class Domain(object):
         
         sensor_domain_folder = os.path.dirname(xml_file) # Look in the same directory as the primary xml file
         
+        # The training domains and the sensors are independent, so they are all loaded
+        #  concurrently on the shared EE request pool.
+        tasks = dict()
+
         if not is_training:
             # Try to load the training domain
             training_domain = root.find('training_domain')
@@ -607,16 +654,14 @@ class Domain(object):
                 training_file_xml_path = os.path.join(sensor_domain_folder, training_domain.text + '.xml')
                 if not os.path.exists(training_file_xml_path):
                     raise Exception('Training file not found: ' + training_file_xml_path)
-                self.training_domain = Domain()
-                self.training_domain.load_xml(training_file_xml_path, True)
+                tasks['training_domain'] = functools.partial(Domain, training_file_xml_path, True)
             
             unflooded_training_domain = root.find('unflooded_training_domain')
             if unflooded_training_domain != None:
                 training_file_xml_path = os.path.join(sensor_domain_folder, unflooded_training_domain.text + '.xml')
                 if not os.path.exists(training_file_xml_path):
                     raise Exception('Training file not found: ' + training_file_xml_path)
-                self.unflooded_domain = Domain()
-                self.unflooded_domain.load_xml(training_file_xml_path, True)
+                tasks['unflooded_domain'] = functools.partial(Domain, training_file_xml_path, True)
                 
             # Load any algorithm params
             algorithm_params = root.find('algorithm_params')
@@ -638,23 +683,29 @@ class Domain(object):
             raise Exception('Must have at least one sensor for the domain!')
         
         # Load each <sensor> tag seperately
-        for sensor_node in sensors.findall('sensor'):
-            try:
-                # Send the sensor node of the domain file for parsing
-                newSensor = SensorObservation()
-                newSensor.init_from_xml(xml_source=sensor_node, ee_bounds=self.bounds, is_domain_file=True) 
-                self.sensor_list.append(newSensor)   # Store the new sensor object
-                
-                # Set sensor as member variable, e.g., self.__dict__['uavsar'] is equivalent to self.uavsar
-                self.__dict__[newSensor.sensor_name] = newSensor
-                
-                print 'Loaded sensor: ' + newSensor.sensor_name
-                
-            except:
-                print '###############################################'
-                print 'Caught exception loading sensor:'
-                print traceback.format_exc()
-                print '###############################################'
+        sensor_nodes = sensors.findall('sensor')
+        for (i, sensor_node) in enumerate(sensor_nodes):
+            tasks[i] = functools.partial(self._load_sensor_node, sensor_node, xml_file)
+
+        keys    = tasks.keys()
+        pool    = cmt.util.ee_request_pool.get_request_pool()
+        results = dict(zip(keys, pool.map(lambda k: tasks[k](), keys)))
+
+        for name in ['training_domain', 'unflooded_domain']:
+            if name in results:
+                self.__dict__[name] = results[name]
+                self._source_mtimes.update(results[name]._source_mtimes)
+
+        for i in range(len(sensor_nodes)): # Keep the order of the domain file
+            newSensor = results[i]
+            if newSensor is None: # Failed to load
+                continue
+            self.sensor_list.append(newSensor)   # Store the new sensor object
+            
+            # Set sensor as member variable, e.g., self.__dict__['uavsar'] is equivalent to self.uavsar
+            self.__dict__[newSensor.sensor_name] = newSensor
+            sensor_xml_path = os.path.join(SENSOR_SOURCE_DIR, newSensor.sensor_name + '.xml')
+            self._source_mtimes[sensor_xml_path] = _get_mtime(sensor_xml_path)
                 
 
         # Load a ground truth image if one was specified
@@ -667,6 +718,25 @@ class Domain(object):
             else:
                 self.ground_truth = ee.Image(truth_section.text).select(['b1']).clamp(0, 1)
 
+        with _cache_lock:
+            _domain_cache[key] = _copy_state(self.__dict__)
+
+
+    def _load_sensor_node(self, sensor_node, xml_file=None):
+        '''Load the sensor for a <sensor> tag in xml_file, returns None if it could not be loaded'''
+        try:
+            # Send the sensor node of the domain file for parsing
+            newSensor = SensorObservation()
+            newSensor.init_from_xml(xml_source=sensor_node, ee_bounds=self.bounds, is_domain_file=True,
+                                    source_name=xml_file)
+            print 'Loaded sensor: ' + newSensor.sensor_name
+            return newSensor
+        except:
+            print '###############################################'
+            print 'Caught exception loading sensor:'
+            print traceback.format_exc()
+            print '###############################################'
+            return None
 
     def _load_bbox(self, root):
         '''read a bbox, <bbox>'''
@@ -688,6 +758,7 @@ class Domain(object):
         
         # Load the input file
         json_file_path = os.path.join(sensor_domain_folder, json_file_name.text + '.json')
+        self._source_mtimes[json_file_path] = _get_mtime(json_file_path)
         print 'Loading JSON training data: ' + json_file_path
         with open(json_file_path, 'r') as f:
             feature_dict = json.load(f)
@@ -18,6 +18,9 @@
 import ee
 import signal
 
+import cmt.util.ee_cassette
+import cmt.util.ee_trace
+
 from os.path import expanduser
 
 
@@ -25,8 +28,18 @@ __MY_ACCOUNT_FILE = expanduser('~/.local/google_service_account.txt')
 #__MY_PRIVATE_KEY_FILE = expanduser('~/.local/google_service_api_private_key.p12')
 __MY_PRIVATE_KEY_FILE = expanduser('~/.local/google_service_api_private_key.pem')
 
-def initialize(account=None, key_file=None):
-    '''Initialize the Earth Engine object, using your authentication credentials.'''
+def initialize(account=None, key_file=None, cassette_dir=None, cassette_mode=None):
+    '''Initialize the Earth Engine object, using your authentication credentials.
+       - Responses are recorded or replayed if a cassette is given here or in the environment.'''
+
+    cassette = None
+    if hasattr(ee, 'data'): # Not needed with the local backend
+        cassette = cmt.util.ee_cassette.install_default(cassette_dir, cassette_mode)
+        cmt.util.ee_trace.install_default() # Times every request if CMT_EE_TRACE is set
+    if cassette and (cassette.mode == 'replay'): # Every response comes from disk
+        ee.Initialize(None)
+        return
+
     try:
         ee.Initialize()
     except:
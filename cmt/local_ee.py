@@ -0,0 +1,1268 @@
+# -----------------------------------------------------------------------------
+# Copyright * 2014, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration. All
+# rights reserved.
+#
+# The Crisis Mapping Toolkit (CMT) v1 platform is licensed under the Apache
+# License, Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+# -----------------------------------------------------------------------------
+
+import os
+import re
+import sys
+import json
+import math
+import calendar
+import datetime
+import warnings
+import collections
+
+import numpy
+import scipy.ndimage
+
+'''
+A local stand-in for part of the Earth Engine API used by the toolkit.
+
+Images are NumPy rasters loaded from GeoTIFFs and every operation is computed
+immediately on the CPU, so algorithms written against ee.Image / ee.Reducer can
+run offline on archived scenes and be profiled without any quota.
+
+Classifiers, ee.Feature / ee.FeatureCollection, ee.Algorithms, ee.Terrain,
+joins, and the Image methods expression, neighborhoodToBands, glcmTexture,
+derivative, atan, reduceResolution and sampleRegions are not implemented.  The
+README lists which flood detection algorithms run with this backend.
+
+Set CMT_LOCAL_EE_DIR to an archive folder before importing cmt and this module
+is used everywhere in place of the ee package, or call install() directly.
+Earth Engine IDs are looked up in the archive folder:
+
+    <archive>/<ee id>.tif          A single image, bands are named b1, b2, ...
+    <archive>/<ee id>/<band>.tif   A single image stored as one file per band
+    <archive>/<ee id>/*            An image collection, one image per .tif or folder
+
+An optional .json file next to an image (or properties.json inside an image
+folder) can hold {"bands": [...], "properties": {...}}, for example to set the
+"system:time_start" property used by filterDate.  Georeferencing is read from a
+.tfw world file or from the GeoTIFF tags.  All of the images used together in
+one computation must be on the same pixel grid.
+'''
+
+# Archive folder used to resolve Earth Engine IDs
+ARCHIVE_DIR = os.environ.get('CMT_LOCAL_EE_DIR')
+
+# Number of buckets used by Reducer.histogram() when maxBuckets is not given
+DEFAULT_HISTOGRAM_BUCKETS = 256
+
+METERS_PER_DEGREE = 111320.0
+
+_registered_images      = dict()
+_registered_collections = dict()
+
+
+class EEException(Exception):
+    '''Raised for errors in the local backend, in place of ee.EEException'''
+    pass
+
+def Initialize(*args, **kwargs):
+    '''Nothing to connect to'''
+    pass
+
+def _get_info(value):
+    '''Convert a local object or a container of them to plain Python values'''
+    if hasattr(value, 'getInfo'):
+        return value.getInfo()
+    if isinstance(value, (list, tuple)):
+        return [_get_info(v) for v in value]
+    if isinstance(value, dict):
+        return dict([(k, _get_info(v)) for (k, v) in value.items()])
+    if isinstance(value, numpy.generic):
+        return value.item()
+    return value
+
+
+#=================================================================================
+# Simple computed values
+
+class ComputedObject(object):
+    '''Base class for local values, getInfo() just returns the value'''
+
+    def __init__(self, value=None):
+        self._value = value
+
+    def getInfo(self):
+        return _get_info(self._value)
+
+    def __str__(self):
+        return '%s(%s)' % (self.__class__.__name__, str(self.getInfo()))
+
+class Number(ComputedObject):
+
+    def __init__(self, value):
+        ComputedObject.__init__(self, _get_info(value))
+
+    def add(self, other):
+        return Number(self._value + _get_info(other))
+    def subtract(self, other):
+        return Number(self._value - _get_info(other))
+    def multiply(self, other):
+        return Number(self._value * _get_info(other))
+    def divide(self, other):
+        return Number(self._value / float(_get_info(other)))
+
+class List(ComputedObject):
+
+    def __init__(self, items):
+        if isinstance(items, List):
+            items = items._value
+        ComputedObject.__init__(self, list(items))
+
+    def get(self, index):
+        return self._value[_get_info(index)]
+
+    def size(self):
+        return Number(len(self._value))
+    length = size
+
+    def map(self, function):
+        return List([function(x) for x in self._value])
+
+class Dictionary(ComputedObject):
+
+    def __init__(self, values=None):
+        if isinstance(values, Dictionary):
+            values = values._value
+        ComputedObject.__init__(self, dict(values or {}))
+
+    def get(self, key):
+        return self._value[_get_info(key)]
+
+    def keys(self):
+        return List(sorted(self._value.keys()))
+
+
+class Date(ComputedObject):
+    '''A UTC time stored as milliseconds since the epoch'''
+
+    _FORMATS = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%Y']
+
+    def __init__(self, value):
+        value = _get_info(value)
+        if isinstance(value, dict): # getInfo() output of another date
+            value = value['value']
+        if isinstance(value, basestring):
+            for f in self._FORMATS:
+                try:
+                    value = calendar.timegm(datetime.datetime.strptime(value, f).utctimetuple()) * 1000
+                    break
+                except ValueError:
+                    continue
+            else:
+                raise EEException('Unable to parse date: ' + value)
+        ComputedObject.__init__(self, int(value))
+
+    @staticmethod
+    def parse(date_format, date_string):
+        '''Only ISO style date strings are supported, the format is ignored'''
+        return Date(date_string)
+
+    def _to_datetime(self):
+        return datetime.datetime.utcfromtimestamp(self._value / 1000.0)
+
+    def millis(self):
+        return Number(self._value)
+
+    def advance(self, delta, unit):
+        delta = _get_info(delta)
+        if unit in ['year', 'month']:
+            d      = self._to_datetime()
+            months = d.month - 1 + int(delta * (12 if unit == 'year' else 1))
+            (year, month) = (d.year + months // 12, months % 12 + 1)
+            d      = d.replace(year=year, month=month, day=min(d.day, calendar.monthrange(year, month)[1]))
+            return Date(calendar.timegm(d.utctimetuple()) * 1000)
+        seconds = {'week': 604800, 'day': 86400, 'hour': 3600, 'minute': 60, 'second': 1}[unit]
+        return Date(self._value + delta * seconds * 1000)
+
+    def format(self, date_format=None):
+        return ComputedObject(self._to_datetime().strftime('%Y-%m-%dT%H:%M:%S'))
+
+    def getInfo(self):
+        return {'type': 'Date', 'value': self._value}
+
+
+#=================================================================================
+# Geometry
+
+class Geometry(ComputedObject):
+    '''A GeoJSON Point or Polygon in longitude and latitude'''
+
+    def __init__(self, geo_json):
+        if isinstance(geo_json, Geometry):
+            geo_json = geo_json._value
+        ComputedObject.__init__(self, {'type': geo_json['type'], 'coordinates': _get_info(geo_json['coordinates'])})
+
+    @staticmethod
+    def Point(*coords):
+        if len(coords) == 1:
+            coords = coords[0]
+        return Geometry({'type': 'Point', 'coordinates': list(_get_info(coords))})
+
+    @staticmethod
+    def Rectangle(*coords):
+        coords = _get_info(list(coords))
+        if len(coords) == 1: # A single list of coordinates
+            coords = coords[0]
+        if len(coords) == 2: # Two corner points
+            coords = list(coords[0]) + list(coords[1])
+        (x0, y0, x1, y1) = coords
+        return Geometry({'type': 'Polygon', 'coordinates': [[[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]]})
+
+    @staticmethod
+    def Polygon(coords):
+        coords = _get_info(coords)
+        if not isinstance(coords[0][0], (list, tuple)): # A single ring
+            coords = [coords]
+        return Geometry({'type': 'Polygon', 'coordinates': coords})
+
+    def type(self):
+        return ComputedObject(self._value['type'])
+
+    def coordinates(self):
+        return List(self._value['coordinates'])
+
+    def _get_points(self):
+        if self._value['type'] == 'Point':
+            return [self._value['coordinates']]
+        return self._value['coordinates'][0]
+
+    def _get_bbox(self):
+        '''Returns (min lon, min lat, max lon, max lat)'''
+        points = numpy.array(self._get_points(), dtype=numpy.float64)
+        return (points[:,0].min(), points[:,1].min(), points[:,0].max(), points[:,1].max())
+
+    def bounds(self):
+        return Geometry.Rectangle(self._get_bbox())
+
+    def centroid(self):
+        (x0, y0, x1, y1) = self._get_bbox()
+        return Geometry.Point((x0 + x1) / 2.0, (y0 + y1) / 2.0)
+
+    def _contains_points(self, lons, lats):
+        '''Even-odd test of which points are inside the outer ring of the polygon'''
+        inside = numpy.zeros(lons.shape, dtype=bool)
+        ring   = self._get_points()
+        for i in range(len(ring)):
+            (x0, y0) = ring[i - 1]
+            (x1, y1) = ring[i]
+            if y0 == y1:
+                continue
+            crosses = (lats >= min(y0, y1)) & (lats < max(y0, y1))
+            x_at    = x0 + (lats - y0) * (x1 - x0) / float(y1 - y0)
+            inside ^= crosses & (lons < x_at)
+        return inside
+
+    def toGeoJSON(self):
+        return self.getInfo()
+
+    def toGeoJSONString(self):
+        return json.dumps(self.getInfo())
+
+class _GeometryModule(object):
+    '''Allows ee.geometry.Geometry to be used like the real API'''
+    Geometry = Geometry
+geometry = _GeometryModule()
+
+
+class _Grid(object):
+    '''Pixel grid of an image, the transform is in .tfw order and refers to pixel centers'''
+
+    def __init__(self, transform, rows, cols):
+        self.transform = list(transform)
+        self.rows      = rows
+        self.cols      = cols
+
+    @staticmethod
+    def from_bounds(bbox, scale):
+        '''A grid covering bbox with pixels roughly scale meters wide'''
+        (x0, y0, x1, y1) = bbox
+        lat_step = scale / METERS_PER_DEGREE
+        lon_step = lat_step / max(math.cos(math.radians((y0 + y1) / 2.0)), 0.01)
+        cols = max(1, int(math.ceil((x1 - x0) / lon_step)))
+        rows = max(1, int(math.ceil((y1 - y0) / lat_step)))
+        return _Grid([lon_step, 0.0, 0.0, -lat_step, x0 + lon_step/2.0, y1 - lat_step/2.0], rows, cols)
+
+    def get_scale(self):
+        '''Approximate pixel size in meters'''
+        (a, d, b, e, c, f) = self.transform
+        lat = f + e * self.rows / 2.0
+        return math.sqrt(abs(a * e) * max(math.cos(math.radians(lat)), 0.01)) * METERS_PER_DEGREE
+
+    def pixel_to_lonlat(self, rows, cols):
+        (a, d, b, e, c, f) = self.transform
+        return (c + a * cols + b * rows, f + d * cols + e * rows)
+
+    def get_window(self, bbox):
+        '''Returns the (r0, r1, c0, c1) pixel window covering a lon/lat bbox'''
+        (a, d, b, e, c, f) = self.transform
+        if b or d: # Rotated grids are searched in full
+            return (0, self.rows, 0, self.cols)
+        cols = sorted([(bbox[0] - c) / a, (bbox[2] - c) / a])
+        rows = sorted([(bbox[1] - f) / e, (bbox[3] - f) / e])
+        r0 = max(0, int(math.floor(rows[0])))
+        r1 = min(self.rows, int(math.ceil(rows[1])) + 1)
+        c0 = max(0, int(math.floor(cols[0])))
+        c1 = min(self.cols, int(math.ceil(cols[1])) + 1)
+        return (r0, max(r0, r1), c0, max(c0, c1))
+
+
+#=================================================================================
+# Kernels and reducers
+
+class Kernel(object):
+    '''A square or circular neighborhood'''
+
+    def __init__(self, shape, radius, units='pixels', normalize=True, magnitude=1.0):
+        self.shape     = shape
+        self.radius    = radius
+        self.units     = units
+        self.normalize = normalize
+        self.magnitude = magnitude
+
+    @staticmethod
+    def square(radius, units='pixels', normalize=True, magnitude=1.0):
+        return Kernel('square', radius, units, normalize, magnitude)
+
+    @staticmethod
+    def circle(radius, units='pixels', normalize=True, magnitude=1.0):
+        return Kernel('circle', radius, units, normalize, magnitude)
+
+    def get_weights(self, pixel_meters):
+        '''Returns the kernel weights as a 2D array for an image with the given pixel size'''
+        radius = self.radius / pixel_meters if self.units == 'meters' else self.radius
+        r      = int(math.floor(radius))
+        (dy, dx) = numpy.mgrid[-r:r+1, -r:r+1]
+        if self.shape == 'circle':
+            weights = (dx**2 + dy**2 <= radius**2).astype(numpy.float64)
+        else:
+            weights = numpy.ones(dx.shape)
+        weights *= self.magnitude
+        if self.normalize:
+            weights /= weights.sum()
+        return weights
+
+def _histogram(values, max_buckets):
+    '''Equal width histogram in the same format as the EE histogram reducer'''
+    if not len(values):
+        return None
+    num_buckets = max_buckets or DEFAULT_HISTOGRAM_BUCKETS
+    low  = values.min()
+    high = values.max()
+    if high == low:
+        high = low + 1.0
+    (counts, edges) = numpy.histogram(values, num_buckets, (low, high))
+    (sums,   edges) = numpy.histogram(values, num_buckets, (low, high), weights=values)
+    centers = (edges[:-1] + edges[1:]) / 2.0
+    means   = numpy.where(counts > 0, sums / numpy.maximum(counts, 1), centers)
+    return {'bucketMin': float(low), 'bucketWidth': float(edges[1] - edges[0]),
+            'histogram': counts.astype(numpy.float64).tolist(), 'bucketMeans': means.tolist()}
+
+def _if_any(function):
+    '''Reductions of an empty set of pixels return None'''
+    return lambda v: float(function(v)) if len(v) else None
+
+class Reducer(object):
+    '''Reduces the valid pixels of a band to one or more named outputs'''
+
+    def __init__(self, outputs, function, pixel_function=None):
+        self.outputs   = outputs
+        self._function = function # 1D array of values -> list with one entry per output
+        # Stack of layers with NaN for masked values -> list with one array per output, reducing the
+        #  first axis.  Used by Image.reduce and ImageCollection.reduce, None if not supported.
+        self.pixel_function = pixel_function
+
+    def reduce_values(self, values):
+        return self._function(values)
+
+    @staticmethod
+    def sum():
+        return Reducer(['sum'], lambda v: [float(v.sum())],
+                       lambda s: [numpy.nansum(s, axis=0)])
+    @staticmethod
+    def count():
+        return Reducer(['count'], lambda v: [len(v)],
+                       lambda s: [(~numpy.isnan(s)).sum(axis=0).astype(numpy.float64)])
+    @staticmethod
+    def mean():
+        return Reducer(['mean'], lambda v: [_if_any(numpy.mean)(v)],
+                       lambda s: [numpy.nanmean(s, axis=0)])
+    @staticmethod
+    def stdDev():
+        return Reducer(['stdDev'], lambda v: [_if_any(numpy.std)(v)],
+                       lambda s: [numpy.nanstd(s, axis=0)])
+    @staticmethod
+    def variance():
+        return Reducer(['variance'], lambda v: [_if_any(numpy.var)(v)],
+                       lambda s: [numpy.nanvar(s, axis=0)])
+    @staticmethod
+    def min():
+        return Reducer(['min'], lambda v: [_if_any(numpy.min)(v)],
+                       lambda s: [numpy.nanmin(s, axis=0)])
+    @staticmethod
+    def max():
+        return Reducer(['max'], lambda v: [_if_any(numpy.max)(v)],
+                       lambda s: [numpy.nanmax(s, axis=0)])
+    @staticmethod
+    def minMax():
+        return Reducer(['min', 'max'], lambda v: [_if_any(numpy.min)(v), _if_any(numpy.max)(v)],
+                       lambda s: [numpy.nanmin(s, axis=0), numpy.nanmax(s, axis=0)])
+    @staticmethod
+    def median():
+        return Reducer(['median'], lambda v: [_if_any(numpy.median)(v)],
+                       lambda s: [numpy.nanmedian(s, axis=0)])
+
+    @staticmethod
+    def percentile(percentiles, outputNames=None):
+        if outputNames is None:
+            outputNames = ['p%g' % p for p in percentiles]
+        def function(v):
+            if not len(v):
+                return [None] * len(percentiles)
+            return [float(x) for x in numpy.percentile(v, percentiles)]
+        return Reducer(outputNames, function,
+                       lambda s: list(numpy.nanpercentile(s, percentiles, axis=0)))
+
+    @staticmethod
+    def histogram(maxBuckets=None, minBucketWidth=None, maxRaw=None):
+        return Reducer(['histogram'], lambda v: [_histogram(v, maxBuckets)])
+
+def _reduce_layers(reducer, layers, prefix=''):
+    '''Apply a reducer at each pixel across a list of (data, mask) layers.
+       - Returns (bands, masks) with one band per reducer output, named prefix + output.
+       - Pixels where every layer is masked are masked in the output.'''
+    if reducer.pixel_function is None:
+        raise EEException('Reducer %s can not be applied to each pixel.' % ', '.join(reducer.outputs))
+    if not layers:
+        raise EEException('Image has no bands.')
+    shapes = [data.shape for (data, mask) in layers if data.ndim == 2]
+    shape  = shapes[0] if shapes else ()
+    try:
+        stack = numpy.array([numpy.broadcast_to(_as_float(data), shape) for (data, mask) in layers])
+        valid = numpy.array([numpy.broadcast_to(True if mask is None else mask, shape) for (data, mask) in layers])
+    except ValueError as e:
+        raise EEException('Images are not on the same pixel grid: ' + str(e))
+    stack[~valid] = numpy.nan
+    with warnings.catch_warnings(): # All-NaN pixels warn, they are masked below
+        warnings.simplefilter('ignore', RuntimeWarning)
+        results = reducer.pixel_function(stack)
+    any_valid = valid.any(axis=0)
+    bands = collections.OrderedDict()
+    masks = dict()
+    for (name, result) in zip(reducer.outputs, results):
+        bands[prefix + name] = numpy.where(any_valid, result, 0.0)
+        masks[prefix + name] = any_valid
+    return (bands, masks)
+
+
+#=================================================================================
+# Images
+
+def _and_masks(a, b):
+    '''Masks are boolean arrays, or None if every pixel is valid'''
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a & b
+
+def _as_float(data):
+    return numpy.asarray(data, dtype=numpy.float64)
+
+_CAST_TYPES = {'uint8': numpy.uint8, 'uint16': numpy.uint16, 'uint32': numpy.uint32, 'int8': numpy.int8,
+               'int16': numpy.int16, 'int32': numpy.int32, 'int64': numpy.int64}
+
+class Image(ComputedObject):
+    '''A multi-band raster held in memory (or memory mapped) as NumPy arrays'''
+
+    def __init__(self, source=None):
+        ComputedObject.__init__(self)
+        self._bands      = collections.OrderedDict() # Band name -> 2D array, or 0D for constants
+        self._masks      = dict()                    # Band name -> boolean array or None
+        self._grid       = None
+        self._properties = dict()
+        if source is None:
+            return
+        if isinstance(source, ComputedObject) and not isinstance(source, Image):
+            source = source.getInfo()
+        if isinstance(source, basestring):
+            source = _load_archived_image(source)
+        if isinstance(source, Image):
+            self._copy_from(source)
+        elif isinstance(source, (int, long, float, numpy.number)):
+            self._bands['constant'] = numpy.array(source, dtype=numpy.float64)
+            self._masks['constant'] = None
+        elif isinstance(source, (list, tuple)):
+            self._copy_from(Image.cat(*source))
+        else:
+            raise EEException('Unable to create an image from ' + str(source))
+
+    def _copy_from(self, other):
+        self._bands      = collections.OrderedDict(other._bands)
+        self._masks      = dict(other._masks)
+        self._grid       = other._grid
+        self._properties = dict(other._properties)
+
+    def _derive(self, bands, masks, grid=None):
+        '''Build a new image with the same grid and properties as this one'''
+        image = Image()
+        image._bands      = bands
+        image._masks      = masks
+        image._grid       = grid or self._grid
+        image._properties = dict(self._properties)
+        return image
+
+    @staticmethod
+    def from_arrays(arrays, transform=None, properties=None, masks=None):
+        '''Create an image from an ordered list of (band name, 2D array) pairs'''
+        image = Image()
+        for (name, data) in arrays:
+            image._bands[name] = data
+            image._masks[name] = masks.get(name) if masks else None
+        if transform is not None:
+            (rows, cols) = arrays[0][1].shape
+            image._grid = _Grid(transform, rows, cols)
+        image._properties = dict(properties or {})
+        return image
+
+    @staticmethod
+    def constant(value):
+        return Image(value)
+
+    @staticmethod
+    def cat(*images):
+        output = Image()
+        for i in images:
+            output = output.addBands(Image(i))
+        return output
+
+    # ----- Information
+
+    def getInfo(self):
+        bands = []
+        for (name, data) in self._bands.items():
+            precision = 'int' if numpy.issubdtype(data.dtype, numpy.integer) else 'double'
+            info = {'id': name, 'data_type': {'type': 'PixelType', 'precision': precision}}
+            if data.ndim == 2:
+                info['dimensions'] = [data.shape[1], data.shape[0]]
+            bands.append(info)
+        return {'type': 'Image', 'bands': bands, 'properties': _get_info(self._properties)}
+
+    def bandNames(self):
+        return List(self._bands.keys())
+
+    def get(self, name):
+        return ComputedObject(self._properties.get(name))
+
+    def set(self, name, value):
+        image = self._derive(self._bands, self._masks)
+        image._properties[name] = _get_info(value)
+        return image
+
+    def date(self):
+        return Date(self._properties['system:time_start'])
+
+    def _get_scale(self):
+        return self._grid.get_scale() if self._grid else 1.0
+
+    # ----- Band selection
+
+    def _match_band(self, selector):
+        names = self._bands.keys()
+        if isinstance(selector, (int, long)):
+            if selector >= len(names):
+                raise EEException('Image.select: Band index %d out of range.' % selector)
+            return [names[selector]]
+        if selector in self._bands:
+            return [selector]
+        matches = [n for n in names if re.match('(' + selector + ')$', n)]
+        if not matches:
+            raise EEException("Image.select: Pattern '%s' did not match any bands." % selector)
+        return matches
+
+    def select(self, selectors=None, names=None, *args):
+        if not isinstance(selectors, (list, tuple)): # Bands given as separate arguments
+            selectors = [s for s in [selectors, names] + list(args) if s is not None]
+            names     = None
+        selected = []
+        for s in _get_info(list(selectors)):
+            selected.extend(self._match_band(s))
+        if names is None:
+            names = selected
+        if len(names) != len(selected):
+            raise EEException('Image.select: Selected %d bands but got %d names.' % (len(selected), len(names)))
+        bands = collections.OrderedDict()
+        masks = dict()
+        for (old, new) in zip(selected, _get_info(list(names))):
+            bands[new] = self._bands[old]
+            masks[new] = self._masks[old]
+        return self._derive(bands, masks)
+
+    def rename(self, *names):
+        if len(names) == 1 and isinstance(names[0], (list, tuple)):
+            names = names[0]
+        return self.select(self._bands.keys(), list(names))
+
+    def addBands(self, srcImg, names=None, overwrite=False):
+        other = Image(srcImg)
+        if names is not None:
+            other = other.select(names)
+        bands = collections.OrderedDict(self._bands)
+        masks = dict(self._masks)
+        for (name, data) in other._bands.items():
+            new_name = name
+            if not overwrite: # Like EE, rename to foo_1, foo_2, ... if the name is taken
+                suffix = 1
+                while new_name in bands:
+                    new_name = '%s_%d' % (name, suffix)
+                    suffix  += 1
+            bands[new_name] = data
+            masks[new_name] = other._masks[name]
+        return self._derive(bands, masks, self._grid or other._grid)
+
+    # ----- Pixel operations
+
+    def _pair_bands(self, other):
+        '''Match up the bands of two images the same way EE does'''
+        a = self._bands.keys()
+        b = other._bands.keys()
+        if len(a) == len(b):
+            return [(n, n1, n2) for (n, n1, n2) in zip(a, a, b)]
+        if len(b) == 1:
+            return [(n, n, b[0]) for n in a]
+        if len(a) == 1:
+            return [(n, a[0], n) for n in b]
+        raise EEException('Images must contain the same number of bands or only 1 band. Got %d and %d.'
+                          % (len(a), len(b)))
+
+    def _binary(self, other, function):
+        other = other if isinstance(other, Image) else Image(other)
+        bands = collections.OrderedDict()
+        masks = dict()
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for (name, n1, n2) in self._pair_bands(other):
+                try:
+                    data = function(self._bands[n1], other._bands[n2])
+                except ValueError as e:
+                    raise EEException('Images are not on the same pixel grid: ' + str(e))
+                (bands[name], masks[name]) = self._mask_invalid(data, _and_masks(self._masks[n1], other._masks[n2]))
+        return self._derive(bands, masks, self._grid or other._grid)
+
+    def _unary(self, function):
+        bands = collections.OrderedDict()
+        masks = dict()
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for (name, data) in self._bands.items():
+                (bands[name], masks[name]) = self._mask_invalid(function(data), self._masks[name])
+        return self._derive(bands, masks)
+
+    @staticmethod
+    def _mask_invalid(data, mask):
+        '''Like EE, mask out NaN and infinite results (divide by zero, log of negative numbers)'''
+        if not numpy.issubdtype(data.dtype, numpy.floating):
+            return (data, mask)
+        finite = numpy.isfinite(data)
+        if finite.all():
+            return (data, mask)
+        return (numpy.where(finite, data, 0.0), _and_masks(mask, finite))
+
+    def add(self, other):
+        return self._binary(other, lambda a, b: _as_float(a) + b)
+    def subtract(self, other):
+        return self._binary(other, lambda a, b: _as_float(a) - b)
+    def multiply(self, other):
+        return self._binary(other, lambda a, b: _as_float(a) * b)
+    def divide(self, other):
+        return self._binary(other, lambda a, b: _as_float(a) / b)
+    def pow(self, other):
+        return self._binary(other, lambda a, b: _as_float(a) ** b)
+    def mod(self, other):
+        return self._binary(other, lambda a, b: numpy.fmod(_as_float(a), b))
+    def max(self, other):
+        return self._binary(other, lambda a, b: numpy.maximum(_as_float(a), b))
+    def min(self, other):
+        return self._binary(other, lambda a, b: numpy.minimum(_as_float(a), b))
+
+    def lt(self, other):
+        return self._binary(other, lambda a, b: (a <  b).astype(numpy.uint8))
+    def lte(self, other):
+        return self._binary(other, lambda a, b: (a <= b).astype(numpy.uint8))
+    def gt(self, other):
+        return self._binary(other, lambda a, b: (a >  b).astype(numpy.uint8))
+    def gte(self, other):
+        return self._binary(other, lambda a, b: (a >= b).astype(numpy.uint8))
+    def eq(self, other):
+        return self._binary(other, lambda a, b: (a == b).astype(numpy.uint8))
+    def neq(self, other):
+        return self._binary(other, lambda a, b: (a != b).astype(numpy.uint8))
+    def And(self, other):
+        return self._binary(other, lambda a, b: ((a != 0) & (b != 0)).astype(numpy.uint8))
+    def Or(self, other):
+        return self._binary(other, lambda a, b: ((a != 0) | (b != 0)).astype(numpy.uint8))
+    def Not(self):
+        return self._unary(lambda a: (a == 0).astype(numpy.uint8))
+
+    def bitwise_and(self, other):
+        return self._binary(other, lambda a, b: numpy.asarray(a, numpy.int64) & numpy.asarray(b, numpy.int64))
+    bitwiseAnd = bitwise_and
+    def rightShift(self, other):
+        return self._binary(other, lambda a, b: numpy.asarray(a, numpy.int64) >> numpy.asarray(b, numpy.int64))
+    def leftShift(self, other):
+        return self._binary(other, lambda a, b: numpy.asarray(a, numpy.int64) << numpy.asarray(b, numpy.int64))
+
+    def abs(self):
+        return self._unary(numpy.abs)
+    def sqrt(self):
+        return self._unary(lambda a: numpy.sqrt(_as_float(a)))
+    def exp(self):
+        return self._unary(lambda a: numpy.exp(_as_float(a)))
+    def log(self):
+        return self._unary(lambda a: numpy.log(_as_float(a)))
+    def log10(self):
+        return self._unary(lambda a: numpy.log10(_as_float(a)))
+    def round(self):
+        return self._unary(numpy.round)
+    def floor(self):
+        return self._unary(numpy.floor)
+    def ceil(self):
+        return self._unary(numpy.ceil)
+
+    def clamp(self, low, high):
+        return self._unary(lambda a: numpy.clip(_as_float(a), low, high))
+
+    def unitScale(self, low, high):
+        return self._unary(lambda a: (_as_float(a) - low) / float(high - low))
+
+    def _cast(self, type_name):
+        dtype = _CAST_TYPES[type_name]
+        info  = numpy.iinfo(dtype)
+        return self._unary(lambda a: numpy.clip(a, info.min, info.max).astype(dtype))
+
+    def uint8(self):
+        return self._cast('uint8')
+    def uint16(self):
+        return self._cast('uint16')
+    def uint32(self):
+        return self._cast('uint32')
+    def int8(self):
+        return self._cast('int8')
+    def int16(self):
+        return self._cast('int16')
+    def int32(self):
+        return self._cast('int32')
+    def int64(self):
+        return self._cast('int64')
+    toInt = int32
+    def float(self):
+        return self._unary(lambda a: numpy.asarray(a, numpy.float32))
+    def double(self):
+        return self._unary(_as_float)
+    toFloat  = float
+    toDouble = double
+
+    # ----- Masks
+
+    def _full_mask(self, name):
+        '''The mask of a band as an array or scalar'''
+        mask = self._masks[name]
+        return numpy.array(True) if mask is None else mask
+
+    def mask(self, mask=None):
+        '''With no argument return the mask as an image, otherwise replace the mask'''
+        if mask is None:
+            bands = collections.OrderedDict()
+            for name in self._bands.keys():
+                bands[name] = self._full_mask(name).astype(numpy.float64)
+            return self._derive(bands, dict([(n, None) for n in bands.keys()]))
+        mask  = Image(mask)
+        bands = collections.OrderedDict()
+        masks = dict()
+        for (name, n1, n2) in self._pair_bands(mask):
+            bands[name] = self._bands[n1]
+            masks[name] = (mask._bands[n2] != 0) & mask._full_mask(n2)
+        return self._derive(bands, masks, self._grid or mask._grid)
+
+    def updateMask(self, mask):
+        mask   = Image(mask)
+        output = self._binary(mask, lambda a, b: a)
+        for (name, n1, n2) in self._pair_bands(mask):
+            output._masks[name] = _and_masks(output._masks[name], mask._bands[n2] != 0)
+        return output
+
+    def unmask(self, value=0):
+        value = Image(value)
+        return self.where(self.mask().Not(), value)._set_masks(None)
+
+    def _set_masks(self, mask):
+        for name in self._bands.keys():
+            self._masks[name] = mask
+        return self
+
+    def where(self, test, value):
+        '''Replace pixels where test is non-zero with value'''
+        test  = Image(test)
+        value = Image(value)
+        bands = collections.OrderedDict()
+        masks = dict()
+        for (name, n1, n2) in self._pair_bands(test):
+            condition = (test._bands[n2] != 0) & test._full_mask(n2)
+            v         = value._bands[value._bands.keys()[0]] if len(value._bands) == 1 else value._bands[name]
+            vmask     = value._full_mask(value._bands.keys()[0]) if len(value._bands) == 1 else value._full_mask(name)
+            bands[name] = numpy.where(condition, v, self._bands[n1])
+            masks[name] = numpy.where(condition, vmask, self._full_mask(n1))
+        return self._derive(bands, masks, self._grid or test._grid or value._grid)
+
+    def clip(self, geometry):
+        '''Mask out pixels outside of the geometry'''
+        if not self._grid:
+            return self
+        (rows, cols)  = numpy.mgrid[0:self._grid.rows, 0:self._grid.cols]
+        (lons, lats)  = self._grid.pixel_to_lonlat(rows, cols)
+        inside = Geometry(geometry)._contains_points(lons, lats)
+        output = self._derive(self._bands, dict(self._masks))
+        for name in output._bands.keys():
+            output._masks[name] = _and_masks(output._masks[name], inside)
+        return output
+
+    # ----- Neighborhood operations
+
+    def convolve(self, kernel):
+        weights = kernel.get_weights(self._get_scale())
+        bands   = collections.OrderedDict()
+        masks   = dict()
+        for (name, data) in self._bands.items():
+            if data.ndim == 0:
+                bands[name] = _as_float(data) * weights.sum()
+                masks[name] = None
+                continue
+            mask = self._full_mask(name) * numpy.ones(data.shape)
+            total = scipy.ndimage.correlate(_as_float(data) * mask, weights, mode='nearest')
+            if kernel.normalize: # Renormalize over the unmasked pixels
+                norm  = scipy.ndimage.correlate(mask, weights, mode='nearest')
+                valid = norm > 0
+                total = numpy.where(valid, total / numpy.where(valid, norm, 1.0), 0.0)
+                masks[name] = valid if self._masks[name] is not None else None
+            else:
+                masks[name] = self._masks[name]
+            bands[name] = total
+        return self._derive(bands, masks)
+
+    def _focal(self, function, fill, radius, kernelType, units):
+        footprint = Kernel(kernelType, radius, units, False).get_weights(self._get_scale()) > 0
+        bands = collections.OrderedDict()
+        masks = dict()
+        for (name, data) in self._bands.items():
+            mask = self._masks[name]
+            if data.ndim == 0:
+                (bands[name], masks[name]) = (data, mask)
+                continue
+            if mask is not None and fill is not None:
+                data = numpy.where(mask, data, fill)
+            bands[name] = function(data, footprint=footprint, mode='nearest')
+            masks[name] = None if mask is None else \
+                          scipy.ndimage.maximum_filter(mask, footprint=footprint, mode='constant')
+        return self._derive(bands, masks)
+
+    def focal_min(self, radius=1.5, kernelType='circle', units='pixels', iterations=1):
+        output = self
+        for i in range(iterations):
+            output = output._focal(scipy.ndimage.minimum_filter, numpy.inf, radius, kernelType, units)
+        return output
+
+    def focal_max(self, radius=1.5, kernelType='circle', units='pixels', iterations=1):
+        output = self
+        for i in range(iterations):
+            output = output._focal(scipy.ndimage.maximum_filter, -numpy.inf, radius, kernelType, units)
+        return output
+
+    def focal_median(self, radius=1.5, kernelType='circle', units='pixels', iterations=1):
+        output = self
+        for i in range(iterations):
+            output = output._focal(scipy.ndimage.median_filter, None, radius, kernelType, units)
+        return output
+
+    def focal_mean(self, radius=1.5, kernelType='circle', units='pixels', iterations=1):
+        output = self
+        for i in range(iterations):
+            output = output.convolve(Kernel(kernelType, radius, units, True))
+        return output
+
+    # ----- Reductions
+
+    def _get_pixel_selection(self, geometry, scale):
+        '''Find the grid, pixel window, sampling stride and in-region mask for a reduction'''
+        grid = self._grid
+        if grid is None: # Only constant bands, make up a grid over the region
+            if geometry is None:
+                return (None, None, None)
+            grid = _Grid.from_bounds(Geometry(geometry)._get_bbox(), scale or 1000.0)
+
+        stride = 1
+        if scale:
+            stride = max(1, int(round(scale / grid.get_scale())))
+        if geometry is None:
+            return (grid, (0, grid.rows, 0, grid.cols, stride), None)
+
+        geometry = Geometry(geometry)
+        (r0, r1, c0, c1) = grid.get_window(geometry._get_bbox())
+        (rows, cols) = numpy.mgrid[r0:r1:stride, c0:c1:stride]
+        (lons, lats) = grid.pixel_to_lonlat(rows, cols)
+        if geometry._value['type'] == 'Point': # Just the nearest pixel
+            inside = numpy.zeros(rows.shape, dtype=bool)
+            if inside.size:
+                (x, y) = geometry._value['coordinates']
+                inside.flat[numpy.argmin((lons - x)**2 + (lats - y)**2)] = True
+        else:
+            inside = geometry._contains_points(lons, lats)
+        return (grid, (r0, r1, c0, c1, stride), inside)
+
+    def reduceRegion(self, reducer, geometry=None, scale=None, crs=None, crsTransform=None,
+                     bestEffort=False, maxPixels=None, tileScale=None):
+        (grid, window, inside) = self._get_pixel_selection(geometry, scale)
+        output = dict()
+        for (name, data) in self._bands.items():
+            mask = self._masks[name]
+            if window is None: # A constant image with no region
+                values = _as_float(data).reshape(1)
+            else:
+                (r0, r1, c0, c1, stride) = window
+                shape = ((r1 - r0 + stride - 1) // stride, (c1 - c0 + stride - 1) // stride)
+                if data.ndim == 0:
+                    data = numpy.empty(shape)
+                    data.fill(self._bands[name])
+                else:
+                    data = data[r0:r1:stride, c0:c1:stride]
+                valid = numpy.ones(shape, dtype=bool) if inside is None else inside
+                if mask is not None and mask.ndim == 2:
+                    valid = valid & mask[r0:r1:stride, c0:c1:stride]
+                values = _as_float(data[valid])
+            results = reducer.reduce_values(values)
+            if len(reducer.outputs) == 1:
+                output[name] = results[0]
+            else:
+                for (out_name, r) in zip(reducer.outputs, results):
+                    output[name + '_' + out_name] = r
+        return Dictionary(output)
+
+    def reduce(self, reducer):
+        '''Reduce the bands of each pixel, the output bands are named after the reducer outputs'''
+        (bands, masks) = _reduce_layers(reducer, [(data, self._masks[name]) for (name, data) in self._bands.items()])
+        return self._derive(bands, masks)
+
+    # ----- Projection, accepted but ignored since everything is on one grid
+
+    def reproject(self, *args, **kwargs):
+        return self
+    def resample(self, mode='bilinear'):
+        return self
+
+
+#=================================================================================
+# Image collections
+
+class Filter(object):
+    '''A test on image properties'''
+
+    def __init__(self, function):
+        self._function = function
+
+    def test(self, image):
+        return self._function(image._properties)
+
+    @staticmethod
+    def _compare(name, value, function):
+        value = _get_info(value)
+        return Filter(lambda p: (name in p) and function(p[name], value))
+
+    @staticmethod
+    def eq(name, value):
+        return Filter._compare(name, value, lambda a, b: a == b)
+    @staticmethod
+    def neq(name, value):
+        return Filter._compare(name, value, lambda a, b: a != b)
+    @staticmethod
+    def lt(name, value):
+        return Filter._compare(name, value, lambda a, b: a < b)
+    @staticmethod
+    def lte(name, value):
+        return Filter._compare(name, value, lambda a, b: a <= b)
+    @staticmethod
+    def gt(name, value):
+        return Filter._compare(name, value, lambda a, b: a > b)
+    @staticmethod
+    def gte(name, value):
+        return Filter._compare(name, value, lambda a, b: a >= b)
+    @staticmethod
+    def inList(name, values):
+        return Filter._compare(name, values, lambda a, b: a in b)
+
+    @staticmethod
+    def date(start, end=None):
+        start = Date(start)._value
+        end   = Date(end)._value if end is not None else float('inf')
+        return Filter(lambda p: start <= p.get('system:time_start', start - 1) < end)
+
+    @staticmethod
+    def And(*filters):
+        return Filter(lambda p: all([f._function(p) for f in filters]))
+
+
+class ImageCollection(ComputedObject):
+    '''An ordered list of images'''
+
+    def __init__(self, source):
+        ComputedObject.__init__(self)
+        if isinstance(source, basestring):
+            source = _load_archived_collection(source)
+        if isinstance(source, ImageCollection):
+            source = source._images
+        self._images = [Image(i) for i in _get_list(source)]
+
+    def getInfo(self):
+        return {'type': 'ImageCollection', 'features': [i.getInfo() for i in self._images]}
+
+    def size(self):
+        return Number(len(self._images))
+
+    def first(self):
+        if not self._images:
+            raise EEException('Empty image collection.')
+        return self._images[0]
+
+    def toList(self, count, offset=0):
+        return List(self._images[offset:offset+count])
+
+    def limit(self, count):
+        return ImageCollection(self._images[:count])
+
+    def map(self, function):
+        return ImageCollection([function(i) for i in self._images])
+
+    def select(self, *args):
+        return self.map(lambda i: i.select(*args))
+
+    def filter(self, filter_object):
+        return ImageCollection([i for i in self._images if filter_object.test(i)])
+
+    def filterDate(self, start, end=None):
+        return self.filter(Filter.date(start, end))
+
+    def filterMetadata(self, name, operator, value):
+        operators = {'equals': Filter.eq, 'not_equals': Filter.neq, 'less_than': Filter.lt,
+                     'greater_than': Filter.gt}
+        return self.filter(operators[operator](name, value))
+
+    def filterBounds(self, geometry):
+        (x0, y0, x1, y1) = Geometry(geometry)._get_bbox()
+        def intersects(image):
+            grid = image._grid
+            if grid is None:
+                return True
+            (r0, r1, c0, c1) = grid.get_window((x0, y0, x1, y1))
+            return (r1 > r0) and (c1 > c0)
+        return ImageCollection([i for i in self._images if intersects(i)])
+
+    def merge(self, other):
+        return ImageCollection(self._images + ImageCollection(other)._images)
+
+    def sort(self, name, ascending=True):
+        images = sorted(self._images, key=lambda i: i._properties.get(name))
+        return ImageCollection(images if ascending else images[::-1])
+
+    def _composite(self, function):
+        '''Combine each band across the images, only using the unmasked pixels'''
+        if not self._images:
+            return Image()
+        first = self._images[0]
+        bands = collections.OrderedDict()
+        masks = dict()
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            for name in first._bands.keys():
+                try:
+                    stack = numpy.array([numpy.broadcast_to(_as_float(i._bands[name]), first._bands[name].shape)
+                                         for i in self._images])
+                except KeyError:
+                    raise EEException("Band '%s' is missing from some images in the collection." % name)
+                valid = numpy.array([i._full_mask(name) * numpy.ones(stack.shape[1:], dtype=bool)
+                                     for i in self._images])
+                stack[~valid] = numpy.nan
+                result = function(stack)
+                masks[name] = valid.any(axis=0)
+                bands[name] = numpy.where(masks[name], result, 0.0)
+        return first._derive(bands, masks)
+
+    def mean(self):
+        return self._composite(lambda s: numpy.nanmean(s, axis=0))
+    def median(self):
+        return self._composite(lambda s: numpy.nanmedian(s, axis=0))
+    def min(self):
+        return self._composite(lambda s: numpy.nanmin(s, axis=0))
+    def max(self):
+        return self._composite(lambda s: numpy.nanmax(s, axis=0))
+    def sum(self):
+        return self._composite(lambda s: numpy.nansum(s, axis=0))
+
+    def reduce(self, reducer):
+        '''Reduce each band across the images, the output bands are named <band>_<reducer output>'''
+        if not self._images:
+            return Image()
+        first = self._images[0]
+        bands = collections.OrderedDict()
+        masks = dict()
+        for name in first._bands.keys():
+            try:
+                layers = [(i._bands[name], i._masks[name]) for i in self._images]
+            except KeyError:
+                raise EEException("Band '%s' is missing from some images in the collection." % name)
+            (band_outputs, mask_outputs) = _reduce_layers(reducer, layers, name + '_')
+            bands.update(band_outputs)
+            masks.update(mask_outputs)
+        return first._derive(bands, masks)
+
+    def mosaic(self):
+        '''Later images are drawn on top of earlier ones'''
+        def last_valid(stack):
+            output = numpy.zeros(stack.shape[1:])
+            for layer in stack:
+                output = numpy.where(numpy.isnan(layer), output, layer)
+            return output
+        return self._composite(last_valid)
+
+def _get_list(value):
+    if isinstance(value, List):
+        return value._value
+    return list(value)
+
+
+#=================================================================================
+# Loading from disk
+
+def register_image(ee_id, image):
+    '''Make ee.Image(ee_id) return this image'''
+    _registered_images[ee_id] = image
+
+def register_collection(ee_id, images):
+    '''Make ee.ImageCollection(ee_id) return these images'''
+    _registered_collections[ee_id] = list(images)
+
+def _read_metadata(json_path):
+    if not os.path.exists(json_path):
+        return dict()
+    with open(json_path, 'r') as f:
+        return json.load(f)
+
+def _read_band_file(path):
+    '''Load one TIFF file, returns (array, transform or None)'''
+    from cmt.local_ee_image import memmap_tiff, read_geotiff_transform
+    import matplotlib.pyplot as plt
+
+    data = memmap_tiff(path)
+    if data is None:
+        data = plt.imread(path)
+    world_path = os.path.splitext(path)[0] + '.tfw'
+    if os.path.exists(world_path):
+        with open(world_path, 'r') as f:
+            transform = [float(line) for line in f if line.strip()]
+    else:
+        transform = read_geotiff_transform(path)
+    return (data, transform)
+
+def load_geotiff(path, band_names=None, properties=None):
+    '''Load a single or multi band GeoTIFF file as an Image'''
+    (data, transform) = _read_band_file(path)
+    if data.ndim == 2:
+        layers = [data]
+    else:
+        layers = [data[:,:,i] for i in range(data.shape[2])]
+    if band_names is None:
+        band_names = ['b%d' % (i+1) for i in range(len(layers))]
+    return Image.from_arrays(zip(band_names, layers), transform, properties)
+
+def load_band_folder(folder, properties=None):
+    '''Load an image stored as one TIFF file per band, named <band>.tif or <image>.<band>.tif'''
+    arrays    = []
+    transform = None
+    for name in sorted(os.listdir(folder)):
+        if os.path.splitext(name)[1].lower() not in ['.tif', '.tiff']:
+            continue
+        (data, band_transform) = _read_band_file(os.path.join(folder, name))
+        arrays.append((os.path.splitext(name)[0].split('.')[-1], data))
+        transform = transform or band_transform
+    if not arrays:
+        raise EEException('No band files found in ' + folder)
+    return Image.from_arrays(arrays, transform, properties)
+
+def _get_archive_path(ee_id):
+    if not ARCHIVE_DIR:
+        raise EEException('Image ' + ee_id + ' is not registered and CMT_LOCAL_EE_DIR is not set.')
+    return os.path.join(ARCHIVE_DIR, *ee_id.split('/'))
+
+def _load_path(path):
+    '''Load the image stored in a .tif file or a folder of band files'''
+    if os.path.isdir(path):
+        metadata = _read_metadata(os.path.join(path, 'properties.json'))
+        image    = load_band_folder(path, metadata.get('properties'))
+    else:
+        metadata = _read_metadata(os.path.splitext(path)[0] + '.json')
+        image    = load_geotiff(path, metadata.get('bands'), metadata.get('properties'))
+    if 'system:index' not in image._properties:
+        image._properties['system:index'] = os.path.basename(os.path.splitext(path)[0])
+    return image
+
+def _load_archived_image(ee_id):
+    if ee_id in _registered_images:
+        return _registered_images[ee_id]
+    path = _get_archive_path(ee_id)
+    for candidate in [path + '.tif', path + '.tiff', path]:
+        if os.path.exists(candidate):
+            image = _load_path(candidate)
+            _registered_images[ee_id] = image # Images are immutable so they can be shared
+            return image
+    raise EEException('Image asset not found: ' + ee_id)
+
+def _load_archived_collection(ee_id):
+    if ee_id in _registered_collections:
+        return _registered_collections[ee_id]
+    folder = _get_archive_path(ee_id)
+    if not os.path.isdir(folder):
+        raise EEException('ImageCollection asset not found: ' + ee_id)
+    images = []
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if os.path.isdir(path) or (os.path.splitext(name)[1].lower() in ['.tif', '.tiff']):
+            images.append(_load_path(path))
+    _registered_collections[ee_id] = images
+    return images
+
+
+#=================================================================================
+
+def install(archive_dir=None):
+    '''Use this module in place of the Earth Engine API.
+       - Modules which already imported ee are switched over to this module.'''
+    global ARCHIVE_DIR
+    if archive_dir:
+        ARCHIVE_DIR = archive_dir
+    this = sys.modules[__name__]
+    real = sys.modules.get('ee')
+    sys.modules['ee'] = this
+    if (real is None) or (real is this):
+        return
+    for module in sys.modules.values():
+        if (module is not None) and (getattr(module, 'ee', None) is real):
+            module.ee = this
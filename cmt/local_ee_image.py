@@ -21,13 +21,18 @@ import functools
 import math
 import sys
 import os.path
-import urllib2
+import shutil
+import struct
 import uuid
 import zipfile
 import tempfile
 from multiprocessing.pool import ThreadPool
 
 import ee
+import numpy
+
+from cmt.util.miscUtilities import which
+from cmt.util.download_cache import get_download_cache
 
 from PIL import ImageQt
 from PIL import Image, ImageChops
@@ -41,11 +46,97 @@ BASE_URL = 'https://earthengine.googleapis.com'
 
 TEMP_FILE_DIR = tempfile.gettempdir()
 
+# TIFF tags needed to memory map a band file or locate it on the globe
+_TIFF_TAGS = {256: 'width', 257: 'height', 258: 'bits', 259: 'compression', 273: 'strip_offsets',
+              277: 'samples', 278: 'rows_per_strip', 279: 'strip_byte_counts', 284: 'planar',
+              322: 'tile_width', 339: 'sample_format', 33550: 'pixel_scale', 33922: 'tiepoint'}
+# TIFF field type -> struct format
+_TIFF_TYPES = {1: 'B', 3: 'H', 4: 'I', 12: 'd', 16: 'Q'}
+# (sample format, bits per sample) -> numpy type character
+_TIFF_DTYPES = {(1, 8): 'u1', (1, 16): 'u2', (1, 32): 'u4', (2, 8): 'i1', (2, 16): 'i2', (2, 32): 'i4',
+                (3, 32): 'f4', (3, 64): 'f8'}
+
+def _read_tiff_fields(path):
+    '''Read the fields we care about from the first IFD of a TIFF file.
+       - Returns (byte order, dictionary of value tuples) or None if this is not a TIFF we can read.'''
+    with open(path, 'rb') as f:
+        header = f.read(8)
+        if header[0:2] == 'II':
+            order = '<'
+        elif header[0:2] == 'MM':
+            order = '>'
+        else:
+            return None
+        (magic, ifd_offset) = struct.unpack(order + 'HI', header[2:8])
+        if magic != 42: # Not handling BigTIFF
+            return None
+        f.seek(ifd_offset)
+        (num_entries,) = struct.unpack(order + 'H', f.read(2))
+        entries = f.read(12 * num_entries)
+        fields  = dict()
+        for i in range(num_entries):
+            (tag, field_type, count) = struct.unpack(order + 'HHI', entries[12*i:12*i+8])
+            if (tag not in _TIFF_TAGS) or (field_type not in _TIFF_TYPES):
+                continue
+            fmt  = order + str(count) + _TIFF_TYPES[field_type]
+            size = struct.calcsize(fmt)
+            if size <= 4: # Values are stored in the entry itself
+                values = struct.unpack(fmt, entries[12*i+8:12*i+8+size])
+            else:
+                (offset,) = struct.unpack(order + 'I', entries[12*i+8:12*i+12])
+                here = f.tell()
+                f.seek(offset)
+                values = struct.unpack(fmt, f.read(size))
+                f.seek(here)
+            fields[_TIFF_TAGS[tag]] = values
+    return (order, fields)
+
+def read_geotiff_transform(path):
+    '''Read the georeference of a north up GeoTIFF as a transform like the one in a .tfw file.
+       - Returns None if the file does not have the GeoTIFF pixel scale and tie point tags.'''
+    result = _read_tiff_fields(path)
+    if result is None:
+        return None
+    fields = result[1]
+    if ('pixel_scale' not in fields) or ('tiepoint' not in fields):
+        return None
+    (sx, sy) = fields['pixel_scale'][0:2]
+    (i, j, k, x, y) = fields['tiepoint'][0:5]
+    # The tie point refers to the pixel corner, the transform refers to pixel centers
+    return [sx, 0.0, 0.0, -sy, x - i*sx + sx/2.0, y + j*sy - sy/2.0]
+
+def memmap_tiff(path):
+    '''Memory map a single band, uncompressed, strip organized TIFF file.
+       - Returns a read only numpy.memmap or None if the file layout can't be mapped.'''
+    result = _read_tiff_fields(path)
+    if result is None:
+        return None
+    (order, fields) = result
+
+    # Only the simple layout is supported, anything else falls back to a full read
+    if ('tile_width' in fields) or (fields.get('compression', (1,))[0] != 1) or \
+       (fields.get('samples', (1,))[0] != 1) or ('strip_offsets' not in fields):
+        return None
+    width  = fields['width'][0]
+    height = fields['height'][0]
+    key    = (fields.get('sample_format', (1,))[0], fields.get('bits', (1,))[0])
+    if key not in _TIFF_DTYPES:
+        return None
+    dtype   = numpy.dtype(order + _TIFF_DTYPES[key])
+    offsets = fields['strip_offsets']
+    counts  = fields.get('strip_byte_counts', ())
+    if len(counts) != len(offsets) or sum(counts) != width * height * dtype.itemsize:
+        return None
+    for i in range(len(offsets) - 1): # The strips must be stored back to back
+        if offsets[i] + counts[i] != offsets[i+1]:
+            return None
+    return numpy.memmap(path, dtype=dtype, mode='r', offset=offsets[0], shape=(height, width))
+
 class LocalEEImage(object):
     """Downloads an entire image from Earth Engine and maintains it locally."""
 
     # Download an image locally. Caches images with the same bbox, scale and image_name
-    def __init__(self, eeobject, bbox, scale, bands, image_name=None):
+    def __init__(self, eeobject, bbox, scale, bands, image_name=None, memory_map=False):
         """Constructs a LocalEEImage.
 
         Arguments:
@@ -53,28 +144,19 @@ class LocalEEImage(object):
         bbox       -- A four-tuple describing the bounds to download, (lon0, lat0, lon1, lat1).
         scale      -- The scale in meters of the image to download.
         bands      -- A list containing the names of the bands in eeobject to download.
-        image_name -- A unique name for this image. If an image of the same name, bbox and
-        scale was downloaded previously, a cached image may be used. If a name is not specified,
-        no caching is performed.
+        image_name -- A name for this image, used for the files inside the download. Downloads
+        are cached by the content of eeobject, bbox and scale so the name does not need to be unique.
+        memory_map -- If True, keep the bands on disk as memory mapped arrays so only the
+        windows which are accessed get read. Bands which can't be mapped are loaded normally.
         """
 
-        image_name = image_name.replace(' ', '') # can't have space in filename
         if image_name == None: # Use a default name if needed
-            image_name = uuid.uuid4()
+            image_name = 'LocalEEImage'
+        image_name = image_name.replace(' ', '') # can't have space in filename
         # If you get an invalid asset ID here that probably means there is a problem with image_name
-        url = eeobject.getDownloadUrl({'name' : image_name, 'scale': scale, 'crs': 'EPSG:4326',
-                                       'region': apply(ee.Geometry.Rectangle, bbox).toGeoJSONString()})
-        tempFile = '%s_%g,%g_%g,%g_%g.zip' % (image_name, bbox[0], bbox[1], bbox[2], bbox[3], scale)
-        filename = os.path.join(TEMP_FILE_DIR, tempFile) 
-        if (image_name != None) and (not os.path.isfile(filename)):
-            print 'Downloading image...'
-            data = urllib2.urlopen(url)
-            with open(filename, 'wb') as fp:
-                while True:
-                    chunk = data.read(16 * 1024)
-                    if not chunk: break
-                    fp.write(chunk)
-            print 'Download complete!'
+        params = {'name' : image_name, 'scale': scale, 'crs': 'EPSG:4326',
+                  'region': apply(ee.Geometry.Rectangle, bbox).toGeoJSONString()}
+        filename = get_download_cache().fetch(eeobject, params)
 
         # extract the zip file
         z = zipfile.ZipFile(filename, 'r')
@@ -82,19 +164,54 @@ class LocalEEImage(object):
         transform_file = z.open(image_name + '.' + bands[0] + '.tfw', 'r')
         self.transform = [float(line) for line in transform_file]
 
-        # Load each of the bands in to memory
+        # Load each of the bands in to memory or map them from disk
+        # - Extract to a private folder so concurrent workers with the same image name don't collide.
+        extract_dir = tempfile.mkdtemp(prefix='CMT_LocalEEImage_', dir=TEMP_FILE_DIR)
         self.images = dict()
         for b in bands:
             bandfilename   = image_name + '.' + b + '.tif'
-            band_file_path = os.path.join(TEMP_FILE_DIR, bandfilename)
-            z.extract(bandfilename, TEMP_FILE_DIR)
-            self.images[b] = plt.imread(band_file_path)
+            band_file_path = os.path.join(extract_dir, bandfilename)
+            z.extract(bandfilename, extract_dir)
+            mapped = memmap_tiff(band_file_path) if memory_map else None
+            if mapped is not None:
+                self.images[b] = mapped
+                if os.name == 'posix': # The mapping stays valid after the file is unlinked
+                    os.remove(band_file_path)
+            else:
+                if memory_map:
+                    print 'Unable to memory map ' + bandfilename + ', loading it in to memory.'
+                self.images[b] = plt.imread(band_file_path)
+                os.remove(band_file_path)
+        z.close()
+        # Elsewhere mapped files can't be deleted while open, close() removes them.
+        self._extract_dir = extract_dir
+        if not os.listdir(extract_dir):
+            os.rmdir(extract_dir)
+            self._extract_dir = None
+        self.memory_map = memory_map
         
         self.image_name = image_name
         self.bands      = bands
         self.bbox       = bbox
         self.scale      = scale
 
+        # Optional derived planes, only filled in by build_derived_planes()
+        self.log10_images    = dict()
+        self.integral_images = dict()
+
+    def close(self):
+        '''Release the image data and remove any band files which are still on disk.'''
+        self.images = dict()
+        self.clear_derived_planes()
+        extract_dir = getattr(self, '_extract_dir', None)
+        if extract_dir:
+            shutil.rmtree(extract_dir, ignore_errors=True)
+            self._extract_dir = None
+
+    def __del__(self):
+        if getattr(self, '_extract_dir', None):
+            self.close()
+
     def image_to_global(self, r, c):
         '''Convert pixel coordinate to latitude and longitude.'''
         lng = self.transform[0] * c + self.transform[4]
@@ -121,6 +238,11 @@ class LocalEEImage(object):
     def get_image(self, band_name):
         '''Fetch the selected band as a PIL image.'''
         return self.images[band_name]
+
+    def get_window(self, band_name, r0, r1, c0, c1):
+        '''Fetch rows [r0, r1) and columns [c0, c1) of the selected band as an in-memory array.
+           - For memory mapped bands only this window is read from disk.'''
+        return numpy.array(self.images[band_name][r0:r1, c0:c1])
     
     def get_band_by_index(self, band_index):
         '''Fetch the selected band as a PIL image.'''
@@ -130,3 +252,91 @@ class LocalEEImage(object):
         '''Get the width and height of the image.'''
         return self.images[self.bands[0]].shape
 
+    def build_derived_planes(self, log10=False, integral=False, bands=None):
+        '''Precompute derived planes so they are not recomputed on every pixel access.
+
+        Arguments:
+        log10    -- Build a float32 log10 plane for each band.
+        integral -- Build summed-area tables of value and value squared for each band.
+                    If log10 is also set the tables are built over the log10 values.
+        bands    -- The bands to build planes for, defaults to all bands.
+
+        Each integral plane costs two float64 copies of the band, so only request what is needed.
+        '''
+        if bands is None:
+            bands = self.bands
+        for b in bands:
+            if log10 and (b not in self.log10_images):
+                self.log10_images[b] = numpy.log10(self.images[b].astype(numpy.float32))
+            if integral and (self.integral_images.get(b, (None,))[0] != log10):
+                values = self.log10_images[b] if log10 else self.images[b]
+                values = values.astype(numpy.float64)
+                (h, w) = values.shape
+                sums  = numpy.zeros((h + 1, w + 1), dtype=numpy.float64)
+                sums2 = numpy.zeros((h + 1, w + 1), dtype=numpy.float64)
+                sums [1:, 1:] = values.cumsum(axis=0).cumsum(axis=1)
+                sums2[1:, 1:] = (values * values).cumsum(axis=0).cumsum(axis=1)
+                self.integral_images[b] = (log10, sums, sums2)
+
+    def clear_derived_planes(self):
+        '''Release any planes built by build_derived_planes.'''
+        self.log10_images    = dict()
+        self.integral_images = dict()
+
+    def get_log10_window(self, band_name, r0, r1, c0, c1):
+        '''Fetch the log10 of rows [r0, r1) and columns [c0, c1) of the selected band.
+           - Uses the cached plane if it was built, otherwise only the window is converted.'''
+        if band_name in self.log10_images:
+            return self.log10_images[band_name][r0:r1, c0:c1]
+        return numpy.log10(self.images[band_name][r0:r1, c0:c1].astype(numpy.float32))
+
+    def region_sums(self, band_name, r0, r1, c0, c1):
+        '''Return (count, sum, sum of squares) of the band over rows [r0, r1) and columns [c0, c1).
+           - Requires integral planes to have been built for this band.
+           - The bounds may be arrays of the same shape to look up many regions at once.'''
+        (log10, sums, sums2) = self.integral_images[band_name]
+        r1 = numpy.maximum(r0, r1)
+        c1 = numpy.maximum(c0, c1)
+        count  = (r1 - r0) * (c1 - c0)
+        total  = sums [r1, c1] - sums [r0, c1] - sums [r1, c0] + sums [r0, c0]
+        total2 = sums2[r1, c1] - sums2[r0, c1] - sums2[r1, c0] + sums2[r0, c0]
+        return (count, total, total2)
+
+    def region_mean_variance(self, band_name, r0, r1, c0, c1):
+        '''Return (mean, variance) of the band over rows [r0, r1) and columns [c0, c1).
+           - Requires integral planes to have been built for this band.'''
+        (count, total, total2) = self.region_sums(band_name, r0, r1, c0, c1)
+        if count == 0:
+            return (0.0, 0.0)
+        mean = total / count
+        var  = max(0.0, total2 / count - mean ** 2) # can be negative due to precision errors
+        return (mean, var)
+
+    def write_geotiff(self, array, file_path):
+        '''Write a 2D array aligned with this image to file_path.
+           - If GDAL is installed the output is a GeoTIFF, otherwise a TIFF with a .tfw world file.'''
+        (rows, cols) = array.shape[0:2]
+        if not which('gdal_translate'):
+            Image.fromarray(array).save(file_path)
+            world_path = os.path.splitext(file_path)[0] + '.tfw'
+            with open(world_path, 'w') as f:
+                for v in self.transform:
+                    f.write('%.12f\n' % v)
+            print 'Wrote ' + file_path + ' with world file ' + world_path
+            return True
+
+        temp_path = os.path.join(TEMP_FILE_DIR, 'CMT_temp_raster_%s.tif' % uuid.uuid4())
+        Image.fromarray(array).save(temp_path)
+        # The transform refers to pixel centers, GDAL wants the outer corners
+        ulx = self.transform[4] - self.transform[0] / 2.0
+        uly = self.transform[5] - self.transform[3] / 2.0
+        lrx = ulx + self.transform[0] * cols
+        lry = uly + self.transform[3] * rows
+        cmd = ('gdal_translate -q -a_srs EPSG:4326 -a_ullr %.12f %.12f %.12f %.12f %s %s'
+               % (ulx, uly, lrx, lry, temp_path, file_path))
+        os.system(cmd)
+        os.remove(temp_path)
+        if not os.path.exists(file_path):
+            raise Exception('Failed to create output image file!')
+        print 'Wrote ' + file_path
+        return True
@@ -23,7 +23,7 @@ import math
 from cmt.domain import Domain
 from cmt.modis.simple_modis_algorithms import *
 from cmt.mapclient_qt import addToMap
-from cmt.util.miscUtilities import safe_get_info
+from cmt.util.miscUtilities import safe_get_info, safe_get_info_list
 import cmt.modis.modis_utilities
 
 """
@@ -109,11 +109,15 @@ def _find_adaboost_optimal_threshold(domains, images, truths, band_name, weights
     domain_range = range(len(domains))
     best         = None
     best_value   = None
+    
+    # The error sums for every threshold are independent so request them all concurrently
+    num_images = len(images)
+    all_errors = safe_get_info_list([weights[i].multiply(images[i].select(band_name).lte(c).neq(truths[i])).reduceRegion(ee.Reducer.sum(), domains[i].bounds, EVAL_RESOLUTION, 'EPSG:4326')
+                                     for c in choices for i in range(num_images)])
     for k in range(len(choices)):
         # Pick a threshold and count how many pixels fall under it across all the input images
         c = choices[k]
-        errors = [safe_get_info(weights[i].multiply(images[i].select(band_name).lte(c).neq(truths[i])).reduceRegion(ee.Reducer.sum(), domains[i].bounds, EVAL_RESOLUTION, 'EPSG:4326'))['constant']
-                       for i in range(len(images))]
+        errors = [e['constant'] for e in all_errors[k*num_images:(k+1)*num_images]]
         error  = sum(errors)
         #threshold_sums = [safe_get_info(weights[i].mask(images[i].select(band_name).lte(c)).reduceRegion(ee.Reducer.sum(), domains[i].bounds, EVAL_RESOLUTION))['constant'] for i in domain_range]
         #flood_and_threshold_sum = sum(threshold_sums)
@@ -316,7 +320,7 @@ def adaboost_learn(ignored=None, ignored2=None):
     bands             = safe_get_info(training_images[0].bandNames())
     print 'Computing threshold ranges.'
     band_splits = __compute_threshold_ranges(training_domains, training_images, water_masks, bands)
-    counts = [safe_get_info(training_images[i].select('b1').reduceRegion(ee.Reducer.count(), training_domains[i].bounds, 250))['b1'] for i in range(len(training_images))]
+    counts = [c['b1'] for c in safe_get_info_list([training_images[i].select('b1').reduceRegion(ee.Reducer.count(), training_domains[i].bounds, 250) for i in range(len(training_images))])]
     count = sum(counts)
     weights = [ee.Image(1.0 / count) for i in training_images] # Each input pixel in the training images has an equal weight
     
@@ -362,7 +366,7 @@ def adaboost_learn(ignored=None, ignored2=None):
         
         # update the weights
         weights = [weights[i].multiply(apply_classifier(training_images[i], classifier[0], classifier[1]).multiply(transformed_masks[i]).multiply(-alpha).exp()) for i in range(len(training_images))]
-        totals  = [safe_get_info(weights[i].reduceRegion(ee.Reducer.sum(), training_domains[i].bounds, EVAL_RESOLUTION))['constant'] for i in range(len(training_images))]
+        totals  = [t['constant'] for t in safe_get_info_list([weights[i].reduceRegion(ee.Reducer.sum(), training_domains[i].bounds, EVAL_RESOLUTION) for i in range(len(training_images))])]
         total   = sum(totals)
         weights = [w.divide(total) for w in weights]
         print full_classifier
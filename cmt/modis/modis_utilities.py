@@ -83,8 +83,8 @@ def getModisBadPixelMask(lowResModis):
     #mask = landWaterFlag.neq(7).And(cloud.Not())
     #return mask
 
-def getCloudPercentage(lowResModis, region):
-    '''Returns the percentage of a region flagged as clouds by the MODIS metadata'''
+def computeCloudPercentage(lowResModis, region):
+    '''Returns an ee.Number with the percentage of a region flagged as clouds by the MODIS metadata'''
 
     MODIS_CLOUD_RESOLUTION = 1000 # Clouds are flagged at this resolution
 
@@ -93,9 +93,11 @@ def getCloudPercentage(lowResModis, region):
     cloudMask  = getModisBadPixelMask(lowResModis)
     areaCount  = oneMask.reduceRegion(  ee.Reducer.sum(), region, MODIS_CLOUD_RESOLUTION)
     cloudCount = cloudMask.reduceRegion(ee.Reducer.sum(), region, MODIS_CLOUD_RESOLUTION)
-    percentage = safe_get_info(cloudCount)['cloud_state'] / safe_get_info(areaCount)['constant']
+    return ee.Number(cloudCount.get('cloud_state')).divide(areaCount.get('constant'))
 
-    return percentage
+def getCloudPercentage(lowResModis, region):
+    '''Returns the percentage of a region flagged as clouds by the MODIS metadata'''
+    return safe_get_info(computeCloudPercentage(lowResModis, region))
 
 def get_permanent_water_mask():
     return ee.Image("MODIS/MOD44W/MOD44W_005_2000_02_24").select(['water_mask'], ['b1'])
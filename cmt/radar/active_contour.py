@@ -16,10 +16,15 @@
 # -----------------------------------------------------------------------------
 
 from cmt.local_ee_image import LocalEEImage
+from cmt.util.ee_batch import get_info_batch
 
 import ee
 
+import collections
+import heapq
 import math
+import multiprocessing
+import numpy
 
 # TODO: Move out of the radar directory?
 
@@ -43,8 +48,9 @@ def compute_band_statistics(ee_image, classified_image, region):
     ALLOWED_DEVIATIONS = 2.5 # For now this is a constant
     
     masked_image = ee_image.mask(classified_image)
-    means        = masked_image.reduceRegion(ee.Reducer.mean(),   region, EVAL_RESOLUTION).getInfo() # These result in lists with one entry per band
-    stdDevs      = masked_image.reduceRegion(ee.Reducer.stdDev(), region, EVAL_RESOLUTION).getInfo()
+    # These result in lists with one entry per band
+    (means, stdDevs) = get_info_batch([masked_image.reduceRegion(ee.Reducer.mean(),   region, EVAL_RESOLUTION),
+                                       masked_image.reduceRegion(ee.Reducer.stdDev(), region, EVAL_RESOLUTION)])
     
     # Pack up the results per-band
     band_statistics = []
@@ -73,17 +79,17 @@ def compute_band_statistics_features(ee_image, regionList):
     listFormat = regionList.toList(100)
     numInputs  = listFormat.size().getInfo()
     for index in range(numInputs):
-        region = listFormat.get(index)
+        regionInfo = listFormat.get(index).getInfo()
         # Skip land regions (water is 1)
-        if region.getInfo()['properties']['classification'] != 1:
+        if regionInfo['properties']['classification'] != 1:
             continue
         
         # Need to take the border out of EE format and then put it back in!
-        regionBorder = ee.Geometry.LinearRing(region.getInfo()['geometry']['coordinates'])
+        regionBorder = ee.Geometry.LinearRing(regionInfo['geometry']['coordinates'])
         
         # These result in lists with one entry per band
-        means   = masked_image.reduceRegion(ee.Reducer.mean(),   regionBorder, EVAL_RESOLUTION).getInfo()
-        stdDevs = masked_image.reduceRegion(ee.Reducer.stdDev(), regionBorder, EVAL_RESOLUTION).getInfo()
+        (means, stdDevs) = get_info_batch([masked_image.reduceRegion(ee.Reducer.mean(),   regionBorder, EVAL_RESOLUTION),
+                                           masked_image.reduceRegion(ee.Reducer.stdDev(), regionBorder, EVAL_RESOLUTION)])
         # Accumulate the mean and standard deviation for each band over the regions
         for km, ks in zip(means, stdDevs):
             meanSums[km] = (meanSums[km]+means[km]  ) if (km in meanSums) else (means[km]  )
@@ -103,6 +109,86 @@ def compute_band_statistics_features(ee_image, regionList):
     return (band_names, band_statistics)
 
 
+class SegmentGrid(object):
+    '''Uniform grid spatial index over (x_min, x_max, y_min, y_max) bounding boxes.
+       - Used to restrict intersection tests to segments and loops which are close together.'''
+
+    CELL_SIZE = 32 # In pixels
+
+    def __init__(self, cell_size=None):
+        self.cell_size = cell_size if cell_size else self.CELL_SIZE
+        self.cells     = collections.defaultdict(list)
+        self.entries   = dict() # key -> (insertion order, list of cells)
+        self.counter   = 0
+
+    def _get_cells(self, bbox):
+        (x_min, x_max, y_min, y_max) = bbox
+        cs = self.cell_size
+        return [(cx, cy) for cx in range(int(math.floor(x_min / cs)), int(math.floor(x_max / cs)) + 1)
+                         for cy in range(int(math.floor(y_min / cs)), int(math.floor(y_max / cs)) + 1)]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def insert(self, key, bbox):
+        cells = self._get_cells(bbox)
+        self.entries[key] = (self.counter, cells)
+        self.counter += 1
+        for c in cells:
+            self.cells[c].append(key)
+
+    def remove(self, key):
+        (order, cells) = self.entries.pop(key)
+        for c in cells:
+            self.cells[c].remove(key)
+
+    def query(self, bbox):
+        '''Returns all keys with a cell in common with bbox, in insertion order.'''
+        found = set()
+        for c in self._get_cells(bbox):
+            found.update(self.cells.get(c, []))
+        return sorted(found, key=lambda k: self.entries[k][0])
+
+def _segment_bbox(a, b):
+    return (min(a[0], b[0]), max(a[0], b[0]), min(a[1], b[1]), max(a[1], b[1]))
+
+def _bboxes_overlap(a, b):
+    return (a[0] <= b[1]) and (b[0] <= a[1]) and (a[2] <= b[3]) and (b[2] <= a[3])
+
+
+def _xy(p):
+    '''Split a point or an array of points in to x and y float components'''
+    p = numpy.asarray(p, dtype=numpy.float64)
+    return (p[..., 0], p[..., 1])
+
+
+class NodeArray(object):
+    '''Compact read only storage for the nodes of a retired Loop.
+       - Stores int32 x and y coordinates and a uint16 count of how long each node has been still.
+       - Nodes read back as (x, y, still) tuples and slices as lists of tuples, like the node
+         list of an active Loop.'''
+
+    __slots__ = ('x', 'y', 'still')
+
+    MAX_STILL = numpy.iinfo(numpy.uint16).max
+
+    def __init__(self, nodes):
+        nodes = list(nodes)
+        self.x     = numpy.array([n[0] for n in nodes], dtype=numpy.int32)
+        self.y     = numpy.array([n[1] for n in nodes], dtype=numpy.int32)
+        self.still = numpy.array([min(n[2], self.MAX_STILL) for n in nodes], dtype=numpy.uint16)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return zip(self.x[i].tolist(), self.y[i].tolist(), self.still[i].tolist())
+        return (int(self.x[i]), int(self.y[i]), int(self.still[i]))
+
+    def __iter__(self):
+        return iter(self[:])
+
 class Loop(object):
     MIN_NODE_SEPARATION    =    5 # In pixels
     MAX_NODE_SEPARATION    =   15
@@ -138,6 +224,29 @@ class Loop(object):
         self.almost_done_count = 0
         self.band_statistics = band_statistics
         self.image_is_log_10 = image_is_log_10
+        self._invalidate_geometry()
+
+    def _invalidate_geometry(self):
+        '''Must be called whenever the nodes change so the cached geometry is rebuilt.'''
+        self._bbox          = None
+        self._segment_index = None
+
+    def get_bounding_box(self):
+        '''Returns (x_min, x_max, y_min, y_max) of the nodes in the loop'''
+        if self._bbox is None:
+            xs = [n[0] for n in self.nodes]
+            ys = [n[1] for n in self.nodes]
+            self._bbox = (min(xs), max(xs), min(ys), max(ys))
+        return self._bbox
+
+    def _get_segment_index(self):
+        '''Returns a SegmentGrid of the loop segments, keyed by the index of the segment end node'''
+        if self._segment_index is None:
+            self._segment_index = SegmentGrid()
+            for i in range(len(self.nodes)):
+                prev_i = (i - 1) if (i > 0) else (len(self.nodes) - 1)
+                self._segment_index.insert(i, _segment_bbox(self.nodes[prev_i], self.nodes[i]))
+        return self._segment_index
 
     def get_image_width(self):
         return self.data.size()[0]
@@ -176,10 +285,10 @@ class Loop(object):
         return intersections
 
     def _is_clockwise(self):
+        pts = [(n[0], n[1]) for n in self.nodes]
         s = 0
-        for i in range(len(self.nodes)):
-            n = (i + 1) if (i < len(self.nodes) - 1) else 0 # TODO: There should be a function for this line!
-            s += (self.nodes[n][0] - self.nodes[i][0]) * (self.nodes[n][1] + self.nodes[i][1])
+        for (a, b) in zip(pts, pts[1:] + pts[:1]):
+            s += (b[0] - a[0]) * (b[1] + a[1])
         return s >= 0
     
     def _inside_line(self, a, b, x):
@@ -218,108 +327,157 @@ class Loop(object):
         new += (n3[0] -  n[0]) ** 2 + (n3[1] -  n[1]) ** 2
         return new - old
 
+    def _curvatures(self, n1, n2, n3, nn1=None, nn2=None, nn3=None):
+        '''Array version of _curvature, any of the points may be arrays of points.'''
+        (n1x, n1y) = _xy(n1)
+        (n2x, n2y) = _xy(n2)
+        (n3x, n3y) = _xy(n3)
+        a1 = numpy.arctan2(n1y - n2y, n1x - n2x)
+        a2 = numpy.arctan2(n3y - n2y, n3x - n2x)
+        if nn1 is not None:
+            (px, py) = _xy(nn1)
+            b1 = numpy.arctan2(py  - n2y, px  - n2x)
+            b2 = numpy.arctan2(n3y - n2y, n3x - n2x)
+        elif nn2 is not None:
+            (px, py) = _xy(nn2)
+            b1 = numpy.arctan2(n1y - py, n1x - px)
+            b2 = numpy.arctan2(n3y - py, n3x - px)
+        else:
+            (px, py) = _xy(nn3)
+            b1 = numpy.arctan2(n1y - n2y, n1x - n2x)
+            b2 = numpy.arctan2(py  - n2y, px  - n2x)
+        change = (b1 - b2) - (a1 - a2)
+        change = numpy.mod(change + math.pi, 2 * math.pi) - math.pi # Wrap to +/- pi
+
+        mid1 = (n1x - n2x, n1y - n2y)
+        mid2 = (n3x - n2x, n3y - n2y)
+        a = numpy.sqrt((mid2[0] - mid1[0]) ** 2 + (mid2[1] - mid1[1]) ** 2)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return numpy.where(a == 0, numpy.inf, change * change / a)
+
+    def _tensions(self, n1, n2, n3, n):
+        '''Array version of _tension, any of the points may be arrays of points.'''
+        (n1x, n1y) = _xy(n1)
+        (n2x, n2y) = _xy(n2)
+        (n3x, n3y) = _xy(n3)
+        (nx,  ny ) = _xy(n)
+        old =  (n2x - n1x) ** 2 + (n2y - n1y) ** 2
+        old += (n3x - n2x) ** 2 + (n3y - n2y) ** 2
+        new =  ( nx - n1x) ** 2 + ( ny - n1y) ** 2
+        new += (n3x -  nx) ** 2 + (n3y -  ny) ** 2
+        return new - old
+
+    def _get_band_window(self, bbox):
+        '''Fetch the image values inside bbox as a (num_bands, width, height) float array'''
+        (x_min, x_max, y_min, y_max) = bbox
+        num_bands = len(self.band_statistics)
+        window = numpy.empty((num_bands, x_max - x_min, y_max - y_min), dtype=numpy.float64)
+        for i in range(num_bands):
+            if self.image_is_log_10: # Uses the precomputed log10 plane if the image has one
+                window[i] = self.data.get_log10_window(self.data.bands[i], x_min, x_max, y_min, y_max)
+            else:
+                window[i] = self.data.get_band_by_index(i)[x_min:x_max, y_min:y_max]
+        return window
+
     # Cost function for how much pixels inside curve (n1, n2, n3) within bbox look like water
     def _get_goodness(self, bbox, n1, n2, n3): # n1,n2,n3 are three points on the contour
+        (counts, goodness) = self._get_goodness_batch(bbox, n1, [n2], n3)
+        return (counts[0], goodness[0])
 
-        # These are used to compute if points are inside the contour
-        acute   = self._inside_line(n1, n2, n3)
-        n21diff = (n2[0] - n1[0], n2[1] - n1[1])
-        n32diff = (n3[0] - n2[0], n3[1] - n2[1])
+    def _get_goodness_batch(self, bbox, n1, candidates, n3, window=None):
+        '''Evaluate the goodness function for every candidate position of the middle node at once.
+           - Returns a (counts, goodness) pair of arrays with one entry per candidate.'''
+
+        c = numpy.array([(n[0], n[1]) for n in candidates], dtype=numpy.float64)
+        if window is None:
+            window = self._get_band_window(bbox)
+        cx = c[:, 0, numpy.newaxis, numpy.newaxis]
+        cy = c[:, 1, numpy.newaxis, numpy.newaxis]
+
+        # add .5 so we don't get integer effects where a
+        # shift of one pixel removes the entire row
+        px = (numpy.arange(bbox[0], bbox[1]) + 0.5)[numpy.newaxis, :, numpy.newaxis]
+        py = (numpy.arange(bbox[2], bbox[3]) + 0.5)[numpy.newaxis, numpy.newaxis, :]
+
+        # These are used to compute if points are inside the contour, same as
+        #  _inside_line(n1, n2, p) and _inside_line(n2, n3, p) for every candidate n2
+        inside1 = ((cx - n1[0]) * (cy - py) - (cy - n1[1]) * (cx - px)) >= 0
+        inside2 = ((n3[0] - cx) * (n3[1] - py) - (n3[1] - cy) * (n3[0] - px)) >= 0
+        acute   = ((cx - n1[0]) * (cy - n3[1]) - (cy - n1[1]) * (cx - n3[0])) >= 0
+        inside  = numpy.where(acute, inside1 & inside2, inside1 | inside2).astype(numpy.float64)
+
+        # Accumulate the per-band sum and sum of squares inside each candidate contour
+        counts      = inside.sum(axis=(1, 2))
+        band_sums   = numpy.einsum('kxy,bxy->kb', inside, window)
+        band_sums_2 = numpy.einsum('kxy,bxy->kb', inside, window * window)
+
+        return (counts, self._compute_goodness(counts, band_sums, band_sums_2))
+
+    def _compute_goodness(self, counts, band_sums, band_sums_2):
+        '''Perform the goodness calculations for each band and take the mean of the band responses.
+           - counts is an array of pixel counts, band_sums and band_sums_2 are (candidates, bands) arrays.'''
+
+        stats = numpy.array(self.band_statistics, dtype=numpy.float64)
+        (expected_water_mean, expected_water_std_dev, allowed_deviations) = (stats[:, 0], stats[:, 1], stats[:, 2])
+
+        n = counts[:, numpy.newaxis]
+        empty = (counts == 0) # No points inside the contour
+        safe_n = numpy.where(n == 0, 1.0, n)
+        mean   = band_sums   / safe_n
+        mean_2 = band_sums_2 / safe_n
+        var = numpy.maximum(mean_2 - mean ** 2, 0.0) # can be negative due to precision errors
+
+        # Computations from the paper -> Compare std and mean to constant expected values
+        V   = expected_water_std_dev ** 2
+        g_u = 1.0 - ((mean - expected_water_mean) ** 2) / (V * (allowed_deviations ** 2))
+        g_u = numpy.clip(g_u, -1.0, 1.0)
+        #P = 1.01 + 0.258 * n
+        # we have more pixels so use different order function
+        P     = 1.01 + 0.02 * n
+        sigma = V * (1 - 0.509 * numpy.exp(-0.0744 * n))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            g_v = 1.0 / (allowed_deviations ** 2) * (-P * V / sigma +
+                P * numpy.log(P * var / sigma) - numpy.log(var))
+        # for some reason I don't think it's negative in the paper,
+        # but it clearly ought to be
+        g_v = numpy.clip(-g_v + self.VARIANCE_C, -1.0, 1.0)
+        g_v = numpy.where(var == 0.0, 0.0, g_v)
+        g = (g_u + g_v) / 2.0
 
-        # Initialize computation storage        
-        num_bands     = len(self.get_image_pixel(0, 0))
-        band_means   = [0]*num_bands
-        band_means_2 = [0]*num_bands
-        band_counts  = [0]*num_bands
-        
-        # Go over everything in bbox, check if it is inside the contour,
-        #  and find the mean and standard deviation of those locations.
-        for x in range(bbox[0], bbox[1]):
-            for y in range(bbox[2], bbox[3]):
-                # add .5 so we don't get integer effects where a
-                # shift of one pixel removes the entire row
-                p = (x + 0.5, y + 0.5)
-                # doing this still but optimized more
-                # inside1 =  self._inside_line(n1, n2, p)
-                # inside2 =  self._inside_line(n2, n3, p)
-                inside1 = (n21diff[0] * (n2[1] - p[1]) - n21diff[1] * (n2[0] - p[0])) >= 0
-                inside2 = (n32diff[0] * (n3[1] - p[1]) - n32diff[1] * (n3[0] - p[0])) >= 0
-                if acute:
-                    if not (inside1 and inside2):
-                        continue
-                else:
-                    if (not inside1) and (not inside2):
-                        continue
-                
-                # Get the value at this point
-                pixel = self.get_image_pixel(x, y)
-                
-                # Accumulate mean and std data for each band
-                for i in range(0,num_bands):
-                    val = pixel[i]
-                    band_means[i]   += val
-                    band_means_2[i] += val ** 2
-                    band_counts[i]  += 1
-        
-        # Perform goodness calculations for each band
-        mean_count = 0
-        mean_good  = 0
-        for i in range(0,num_bands):
-            
-            # Extract paremeters for this band
-            mean   = band_means[i]
-            mean_2 = band_means_2[i]
-            n      = band_counts[i]
-
-            (expected_water_mean, expected_water_std_dev, allowed_deviations) = self.band_statistics[i]
-            #print str(expected_water_mean) +', ' +  str(expected_water_std_dev)
-            
-            if n == 0: # No points inside the contour
-                return (0, 0)
-            
-            mean   /= float(n)
-            mean_2 /= float(n)
-            var = mean_2 - mean ** 2
-            if var <= 0.0:
-                var = 0.0 # can happen due to precision errors
-                
-            # Computations from the paper -> Compare std and mean to constant expected values
-            V   = expected_water_std_dev ** 2
-            g_u = 1.0 - ((mean - expected_water_mean) ** 2) / (V * (allowed_deviations ** 2))
-            g_u = max(-1.0, min(1.0, g_u))
-            #P = 1.01 + 0.258 * n
-            # we have more pixels so use different order function
-            P     = 1.01 + 0.02 * n
-            sigma = V * (1 - 0.509 * math.exp(-0.0744 * n))
-            if var == 0.0:
-                g_v = 0.0
-            else:
-                g_v = 1.0 / (allowed_deviations ** 2) * (-P * V / sigma +
-                    P * math.log(P * var / sigma) - math.log(var))
-                # for some reason I don't think it's negative in the paper,
-                # but it clearly ought to be
-                g_v = -g_v + self.VARIANCE_C
-                g_v = max(-1.0, min(1.0, g_v))
-            g = (g_u + g_v) / 2.0
-            
-            mean_count += n
-            mean_good  += g
-            
         # Take the mean of all the band's responses.
-        mean_count /= num_bands
-        mean_good  /= num_bands
-        #print str(mean_count) + ', ' + str(mean_good)
-        
-        return (mean_count, mean_good)
+        mean_good = g.mean(axis=1)
+        mean_good[empty] = 0.0
+        return mean_good
 
     NEIGHBORS = [(-1, -1), (-1, 0), (-1, 1),
                  ( 0, -1),          ( 0, 1),
                  ( 1, -1), ( 1, 0), ( 1, 1)]
+
+    def _get_move_costs(self, pp, n1, n2, n3, nn):
+        '''Curvature and tension penalties for moving n2 to each of its NEIGHBORS.
+           - The arguments are (m, 2) arrays holding the five consecutive nodes around m nodes.
+           - Returns (curveg, tensiong), each an (m, len(NEIGHBORS)) array.'''
+        (pp, n1, n2, n3, nn) = [numpy.asarray(q, dtype=numpy.float64)[:, numpy.newaxis, :]
+                                for q in (pp, n1, n2, n3, nn)]
+        moves = n2 + numpy.array(self.NEIGHBORS, dtype=numpy.float64)
+        # penalty for curving sharply
+        curveg = self._curvatures(n1, n2, n3, nn2=moves) + \
+                 self._curvatures(pp, n1, n2, nn2=moves) + \
+                 self._curvatures(n2, n3, nn, nn1=moves)
+        # encourage nodes to stay the right distance apart
+        tensiong = self._tensions(n1, n2, n3, moves)
+        return (curveg, tensiong)
+
+    def _get_all_move_costs(self):
+        '''_get_move_costs for every node in the loop at once'''
+        pts = numpy.array([(n[0], n[1]) for n in self.nodes], dtype=numpy.float64)
+        return self._get_move_costs(numpy.roll(pts,  2, axis=0), numpy.roll(pts,  1, axis=0), pts,
+                                    numpy.roll(pts, -1, axis=0), numpy.roll(pts, -2, axis=0))
+
     # shift a single node to neighboring pixel which reduces cost function the most
-    def _shift_node(self, i):
+    # - costs is this node's row of _get_all_move_costs, it is computed here if not provided.
+    def _shift_node(self, i, costs=None):
         n2 = self.nodes[i]
-        if n2[2] > 5:
-            return n2
         p     = (i - 1) if (i > 0)                   else (len(self.nodes) - 1)
         pp    = (p - 1) if (p > 0)                   else (len(self.nodes) - 1)
         n     = (i + 1) if (i < len(self.nodes) - 1) else 0
@@ -332,86 +490,153 @@ class Loop(object):
         y_min = max(0,                       n2[1] - self.SEED_REGION_BORDER)
         y_max = min(self.get_image_height(), n2[1] + self.SEED_REGION_BORDER)
         bbox = (x_min, x_max, y_min, y_max)
-    
-        best = n2 
-        (original_count, ignored) = self._get_goodness(bbox, n1, n2, n3)
-        best_goodness = 0
-    
-        for d in self.NEIGHBORS:
+
+        # don't move outside image
+        candidates = [n2]
+        moves      = [] # Index in to NEIGHBORS of each candidate after the first
+        for (k, d) in enumerate(self.NEIGHBORS):
             np = (n2[0] + d[0], n2[1] + d[1])
-            # don't move outside image
             if ( (np[0] < 0) or (np[0] >= self.get_image_width() ) or
                  (np[1] < 0) or (np[1] >= self.get_image_height())   ):
                 continue
-            # find how similar pixels inside curve are to expected water distribution
-            (count, g) = self._get_goodness(bbox, n1, np, n3)
+            candidates.append(np)
+            moves.append(k)
+        if not moves:
+            return (n2[0], n2[1], n2[2] + 1)
+
+        # find how similar pixels inside curve are to expected water distribution,
+        #  evaluating the current position and all the neighbors in one pass
+        (counts, goodness) = self._get_goodness_batch(bbox, n1, candidates, n3)
+        original_count = counts[0]
+
+        if costs is None: # Score the moves one at a time, cheaper than numpy for a single node
             # penalty for curving sharply
-            curveg = self._curvature(n1,             n2, n3,             nn2=np) + \
-                     self._curvature(self.nodes[pp], n1, n2,             nn2=np) + \
-                     self._curvature(n2,             n3, self.nodes[nn], nn1=np)
+            curveg = numpy.array([self._curvature(n1,             n2, n3,             nn2=np) +
+                                  self._curvature(self.nodes[pp], n1, n2,             nn2=np) +
+                                  self._curvature(n2,             n3, self.nodes[nn], nn1=np)
+                                  for np in candidates[1:]])
             # encourage nodes to stay the right distance apart
-            tensiong = self._tension(n1, n2, n3, np)
-            fullg = (count - original_count) * g - self.CURVATURE_GAMMA * curveg - \
-                    self.TENSION_LAMBDA * tensiong
-            if fullg > best_goodness:
-                best_goodness = fullg
-                best          = np
-        if best_goodness == 0:
+            tensiong = numpy.array([self._tension(n1, n2, n3, np) for np in candidates[1:]])
+        else:
+            (curveg, tensiong) = (costs[0][moves], costs[1][moves])
+        fullg = (counts[1:] - original_count) * goodness[1:] - self.CURVATURE_GAMMA * curveg - \
+                self.TENSION_LAMBDA * tensiong
+        fullg[numpy.isnan(fullg)] = -numpy.inf # Never move to a position which could not be scored
+        best = numpy.argmax(fullg) # Picks the first of any ties
+        if not (fullg[best] > 0):
             return (n2[0], n2[1], n2[2] + 1)
         else:
-            return (best[0], best[1], 0)
+            return (candidates[best + 1][0], candidates[best + 1][1], 0)
+
+    # Nodes whose cost terms use a moved node, the curvature terms reach two nodes away
+    DIRTY_NEIGHBORS = [-2, -1, 1, 2]
 
-    # shift all nodes in loop to neighboring pixel of lowest cost
+    @classmethod
+    def _mark_dirty(cls, nodes, k):
+        '''Reset the still count of node k and of the nodes whose cost terms use it'''
+        for d in [0] + cls.DIRTY_NEIGHBORS:
+            m = (k + d) % len(nodes)
+            nodes[m] = (nodes[m][0], nodes[m][1], 0)
+
+    # shift the dirty nodes in loop to neighboring pixel of lowest cost
+    # - A node is dirty (still count of zero) if it or one of its neighbors moved since it was
+    #   last evaluated, nodes which are not dirty would give the same result so they are skipped.
     def shift_nodes(self):
         if self.done:
             return
+        self._invalidate_geometry()
         self.moving_count = 0
-        for i in range(len(self.nodes)):
-            self.nodes[i] = self._shift_node(i)
+        nodes     = self.nodes
+        num_nodes = len(nodes)
+        queue  = [i for i in range(num_nodes) if nodes[i][2] == 0] # Already in increasing order
+        queued = set(queue)
+        # The curvature and tension terms of all nodes are computed up front, only the
+        #  nodes next to a node which moved during this pass need them recomputed.
+        if queue:
+            (curvegs, tensiongs) = self._get_all_move_costs()
+        stale = set()
+        while queue:
+            i = heapq.heappop(queue)
+            nodes[i] = self._shift_node(i, None if (i in stale) else (curvegs[i], tensiongs[i]))
+            if nodes[i][2] != 0: # Did not move
+                continue
             # this node updated, neighboring nodes should too
-            if self.nodes[i][2] == 0:
-                p = (i - 1) if (i > 0)                   else (len(self.nodes) - 1)
-                n = (i + 1) if (i < len(self.nodes) - 1) else 0
-                self.nodes[p] = (self.nodes[p][0], self.nodes[p][1], 0)
-                self.nodes[n] = (self.nodes[n][0], self.nodes[n][1], 0)
-                self.moving_count += 1
+            # - Nodes after this one are handled in this pass, earlier ones in the next pass.
+            for d in self.DIRTY_NEIGHBORS:
+                k = (i + d) % num_nodes
+                nodes[k] = (nodes[k][0], nodes[k][1], 0)
+                stale.add(k)
+                if (k > i) and (k not in queued):
+                    heapq.heappush(queue, k)
+                    queued.add(k)
+            self.moving_count += 1
+        # retire the loop once no nodes are left to evaluate and the spacing has settled
+        if not any([n[2] == 0 for n in nodes]):
+            self.respace_nodes()
+            if not any([n[2] == 0 for n in self.nodes]):
+                self.retire()
+            return
         if self.moving_count <= 4 or float(self.moving_count) / len(self.nodes) < 0.05:
             self.almost_done_count += 1
         else:
             self.almost_done_count = 0
         # just mark it as done after a while of small oscillations
         if self.almost_done_count >= 50:
-            self.done = True
+            self.retire()
+
+    def retire(self):
+        '''Mark the loop as done, its nodes will not change again so they are packed in to a NodeArray'''
+        self.done  = True
+        self.nodes = NodeArray(self.nodes)
     
     # insert new nodes if nodes are too far apart
     # remove nodes if too close together
+    # - The loop is rebuilt in a single walk instead of inserting and deleting in place.
     def respace_nodes(self):
         if self.done:
             return
+        self._invalidate_geometry()
+        checked = [self.nodes[0]]                # Nodes which have been checked, the last is the current node
+        ahead   = list(reversed(self.nodes[1:])) # Nodes still to check, the next node is at the end
+
+        def position(k):
+            '''Returns (list, index) of the node k positions after the current node'''
+            q = (len(checked) - 1 + k) % (len(checked) + len(ahead))
+            if q < len(checked):
+                return (checked, q)
+            return (ahead, len(ahead) - 1 - (q - len(checked)))
+        def reset(k):
+            (l, j) = position(k)
+            l[j]   = (l[j][0], l[j][1], 0)
+
         # go through nodes in loop
-        i = 0
-        while i < len(self.nodes):
-            n     = (i + 1) if (i < len(self.nodes) - 1) else 0
-            dist2 = (self.nodes[i][0] - self.nodes[n][0]) ** 2 + (self.nodes[i][1] - self.nodes[n][1]) ** 2
+        while True:
+            (l, j) = position(1)
+            cur    = checked[-1]
+            dist2  = (cur[0] - l[j][0]) ** 2 + (cur[1] - l[j][1]) ** 2
             # delete node if too close
             if dist2 < self.MIN_NODE_SEPARATION ** 2:
-                # update neighbors
-                if len(self.nodes) <= 2:
+                if len(checked) + len(ahead) <= 2:
+                    break
+                del l[j]
+                # update the neighbors of the deleted node, it was at position 1 and
+                #  the nodes after it have moved back by one
+                for d in self.DIRTY_NEIGHBORS:
+                    reset((d + 1) if (d < 0) else d)
+                if l is checked: # The first node was deleted, same as stopping after the last node
                     break
-                self.nodes[i] = (self.nodes[i][0], self.nodes[i][1], 0)
-                del self.nodes[n]
-                n = n if (n < len(self.nodes)) else 0 # last might have been deleted
-                self.nodes[n] = (self.nodes[n][0], self.nodes[n][1], 0)
                 continue
             # add node if too far
             elif dist2 > self.MAX_NODE_SEPARATION ** 2:
-                mid = ((self.nodes[i][0] + self.nodes[n][0]) / 2, (self.nodes[i][1] + self.nodes[n][1]) / 2, 0)
-                # update neighbors
-                self.nodes[i] = (self.nodes[i][0], self.nodes[i][1], 0)
-                self.nodes[n] = (self.nodes[n][0], self.nodes[n][1], 0)
-                self.nodes.insert(i + 1, mid)
+                ahead.append(((cur[0] + l[j][0]) / 2, (cur[1] + l[j][1]) / 2, 0))
+                # update the neighbors of the new node at position 1
+                for d in self.DIRTY_NEIGHBORS:
+                    reset(d + 1)
                 continue
-            i += 1
+            if not ahead:
+                break
+            checked.append(ahead.pop())
+        self.nodes = checked + ahead[::-1]
 
     # recursively create new loops based on intersections, in loop between
     # loop_start and loop_end
@@ -423,10 +648,9 @@ class Loop(object):
         all_loops = []
         def lind(n):
             return n if n >= loop_start else n + len(self.nodes)
-        split_before = False
+        junctions = [] # Index in cur_loop of the node before each new connection
         # find next intersection
         while True:
-            initial_length = len(cur_loop)
             closest = lind(loop_end-1) # don't include new loop where prev = loop_end
             closest_other = None
             # find next intersection
@@ -447,21 +671,21 @@ class Loop(object):
             else:
                 cur_loop.extend(self.nodes[i:closest_next])
             if closest_other == None:
-                if split_before:
-                    cur_loop[0] = (cur_loop[0][0], cur_loop[0][1], 0)
                 break
             # recursively create new loops within next intersections
             new_loops = self._create_loops(intersections, closest_next, closest_other)
-            # update neighbors that had changed connectivity
-            cur_loop[initial_length] = (cur_loop[initial_length][0], cur_loop[initial_length][1], 0)
-            cur_loop[-1] = (cur_loop[-1][0], cur_loop[-1][1], 0)
-            split_before = True
+            # the next node added is connected to the last one across the intersection
+            junctions.append(len(cur_loop) - 1)
             all_loops.extend(new_loops)
             i = closest_other
             if i == loop_end:
                 break
         if len(cur_loop) <= 2:
             return all_loops
+        # update neighbors that had changed connectivity, including where the loop closes
+        for k in junctions + [len(cur_loop) - 1]:
+            self._mark_dirty(cur_loop, k)
+            self._mark_dirty(cur_loop, k + 1)
         return [Loop(self.data, cur_loop, self.band_statistics, self.image_is_log_10)] + all_loops
 
     def _inside_loop(self, loop):
@@ -494,23 +718,26 @@ class Loop(object):
 
     # returns any new loops that split off
     def fix_self_intersections(self):
-        if self.done:
-            return [self]
         # kill self if empty
         if len(self.nodes) <= 3:
             return []
         # kill self if collapsed and switched orientation
         if self._is_clockwise() != self.clockwise:
             return []
-        # find self intersections
+        if self.done:
+            return [self]
+        # find self intersections, only checking segments which are nearby
         self_intersections = []
+        index = self._get_segment_index()
         for i in range(len(self.nodes)):
             cur1   = self.nodes[i]
             prev_i = (i - 1) if (i > 0) else (len(self.nodes) - 1)
             prev1  = self.nodes[prev_i]
-            for j in range(i+1, len(self.nodes)):
+            for j in index.query(_segment_bbox(prev1, cur1)):
+                if j <= i:
+                    continue
                 prev_j = (j - 1) if (j > 0) else (len(self.nodes) - 1)
-                if (j == i) or (j == prev_i) or (prev_j == i):
+                if (j == prev_i) or (prev_j == i):
                     continue
                 cur2  = self.nodes[j]
                 prev2 = self.nodes[prev_j]
@@ -527,12 +754,15 @@ class Loop(object):
     # merge two loops if they intersect
     def merge(self, other):
         intersection = None
-        # find intersections
+        if not _bboxes_overlap(self.get_bounding_box(), other.get_bounding_box()):
+            return None
+        # find intersections, only checking segments of the other loop which are nearby
+        other_index = other._get_segment_index()
         for i in range(len(self.nodes)):
             cur1   = self.nodes[i]
             prev_i = (i - 1) if (i > 0) else (len(self.nodes) - 1)
             prev1  = self.nodes[prev_i]
-            for j in range(len(other.nodes)):
+            for j in other_index.query(_segment_bbox(prev1, cur1)):
                 prev_j = (j - 1) if (j > 0) else (len(other.nodes) - 1)
                 cur2   = other.nodes[j]
                 prev2  = other.nodes[prev_j]
@@ -545,6 +775,10 @@ class Loop(object):
         (i, j) = intersection
         loop   = self.nodes[0:i] + other.nodes[j:] + other.nodes[0:j] + self.nodes[i:]
         assert len(loop) == len(self.nodes) + len(other.nodes)
+        # update neighbors that had changed connectivity at both splice points
+        for k in (i - 1, i + len(other.nodes) - 1):
+            self._mark_dirty(loop, k)
+            self._mark_dirty(loop, k + 1)
         return Loop(self.data, loop, self.band_statistics, self.image_is_log_10)
 
 # an active contour, which is composed of a number of Loops
@@ -553,8 +787,8 @@ class Snake(object):
         self.local_image = local_image
         self.data = local_image # Using all bands
         
-        # numpy is slower than tuples
-        #initial_nodes = map(lambda x: map(lambda y: np.array(y), x), initial_nodes)
+        # Active loops keep their nodes as a list of tuples, which is faster than numpy for the
+        #  one node at a time updates, and pack them in to a NodeArray once they retire.
         self.loops = [Loop(self.data, l, band_statistics, image_is_log_10) for l in initial_nodes]
         self.done  = False
 
@@ -581,26 +815,32 @@ class Snake(object):
         new_loops = []
         for l in self.loops:
             new_loops.extend(l.fix_self_intersections())
-        self.loops = new_loops
-
-        # merge intersecting loops
-        i = 0
-        while i < len(self.loops):
-            j = i + 1
-            while j < len(self.loops):
-                merged = self.loops[i].merge(self.loops[j])
+
+        # merge intersecting loops, only testing loops with overlapping bounding boxes
+        grid = SegmentGrid()
+        for l in new_loops:
+            grid.insert(l, l.get_bounding_box())
+        all_loops = list(new_loops)
+        queue     = list(reversed(new_loops))
+        while queue:
+            loop = queue.pop()
+            if loop not in grid: # Already merged in to another loop
+                continue
+            for other in grid.query(loop.get_bounding_box()):
+                if other is loop:
+                    continue
+                merged = loop.merge(other)
                 if merged == None:
-                    j += 1
                     continue
-                else:
-                    merged = merged.fix_self_intersections()
-                    del self.loops[j]
-                    self.loops[i:i+1] = merged
-                    # faster way to do this?
-                    if len(merged) > 1:
-                        i -= 1
-                        break
-            i += 1
+                grid.remove(loop)
+                grid.remove(other)
+                # the merged loops need to be checked against everything again
+                for m in merged.fix_self_intersections():
+                    grid.insert(m, m.get_bounding_box())
+                    all_loops.append(m)
+                    queue.append(m)
+                break
+        self.loops = [l for l in all_loops if l in grid]
 
 
     # first is features to paint, second is features to unpaint
@@ -621,8 +861,56 @@ class Snake(object):
         (exterior, interior) = self.to_ee_feature_collections()
         return ee.Image(0).toByte().select(['constant'], ['b1']).paint(exterior, 1).paint(interior, 0)
 
-def initialize_active_contour(domain, ee_image, band_statistics, image_is_log_10=False):
-    '''Initialize a Snake class on an input image'''
+    def to_mask(self):
+        '''Rasterize the snake locally in to a uint8 array aligned with the local image.
+           - Matches to_ee_image without any Earth Engine requests.'''
+        mask = numpy.zeros(self.local_image.size()[0:2], dtype=numpy.uint8)
+        # Paint the filled regions first, then clear the unfilled regions inside them
+        for l in self.loops:
+            if l.clockwise:
+                rasterize_loop(mask, l.nodes, 1)
+        for l in self.loops:
+            if not l.clockwise:
+                rasterize_loop(mask, l.nodes, 0)
+        return mask
+
+    def to_geotiff(self, file_path):
+        '''Write the output of to_mask to a GeoTIFF file'''
+        return self.local_image.write_geotiff(self.to_mask(), file_path)
+
+def rasterize_loop(mask, nodes, value):
+    '''Scanline fill the polygon formed by nodes in to mask.
+       - Nodes are (row, col) pixel centers and a pixel is filled if its center is inside the polygon.'''
+    (h, w) = mask.shape
+    if len(nodes) < 3:
+        return mask
+    pts = numpy.array([(n[0], n[1]) for n in nodes], dtype=numpy.float64)
+    (r, c) = (pts[:, 0], pts[:, 1])
+    r_next = numpy.roll(r, -1)
+    c_next = numpy.roll(c, -1)
+
+    rows = numpy.arange(max(0, int(math.ceil(r.min()))), min(h, int(math.floor(r.max())) + 1))
+    if len(rows) == 0:
+        return mask
+    # Find where each scanline crosses each edge, the half open test avoids counting vertices twice
+    yc      = rows[:, numpy.newaxis].astype(numpy.float64)
+    crosses = (r <= yc) != (r_next <= yc)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        cross_c = c + (yc - r) / (r_next - r) * (c_next - c)
+    for k in range(len(rows)):
+        xs = numpy.sort(cross_c[k][crosses[k]])
+        # Fill between pairs of crossings (even-odd rule)
+        for (xa, xb) in zip(xs[0::2], xs[1::2]):
+            start = max(0, int(math.ceil(xa)))
+            stop  = min(w, int(math.ceil(xb)))
+            if start < stop:
+                mask[rows[k], start:stop] = value
+    return mask
+
+def initialize_active_contour(domain, ee_image, band_statistics, image_is_log_10=False, memory_map=False):
+    '''Initialize a Snake class on an input image
+       - If memory_map is set the image stays on disk and log10 values are only computed for the
+         windows the loops read, otherwise a full log10 plane is built up front.'''
 
     scale_meters = 25 # TODO: Make this a parameter?
     # TODO: Make initial loop sizes a parameter
@@ -632,7 +920,10 @@ def initialize_active_contour(domain, ee_image, band_statistics, image_is_log_10
     band_entries = ee_image.getInfo()['bands']
     band_names   = [b['id'] for b in band_entries]
     #print 'Running active contour on bands: ' + str(band_names)
-    local_image = LocalEEImage(ee_image, domain.bbox, scale_meters, band_names, 'ActiveContour_' + str(domain.name))
+    local_image = LocalEEImage(ee_image, domain.bbox, scale_meters, band_names, 'ActiveContour_' + str(domain.name),
+                               memory_map)
+    if image_is_log_10 and not memory_map: # Take the log once instead of for every node evaluation
+        local_image.build_derived_planes(log10=True)
     (w, h) = local_image.size()
     
     # Initialize the algorithm with a grid of small loops that cover the region of interest
@@ -652,8 +943,150 @@ def initialize_active_contour(domain, ee_image, band_statistics, image_is_log_10
 
 MAX_STEPS = 10000
 
-def active_contour(domain):
-    '''Start up an active contour and process it until it finishes'''
+def run_snake(snake, max_steps=MAX_STEPS):
+    '''Process a snake until it finishes or max_steps is reached'''
+    for i in range(max_steps):
+        if i % 10 == 0:
+            snake.respace_nodes()
+            snake.shift_nodes() # shift before fixing geometry since reversal of orientation possible
+            snake.fix_geometry()
+        else:
+            snake.shift_nodes()
+        if snake.done:
+            # Loops retire as soon as they stop moving, merge their final positions before stopping
+            snake.fix_geometry()
+            if all([l.done for l in snake.loops]):
+                break
+            snake.done = False
+    return snake
+
+#==========================================================================================
+# Tiled processing of a single image across multiple processes
+
+class ImageTile(LocalEEImage):
+    '''A window of a LocalEEImage which can be sent to a worker process.
+       - Builds a log10 plane over the window if the snake runs on log10 values.'''
+
+    def __init__(self, local_image, row_min, row_max, col_min, col_max, image_is_log_10=False):
+        self.bands           = local_image.bands
+        self.offset          = (row_min, col_min)
+        self.images          = dict()
+        self.log10_images    = dict()
+        self.integral_images = dict()
+        for b in self.bands:
+            self.images[b] = local_image.get_window(b, row_min, row_max, col_min, col_max)
+        self.build_derived_planes(log10=image_is_log_10)
+
+def _split_into_tiles(size, tile_size, overlap):
+    '''Returns a list of (core_min, core_max, tile_min, tile_max) ranges covering [0, size)'''
+    ranges = []
+    for core_min in range(0, size, tile_size):
+        core_max = min(size, core_min + tile_size)
+        ranges.append((core_min, core_max, max(0, core_min - overlap), min(size, core_max + overlap)))
+    return ranges
+
+# The image the tile workers cut their tiles from, set by _init_tile_worker
+_tile_source_image = None
+
+def _init_tile_worker(local_image):
+    '''Worker initializer: keep the source image so each job only needs its window coordinates.
+       - With fork the workers share the parent's image instead of receiving a copy.'''
+    global _tile_source_image
+    _tile_source_image = local_image
+
+def _run_tile_snake(args):
+    '''Worker function: run a snake on one tile and return the loops in full image coordinates'''
+    ((r_min, r_max, c_min, c_max), loops, band_statistics, image_is_log_10, max_steps) = args
+    if not loops:
+        return []
+    tile  = ImageTile(_tile_source_image, r_min, r_max, c_min, c_max, image_is_log_10)
+    snake = Snake(tile, loops, band_statistics, image_is_log_10)
+    run_snake(snake, max_steps)
+    (r0, c0) = tile.offset
+    return [([(n[0] + r0, n[1] + c0, n[2]) for n in l.nodes], l.done) for l in snake.loops]
+
+TILE_SIZE         = 512 # In pixels
+TILE_OVERLAP      =  64 # Must be larger than the initial loop size
+SEAM_REFINE_STEPS = 200
+
+def run_snake_tiled(local_image, snake, num_processes=None, tile_size=TILE_SIZE, overlap=TILE_OVERLAP,
+                    max_steps=MAX_STEPS, seam_steps=SEAM_REFINE_STEPS):
+    '''Process a snake by splitting the image in to overlapping tiles which are run in parallel.
+       - Each loop is assigned to the tile containing its first node and is free to grow in to
+         the overlap region.  Loops from neighboring tiles which meet at a seam are merged and
+         the merged loops are refined for seam_steps iterations on the full image.
+       - Returns a new Snake containing the stitched loops.'''
+
+    (w, h) = local_image.size()
+    if num_processes is None:
+        num_processes = multiprocessing.cpu_count()
+
+    first = snake.loops[0] if snake.loops else None
+    band_statistics = first.band_statistics if first else []
+    image_is_log_10 = first.image_is_log_10 if first else False
+
+    # Assign each loop to exactly one tile so the tiles never duplicate work
+    jobs = []
+    for (r_core_min, r_core_max, r_min, r_max) in _split_into_tiles(w, tile_size, overlap):
+        for (c_core_min, c_core_max, c_min, c_max) in _split_into_tiles(h, tile_size, overlap):
+            loops = []
+            for l in snake.loops:
+                (r, c) = (l.nodes[0][0], l.nodes[0][1])
+                if (r_core_min <= r < r_core_max) and (c_core_min <= c < c_core_max):
+                    loops.append([(n[0] - r_min, n[1] - c_min, n[2]) for n in l.nodes])
+            if not loops:
+                continue
+            # The tile itself is cut from the image in the worker so only one copy of it exists at a time
+            jobs.append(((r_min, r_max, c_min, c_max), loops, band_statistics, image_is_log_10, max_steps))
+
+    if num_processes > 1:
+        pool = multiprocessing.Pool(processes=num_processes, initializer=_init_tile_worker,
+                                    initargs=(local_image,))
+        try:
+            results = pool.map(_run_tile_snake, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_tile_worker(local_image)
+        try:
+            results = map(_run_tile_snake, jobs)
+        finally:
+            _init_tile_worker(None)
+
+    # Stitch the loops back together, merging the ones which meet across tile seams
+    tile_loops = [loop for result in results for loop in result]
+    stitched   = Snake(local_image, [nodes for (nodes, done) in tile_loops], band_statistics, image_is_log_10)
+    for (loop, (nodes, done)) in zip(stitched.loops, tile_loops):
+        if done:
+            loop.retire()
+    stitched.fix_geometry()
+    # Merged loops are not done, let them settle on the full image.
+    run_snake(stitched, seam_steps)
+    return stitched
+
+def _get_num_processes(domain, num_processes):
+    '''Read the number of processes from the domain if it was not specified'''
+    if num_processes is not None:
+        return num_processes
+    return int(domain.algorithm_params.get('active_contour_processes', 1))
+
+def _get_memory_map(domain, memory_map):
+    '''Read whether to memory map the image from the domain if it was not specified'''
+    if memory_map is not None:
+        return memory_map
+    return str(domain.algorithm_params.get('active_contour_memory_map', 'false')).lower() == 'true'
+
+def active_contour(domain, num_processes=None, memory_map=None):
+    '''Start up an active contour and process it until it finishes
+       - If num_processes is greater than one the image is split into tiles which are processed in parallel.
+       - If memory_map is set the downloaded image is read from disk as needed instead of loaded in to memory.'''
+    snake = run_active_contour(domain, num_processes, memory_map)
+    return snake.to_ee_image().clip(domain.bounds)
+
+def run_active_contour(domain, num_processes=None, memory_map=None):
+    '''Same as active_contour but returns the finished Snake instead of an ee.Image.
+       - Use Snake.to_mask() or Snake.to_geotiff() to get the result without an Earth Engine request.'''
 
     train_domain   = domain.training_domain   # Since this is radar data, an earlier date is probably not available.
     sensor         = domain.get_radar()
@@ -667,24 +1100,26 @@ def active_contour(domain):
         statisics_image = train_ee_image
     (band_names, band_statistics) = compute_band_statistics(statisics_image, train_domain.ground_truth, train_domain.bounds)
     
-    (local_image, snake) = initialize_active_contour(domain, ee_image, band_statistics, sensor.log_scale)
-    for i in range(MAX_STEPS):
-        if i % 10 == 0:
-            snake.respace_nodes()
-            snake.shift_nodes() # shift before fixing geometry since reversal of orientation possible
-            snake.fix_geometry()
-        else:
-            snake.shift_nodes()
-        if snake.done:
-            break
-    return snake.to_ee_image().clip(domain.bounds)
+    (local_image, snake) = initialize_active_contour(domain, ee_image, band_statistics, sensor.log_scale,
+                                                     _get_memory_map(domain, memory_map))
+    num_processes = _get_num_processes(domain, num_processes)
+    if num_processes > 1:
+        snake = run_snake_tiled(local_image, snake, num_processes)
+    else:
+        run_snake(snake)
+    return snake
 
 
 #==========================================================================================
 
 # Specialized version of this call for Skybox data 
-def active_countour_skybox(domain, modis_indices):
+def active_countour_skybox(domain, modis_indices, num_processes=None, memory_map=None):
     '''Special Active Contour radar function wrapper to work with Skybox images'''
+    snake = run_active_contour_skybox(domain, num_processes, memory_map)
+    return snake.to_ee_image().clip(domain.bounds)
+
+def run_active_contour_skybox(domain, num_processes=None, memory_map=None):
+    '''Same as active_countour_skybox but returns the finished Snake instead of an ee.Image.'''
     
     # Currently the modis data is ignored when running this
     
@@ -703,15 +1138,11 @@ def active_countour_skybox(domain, modis_indices):
     else: # Train using training truth
         (band_names, band_statistics)  = compute_band_statistics(ee_image_train, train_domain.ground_truth, train_domain.bounds())
     
-    (local_image, snake) = initialize_active_contour(domain, ee_image, band_statistics, False)
-
-    for i in range(MAX_STEPS):
-        if i % 10 == 0:
-            snake.respace_nodes()
-            snake.shift_nodes() # shift before fixing geometry since reversal of orientation possible
-            snake.fix_geometry()
-        else:
-            snake.shift_nodes()
-        if snake.done:
-            break
-    return snake.to_ee_image().clip(domain.bounds)
+    (local_image, snake) = initialize_active_contour(domain, ee_image, band_statistics, False,
+                                                     _get_memory_map(domain, memory_map))
+    num_processes = _get_num_processes(domain, num_processes)
+    if num_processes > 1:
+        snake = run_snake_tiled(local_image, snake, num_processes)
+    else:
+        run_snake(snake)
+    return snake
@@ -16,8 +16,11 @@
 # -----------------------------------------------------------------------------
 
 import ee
+import copy
 import math
+import time
 import numpy
+import multiprocessing
 import scipy
 import scipy.special
 import scipy.optimize
@@ -25,6 +28,8 @@ import scipy.optimize
 import matplotlib
 import matplotlib.pyplot as plt
 
+import cmt.util.ee_batch
+
 '''
 This file contains tools for histogram based detection of water in radar images.
 '''
@@ -39,7 +44,9 @@ class RadarHistogram(object):
     BACKSCATTER_MODEL_DIP      = 3
     BACKSCATTER_MODEL_PEAK     = 4
 
-    def __init__(self, domain, sensor, backscatter_model = None):
+    def __init__(self, domain, sensor, backscatter_model = None, defer=False):
+        '''If defer is set the histograms are not computed or fitted, call get_histogram_request(),
+           set_histogram_info() and fit() instead.'''
         self.domain = domain
         self.sensor = sensor
         self.backscatter_model = []
@@ -62,8 +69,19 @@ class RadarHistogram(object):
         
         self.hist_image = self.__preprocess_image(sensor)
 
-        self.histograms = self.__compute_histogram(self.hist_image)
-        self.__find_thresholds()
+        self.histograms  = None
+        self.fit_seconds = None
+        if not defer:
+            self.set_histogram_info(self.get_histogram_request().getInfo())
+            self.fit()
+
+    def __getstate__(self):
+        '''Only the histograms and the sensor settings are needed to fit, leave out the EE objects'''
+        state = dict(self.__dict__)
+        state['domain']     = None
+        state['hist_image'] = None
+        state['sensor']     = _SensorSettings(self.sensor)
+        return state
     
     def __preprocess_image(self, sensor):
         image = sensor.image
@@ -78,10 +96,14 @@ class RadarHistogram(object):
                 image = image.select([b], [b]).clamp(r[0], r[1]).addBands(image.select(other_bands, other_bands))
         return image
     
-    def __compute_histogram(self, image):
+    def get_histogram_request(self):
+        '''Returns the EE computation of the band histograms, without executing it'''
         # buckets must be same for all bands
         buckets = 128 if 'buckets' not in self.sensor.water_distributions[self.sensor.band_names[0]] else self.sensor.water_distributions[self.sensor.band_names[0]]['buckets']
-        histogram = image.reduceRegion(ee.Reducer.histogram(buckets, None, None), self.domain.bounds, 30, None, None, True).getInfo()
+        return self.hist_image.reduceRegion(ee.Reducer.histogram(buckets, None, None), self.domain.bounds, 30, None, None, True)
+
+    def set_histogram_info(self, histogram):
+        '''Store the result of the histogram request'''
         h = []
     
         for c in range(len(self.sensor.band_names)):
@@ -94,7 +116,13 @@ class RadarHistogram(object):
             total = sum(histogram[ch]['histogram'])
             histogram[ch]['histogram'] = map(lambda x : x / total, histogram[ch]['histogram'])
             h.append((histogram[ch]['bucketMin'], histogram[ch]['bucketWidth'], histogram[ch]['histogram']))
-        return h
+        self.histograms = h
+
+    def fit(self):
+        '''Fit the water distributions and find the thresholds, the time taken is stored in fit_seconds'''
+        start = time.time()
+        self.__find_thresholds()
+        self.fit_seconds = time.time() - start
 
     def __cdf(self, params, x, backscatter_model):
         mode = params[0]
@@ -139,25 +167,24 @@ class RadarHistogram(object):
     def __gamma_function_errors(self, p, mode, fit_end, offset, channel):
         start  = self.histograms[channel][0]
         width  = self.histograms[channel][1]
-        values = self.histograms[channel][2]
+        values = numpy.asarray(self.histograms[channel][2])
         k = p[0]
         bm = self.backscatter_model[channel]
         if (bm == RadarHistogram.BACKSCATTER_MODEL_GAMMA and k <= 1.0):
             return [float('inf')] * len(values)
         if (bm == RadarHistogram.BACKSCATTER_MODEL_GAUSSIAN and k <= 0.0):
             return [float('inf')] * len(values)
-        error = 0.0
-        last_cdf = 0.0
         errors = numpy.zeros(len(values))
         mid = int((mode - start) / width)
         cumulative = sum(values[:mid]) + values[mid] / 2
         scale = cumulative / self.__cdf((mode, k, offset), mode, bm)
-        for i in range(len(values)):
-            if start + i * width - offset > fit_end:
-                break
-            cdf = scale * self.__cdf((mode, k, offset), start + i * width, bm)
-            errors[i] = (cdf - last_cdf) - values[i]
-            last_cdf = cdf
+
+        # Compare the change in the model CDF at each bin up to fit_end with the bin values
+        x = start + numpy.arange(len(values)) * width
+        past = numpy.nonzero(x - offset > fit_end)[0]
+        n    = past[0] if len(past) else len(values) # The bins stop at the first one past fit_end
+        cdf = scale * self.__cdf((mode, k, offset), x[:n], bm)
+        errors[:n] = numpy.diff(numpy.concatenate(([0.0], cdf))) - values[:n]
         return errors
 
     def __find_threshold_histogram(self, channel):
@@ -268,73 +295,138 @@ class RadarHistogram(object):
         plt.show()
 
 
+class _SensorSettings(object):
+    '''The sensor values used to fit a histogram, which can be sent to other processes'''
+    def __init__(self, sensor):
+        self.band_names          = list(sensor.band_names)
+        self.water_distributions = copy.deepcopy(sensor.water_distributions)
+        self.minimum_value       = sensor.minimum_value
+        self.log_scale           = sensor.log_scale
+
+def _fit_radar_histogram(radar_histogram):
+    '''Process pool helper, returns the fitted object'''
+    radar_histogram.fit()
+    return radar_histogram
+
+def fit_radar_histograms(scenes, backscatter_model=None, processes=None):
+    '''Compute RadarHistogram thresholds for a list of (domain, sensor) pairs.
+       - The histograms of all scenes are fetched in one combined request.
+       - If processes is set the fits are spread over a pool of that many processes.
+       - Returns the list of fitted RadarHistograms, the fit time of each one is in fit_seconds.'''
+    histograms = [RadarHistogram(domain, sensor, backscatter_model, defer=True) for (domain, sensor) in scenes]
+    infos      = cmt.util.ee_batch.get_info_batch([h.get_histogram_request() for h in histograms])
+    for (h, info) in zip(histograms, infos):
+        h.set_histogram_info(info)
+
+    if processes and (len(histograms) > 1):
+        pool = multiprocessing.Pool(processes)
+        try:
+            fitted = pool.map(_fit_radar_histogram, histograms)
+        finally:
+            pool.close()
+            pool.join()
+        # Copy the results back so the returned objects keep their EE objects
+        for (h, f) in zip(histograms, fitted):
+            (h.thresholds, h.distributions, h.fit_seconds) = (f.thresholds, f.distributions, f.fit_seconds)
+    else:
+        for h in histograms:
+            h.fit()
+
+    for ((domain, sensor), h) in zip(scenes, histograms):
+        print 'Fit %s histogram for %s in %.3f seconds' % (sensor.sensor_name, domain.name, h.fit_seconds)
+    return histograms
+
+
 #=========================================================================================
 # This is another method which has not been integrated into the class structure above.
 # - If you need to use it for something, go for it!
 
-def __computeJT(relHist, binVals, T):
-    '''As part of the Kittler/Illingworth method, compute J(T) for a given T'''
-
-    FAIL_VAL = 999999
-
-    # Split the hostogram at the threshold T.
-    histogram1 = relHist[0:T]
-    histogram2 = relHist[T+1:]
-
-    # Compute the number of pixels in the two classes.
-    P1 = sum(histogram1)
-    P2 = sum(histogram2)
-
-    # Only continue if both classes contain at least one pixel.
-    if (P1 <= 0) or (P2 <= 0):
-        return FAIL_VAL
-
-    # Compute the standard deviations of the classes.
-    weightedBins1 = numpy.multiply(histogram1, binVals[0:T])
-    weightedBins2 = numpy.multiply(histogram2, binVals[T+1:])
-    mean1         = sum(weightedBins1) / P1;
-    mean2         = sum(weightedBins2) / P2;
-    diffs1        = numpy.subtract(binVals[0:T],  mean1)
-    diffs2        = numpy.subtract(binVals[T+1:], mean2)
-    diffsSq1      = [d*d for d in diffs1]
-    diffsSq2      = [d*d for d in diffs2]
-    weightedBins1 = numpy.multiply(histogram1, diffsSq1)
-    weightedBins2 = numpy.multiply(histogram2, diffsSq2)
-    sigma1        = math.sqrt(sum(weightedBins1) / P1)
-    sigma2        = math.sqrt(sum(weightedBins2) / P2)
-
-    # Make sure both classes contain at least two intensity values.
-    if (sigma1 <= 0) or (sigma2 <= 0):
-        return FAIL_VAL
-
-    # Compute J(T).
-    J = 1 + 2*(P1*math.log(sigma1) + P2*math.log(sigma2)) - 2*(P1*math.log(P1) + P2*math.log(P2))
-    
+# J(T) value for thresholds which do not leave at least two intensity values in each class
+KITTLER_ILLINGWORTH_FAIL_VAL = 999999
+
+def computeKittlerIllingworthJ(histograms, binVals):
+    '''As part of the Kittler/Illingworth method, compute J(T) for every threshold bin T.
+       - histograms is one histogram or a 2-D array with one histogram per row, binVals
+         is a single list of bin values or one row of bin values per histogram.
+       - Bin T itself is left out of both classes.
+       - All thresholds are computed at once from cumulative sums of the counts and of the
+         first and second moments of the bin values.'''
+
+    histograms = numpy.atleast_2d(numpy.asarray(histograms, dtype=numpy.float64))
+    binVals    = numpy.asarray(binVals, dtype=numpy.float64)
+    binVals    = binVals * numpy.ones(histograms.shape) # One row of bin values per histogram
+
+    # Normalize the histograms (each bin is now a percentage)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        relHist = histograms / histograms.sum(axis=1)[:, numpy.newaxis]
+
+    # Center the bin values to reduce round off in the variance computation
+    centered = binVals - binVals.mean(axis=1)[:, numpy.newaxis]
+
+    def lowerSums(values):
+        '''Sum of the bins below T for each T'''
+        sums = numpy.zeros(values.shape)
+        sums[:, 1:] = numpy.cumsum(values, axis=1)[:, :-1]
+        return sums
+    def upperSums(values):
+        '''Sum of the bins above T for each T'''
+        sums = numpy.zeros(values.shape)
+        sums[:, :-1] = numpy.cumsum(values[:, ::-1], axis=1)[:, ::-1][:, 1:]
+        return sums
+
+    # Both classes must contain at least two intensity values
+    nonZero = (relHist > 0).astype(numpy.float64)
+    valid   = (lowerSums(nonZero) >= 2) & (upperSums(nonZero) >= 2)
+
+    J = numpy.ones(relHist.shape)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for (P, S1, S2) in [(lowerSums(relHist), lowerSums(relHist*centered), lowerSums(relHist*centered*centered)),
+                            (upperSums(relHist), upperSums(relHist*centered), upperSums(relHist*centered*centered))]:
+            mean     = S1 / P
+            variance = numpy.maximum(S2 / P - mean*mean, 0)
+            valid   &= (variance > 0)
+            # Each class adds 2*(P*log(sigma) - P*log(P))
+            J       += numpy.where(valid, P*numpy.log(variance) - 2*P*numpy.log(P), 0)
+    J[~valid] = KITTLER_ILLINGWORTH_FAIL_VAL
     return J
 
-def splitHistogramKittlerIllingworth(histogram, binVals):
-    '''Tries to compute an optimal histogram threshold using the Kittler/Illingworth method'''
-
-    # Normalize the histogram (each bin is now a percentage)
-    histSum      = float(sum(histogram))
-    relativeHist = numpy.divide(histogram,histSum)
-
-
-    # Try out every bin value in the histogram and pick the best one
-    #  - For more resolution, use more bins!
-    #  - Could write up a smarter solver for this.
-    numBins = len(binVals)
-    J = []
-    for i in range(0, numBins):
-        J.append(__computeJT(relativeHist, binVals, i))
-        
-    minJ      = J[1]
-    threshold = binVals[0]
-    for i in range(1, numBins):
-        if J[i] < minJ:
-            minJ      = J[i]
-            threshold = (binVals[i] + binVals[i-1])/2 # Threshold is below current bin value
-    
-    return threshold
+def _pickKittlerIllingworthThresholds(J, binVals):
+    '''Convert the J(T) rows to threshold values'''
+    binVals = numpy.asarray(binVals, dtype=numpy.float64) * numpy.ones(J.shape)
+    rows    = numpy.arange(J.shape[0])
+    # The first bin with the smallest J, ignoring bin zero.  If that is bin one the lowest
+    #  bin value is used, otherwise the threshold is below the chosen bin value.
+    best    = numpy.argmin(J[:, 1:], axis=1) + 1
+    return numpy.where(best > 1, (binVals[rows, best] + binVals[rows, best-1])/2, binVals[:, 0])
 
+def findKittlerIllingworthThreshold(histogram, binVals):
+    '''Returns (threshold, J) where J is the array of J(T) values for each bin'''
+    J = computeKittlerIllingworthJ(histogram, binVals)
+    return (_pickKittlerIllingworthThresholds(J, binVals)[0], J[0])
 
+def splitHistogramKittlerIllingworth(histogram, binVals):
+    '''Tries to compute an optimal histogram threshold using the Kittler/Illingworth method'''
+    return float(findKittlerIllingworthThreshold(histogram, binVals)[0])
+
+def splitHistogramsKittlerIllingworth(histograms, binVals):
+    '''Compute Kittler/Illingworth thresholds for many histograms at once.
+       - histograms is a 2-D array or a list of histograms, binVals is a list of bin values
+         shared by all of them or one list per histogram.
+       - Histograms of different lengths are padded with empty bins.
+       - Returns an array with one threshold per histogram.'''
+    if len(histograms) == 0:
+        return numpy.zeros(0)
+    if not hasattr(binVals[0], '__len__'): # Shared bin values
+        binVals = [binVals] * len(histograms)
+
+    # Pad the histograms to the same length, the extra bins never hold a threshold
+    numBins       = max([len(h) for h in histograms])
+    paddedHists   = numpy.zeros((len(histograms), numBins))
+    paddedBinVals = numpy.zeros((len(histograms), numBins))
+    for (i, (hist, vals)) in enumerate(zip(histograms, binVals)):
+        paddedHists[i, :len(hist)]   = hist
+        paddedBinVals[i, :len(vals)] = vals
+        paddedBinVals[i, len(vals):] = vals[-1]
+
+    J = computeKittlerIllingworthJ(paddedHists, paddedBinVals)
+    return _pickKittlerIllingworthThresholds(J, paddedBinVals)
@@ -28,6 +28,9 @@ import matplotlib
 #matplotlib.use('tkagg')
 import matplotlib.pyplot as plt
 from cmt.mapclient_qt import addToMap
+from cmt.util.ee_batch import EeBatch
+from cmt.util.miscUtilities import safe_get_info
+import cmt.util.tile_grid
 
 #------------------------------------------------------------------------
 ''' sar_martinis radar algorithm (find threshold by histogram splits on selected subregions)
@@ -52,75 +55,19 @@ GRAY_PALETTE  = '000000, FFFFFF'
 
 def getBoundingBox(bounds):
     '''Returns (minLon, minLat, maxLon, maxLat) from domain bounds'''
-    
-    coordList = bounds['coordinates'][0]
-    minLat =  999
-    minLon =  999999
-    maxLat = -999
-    maxLon = -999999
-    for c in coordList:
-        if c[0] < minLon:
-            minLon = c[0]
-        if c[0] > maxLon:
-            maxLon = c[0]
-        if c[1] < minLat:
-            minLat = c[1]
-        if c[1] > maxLat:
-            maxLat = c[1]
-    return (minLon, minLat, maxLon, maxLat)
+    return cmt.util.tile_grid.get_bounding_box(bounds)
 
 def divideUpBounds(bounds, boxSizeMeters, maxBoxesPerSide):
     '''Divides up a single boundary into a grid based on a grid size in meters'''
-
-    # Get the four corners of the box and side widths in meters
-    (minLon, minLat, maxLon, maxLat) = getBoundingBox(bounds)
-    bottomLeft  = ee.Geometry.Point(minLon, minLat)
-    topLeft     = ee.Geometry.Point(minLon, maxLat)
-    bottomRight = ee.Geometry.Point(maxLon, minLat)
-    topRight    = ee.Geometry.Point(maxLon, maxLat)
-    
-    height = float(bottomLeft.distance(topLeft).getInfo())
-    width  = float(bottomLeft.distance(bottomRight).getInfo())
-    
-    # Determine the number of boxes
-    numBoxesX = int(math.ceil(width  / boxSizeMeters))
-    numBoxesY = int(math.ceil(height / boxSizeMeters))
-    if numBoxesX > maxBoxesPerSide:
-        numBoxesX = maxBoxesPerSide
-    if numBoxesY > maxBoxesPerSide:
-        numBoxesY = maxBoxesPerSide
-    boxSizeMeters = ((width/numBoxesX) + (height/numBoxesY)) / 2
-    print 'Using ' + str(numBoxesX*numBoxesY) + ' boxes of size ' + str(boxSizeMeters)
-    
-    # Now compute the box boundaries in degrees
-    boxWidthLon  = (maxLon - minLon) / numBoxesX
-    boxHeightLat = (maxLat - minLat) / numBoxesY 
-    y = minLat
-    boxList = []
-    for r in range(0,numBoxesY):
-        y = y + boxHeightLat
-        x = minLon
-        for c in range(0,numBoxesX):
-            x = x + boxWidthLon
-            boxBounds = ee.Geometry.Rectangle(x, y, x+boxWidthLon, y+boxHeightLat)
-            #print boxBounds
-            boxList.append(boxBounds)
-
-    return boxList, boxSizeMeters
+    grid = cmt.util.tile_grid.get_tile_grid(bounds, boxSizeMeters, maxBoxesPerSide)
+    print 'Using ' + str(len(grid)) + ' boxes of size ' + str(grid.box_size_meters)
+    return grid.get_rectangles(), grid.box_size_meters
     
   
 def getBoundsCenter(bounds):
     '''Returns the center point of a boundary'''
-    
-    coordList = bounds['coordinates'][0]
-    meanLat  = 0
-    meanLon  = 0
-    for c in coordList:
-        meanLat = meanLat + c[1]
-        meanLon = meanLon + c[0]
-    meanLat = meanLat / len(coordList)
-    meanLon = meanLon / len(coordList)
-    return (meanLat, meanLon)
+    (minLon, minLat, maxLon, maxLat) = getBoundingBox(bounds)
+    return ((minLat + maxLat) / 2, (minLon + maxLon) / 2)
 
 
 #
@@ -207,10 +154,10 @@ def sar_martinis(domain, cr_method=False):
     # Divide up the region into a grid of subregions
     MAX_BOXES_PER_SIDE = 12 # Cap the number of boxes at 144
     DESIRED_BOX_SIZE_METERS = 3000
-    boxList, boxSizeMeters  = divideUpBounds(domain.bounds, DESIRED_BOX_SIZE_METERS, MAX_BOXES_PER_SIDE)
-    
-    # Extract the center point from each box
-    centersList = map(getBoundsCenter, boxList)
+    # - The grid is computed locally, only the box centers are needed as EE objects
+    grid          = cmt.util.tile_grid.get_tile_grid(domain.bounds, DESIRED_BOX_SIZE_METERS, MAX_BOXES_PER_SIDE)
+    boxSizeMeters = grid.box_size_meters
+    print 'Using ' + str(len(grid)) + ' boxes of size ' + str(boxSizeMeters)
     
     # SENTINEL = 12m/pixel
     KERNEL_SIZE = 13 # Each box will be covered by a 13x13 pixel kernel
@@ -231,11 +178,19 @@ def sar_martinis(domain, cr_method=False):
     #addToMap(grayLayer, {'min': 0, 'max': GRAY_MAX,  'opacity': 1.0, 'palette': GRAY_PALETTE}, 'grayLayer',   False)
     
     
+    # Fetch all of the global statistics we need in one request
+    batch      = EeBatch()
+    globalMean = batch.add(grayLayer.reduceRegion(ee.Reducer.mean(), domain.bounds, metersPerPixel))
+    if cr_method:
+        imageMin = batch.add(grayLayer.reduceRegion(ee.Reducer.min(), domain.bounds, metersPerPixel))
+        imageMax = batch.add(grayLayer.reduceRegion(ee.Reducer.max(), domain.bounds, metersPerPixel))
+    batch.execute()
+    
     # Compute the global mean, then make a constant image out of it.
-    globalMean      = grayLayer.reduceRegion(ee.Reducer.mean(), domain.bounds, metersPerPixel)
-    globalMeanImage = ee.Image.constant(globalMean.getInfo()[channelName])
+    globalMeanValue = globalMean.result()[channelName]
+    globalMeanImage = ee.Image.constant(globalMeanValue)
     
-    print 'global mean = ' + str(globalMean.getInfo()[channelName])
+    print 'global mean = ' + str(globalMeanValue)
     
     
     # Compute mean and standard deviation across the entire image
@@ -274,9 +229,7 @@ def sar_martinis(domain, cr_method=False):
         MIN_CR = 0.10
     
         # sar_griefeneder reccomends replacing CV with CR = (std / gray value range), min value 0.05
-        imageMin  = grayLayer.reduceRegion(ee.Reducer.min(), domain.bounds, metersPerPixel).getInfo()[channelName]
-        imageMax  = grayLayer.reduceRegion(ee.Reducer.max(), domain.bounds, metersPerPixel).getInfo()[channelName]
-        grayRange = imageMax - imageMin
+        grayRange = imageMax.result()[channelName] - imageMin.result()[channelName]
         CR = stdImage.divide(grayRange)
     
         #addToMap(CR, {'min': 0, 'max': 0.3, 'opacity': 1.0, 'palette': GRAY_PALETTE}, 'CR', False)
@@ -308,54 +261,51 @@ def sar_martinis(domain, cr_method=False):
     # Assemble all local gray values at each point ?
     localPixelLists = grayLayer.neighborhoodToBands(avgKernel)
         
-    maskWrapper = ee.ImageCollection([X_doublePrime]);
-    collection  = ee.ImageCollection([localPixelLists]);
     
     # Extract the point data at from each sub-region!
     
     localThresholdList = []
     usedPointList      = []
     rejectedPointList  = []
-    for loc in centersList:
-        
-        try:
-            thisLoc = ee.Geometry.Point(loc[1], loc[0])
-        
-            # If the mask for this location is invalid, skip this location
-            maskValue = maskWrapper.getRegion(thisLoc, metersPerPixel);
-            maskValue = maskValue.getInfo()[1][4] # TODO: Not the best way to grab the value!
-            if not maskValue:
-                rejectedPointList.append(thisLoc)
-                continue
-        
-            # Otherwise pull down all the pixel values surrounding this center point
-            
-            pointData = collection.getRegion(thisLoc, metersPerPixel)
-            pixelVals = pointData.getInfo()[1][4:] # TODO: Not the best way to grab the value!
-    
-            # TODO: Can EE handle making a histogram around this region or do we need to do this ourselves?
-            #pointData = localPixelLists.reduceRegion(thisRegion, ee.Reducer.histogram(), SAMPLING_SCALE);
-            #print pointData.getInfo()
-            #print pixelVals
-            #__show_histogram(pixelVals)
-            #plt.bar(range(len(pixelVals)), pixelVals)
-            
-            # Compute a histogram from the pixels (TODO: Do this with EE!)
-            NUM_BINS = 256
-            hist, binEdges = numpy.histogram(pixelVals, NUM_BINS)
-            binCenters = numpy.divide(numpy.add(binEdges[:NUM_BINS], binEdges[1:]), 2.0)
-            
-            # Compute a split on the histogram
-            splitVal = histogram.splitHistogramKittlerIllingworth(hist, binCenters)
-            print "Computed local threshold = " + str(splitVal)
-            localThresholdList.append(splitVal)
-            usedPointList.append(thisLoc)
-            
-            #plt.bar(binCenters, hist)
-            #plt.show()
-        except Exception,e:
-            print 'Failed to compute a location:'
-            print str(e)
+    pointList = grid.get_center_points()
+
+    # Sample the mask and all the pixel values surrounding every center point with a single
+    #  request, only the points which pass the mask are sent back.
+    MASK_BAND = 'tile_mask'
+    points    = ee.FeatureCollection([ee.Feature(p, {'index': i}) for (i, p) in enumerate(pointList)])
+    samples   = X_doublePrime.select([0], [MASK_BAND]).addBands(localPixelLists) \
+                             .sampleRegions(points, ['index'], metersPerPixel) \
+                             .filter(ee.Filter.neq(MASK_BAND, 0))
+    sampleInfo = batch.add(samples)
+    batch.execute()
+
+    # Points which failed the mask or had no valid pixels are not in the results
+    sampledPixels = dict()
+    for feature in sampleInfo.result()['features']:
+        properties = feature['properties']
+        index      = properties.pop('index')
+        properties.pop(MASK_BAND)
+        sampledPixels[index] = [v for v in properties.values() if v is not None]
+
+    # Compute a histogram from the pixels around each used point
+    NUM_BINS        = 256
+    pointHists      = []
+    pointBinCenters = []
+    for (i, thisLoc) in enumerate(pointList):
+        if not sampledPixels.get(i):
+            rejectedPointList.append(thisLoc)
+            continue
+        hist, binEdges = numpy.histogram(sampledPixels[i], NUM_BINS)
+        binCenters = numpy.divide(numpy.add(binEdges[:NUM_BINS], binEdges[1:]), 2.0)
+        pointHists.append(hist)
+        pointBinCenters.append(binCenters)
+        usedPointList.append(thisLoc)
+
+    # Compute a split on all of the histograms at once
+    if pointHists:
+        localThresholdList = list(histogram.splitHistogramsKittlerIllingworth(pointHists, pointBinCenters))
+    for splitVal in localThresholdList:
+        print "Computed local threshold = " + str(splitVal)
        
     numUsedPoints   = len(usedPointList)
     numUnusedPoints = len(rejectedPointList)
@@ -447,76 +397,98 @@ def rescaleNumber(num, currMin, currMax, newMin, newMax):
     output    = scaled*newRange + newMin
     return output
 
-def sar_martinis2(domain):
-    '''Main function of algorithm from "A fully automated TerraSAR-X based flood service"'''
-
-    # Set up the grid sizes we will use
-    # TODO: Compute these based on the region size and input resolution!
-    BASE_RES = 40; # Input meters per pixel
-    S2_DS    = 32; # Size of the smaller grid S-
-    S1_DS    = 64; # Size of the larger grid S+
-    S1_WIDTH_METERS = BASE_RES*S1_DS;
-
-    sensor = domain.get_radar()
-
-    # Select the radar layer we want to work in
-    if 'water_detect_radar_channel' in domain.algorithm_params:
-        channelName = domain.algorithm_params['water_detect_radar_channel']
-    else: # Just use the first radar channel
-        channelName = sensor.band_names[0]   
-
-    # Get the channel and specify higher quality image resampling method    
-    rawImage = sensor.image.select(channelName)
-
-    # EE does most of the same preprocessing as the paper but we still need to
-    #  duplicate the 0 to 400 scale they used.
-    PROC_MIN_VAL =   0.0
-    PROC_MAX_VAL = 400.0
-    minmax = rawImage.reduceRegion(ee.Reducer.minMax(), domain.bounds, scale=BASE_RES).getInfo();
-    minVal = [value for key, value in minmax.items() if 'min' in key.lower()][0]
-    maxVal = [value for key, value in minmax.items() if 'max' in key.lower()][0]
-    radarImage = rawImage.unitScale(minVal, maxVal).multiply(PROC_MAX_VAL)
+class TilePyramid(object):
+    '''The S-/S+ tile statistics used by sar_martinis2, fetched with a single request.
+       - minVal and maxVal are the input range which is scaled to PROC_MIN_VAL to PROC_MAX_VAL.
+       - tileCenters is an N x 2 array of (lon, lat) for the kept S+ tiles, tileStdDevs their
+         standard deviations and stdThreshold the percentile used to select them.
+       - histograms and bucketMeans are N x B arrays with the gray value histogram of each tile,
+         shorter histograms are padded with empty buckets.'''
+
+    def __init__(self, info):
+        minmax      = info['minmax']
+        self.minVal = [value for key, value in minmax.items() if 'min' in key.lower()][0]
+        self.maxVal = [value for key, value in minmax.items() if 'max' in key.lower()][0]
+        self.stdThreshold = info['std_threshold']
+
+        tiles    = [f['properties'] for f in info['tiles']['features']]
+        numTiles = len(tiles)
+        numBins  = max([len(t['histogram']['histogram']) for t in tiles] + [1])
+        self.tileCenters = numpy.array([(t['lon'], t['lat']) for t in tiles], dtype=numpy.float64).reshape(numTiles, 2)
+        self.tileStdDevs = numpy.array([t['std'] for t in tiles], dtype=numpy.float64)
+        self.histograms  = numpy.zeros((numTiles, numBins))
+        self.bucketMeans = numpy.zeros((numTiles, numBins))
+        for (i, t) in enumerate(tiles):
+            h = t['histogram']
+            n = len(h['histogram'])
+            self.histograms[i, :n]  = h['histogram']
+            self.bucketMeans[i, :n] = h['bucketMeans']
+            self.bucketMeans[i, n:] = h['bucketMeans'][-1]
+
+    def __len__(self):
+        return len(self.tileStdDevs)
+
+# Pyramids already computed in this process, so that a scene can be rerun with different
+#  thresholds without repeating the request.
+_pyramid_cache = dict()
+
+def clearTilePyramidCache():
+    _pyramid_cache.clear()
+
+def computeTilePyramid(rawImage, bounds, baseRes, s2Ds, s1Ds, procMaxVal, reuse=True):
+    '''Compute the statistics sar_martinis2 uses to select tiles as a single EE computation
+       (an ee.Dictionary which could also be exported) and fetch it as a TilePyramid.
+       - If reuse is set a pyramid computed earlier for the same image and parameters is returned.'''
+
+    key = None
+    if hasattr(rawImage, 'serialize'): # EE objects can be compared by their serialized form
+        key = (rawImage.serialize(), bounds.serialize(), baseRes, s2Ds, s1Ds, procMaxVal)
+        if reuse and (key in _pyramid_cache):
+            print 'Reusing the sar_martinis2 tile pyramid'
+            return _pyramid_cache[key]
+
+    # Scale the input to the 0 to procMaxVal range using the min and max on the server
+    minmax    = rawImage.reduceRegion(ee.Reducer.minMax(), bounds, scale=baseRes)
+    bandName  = ee.String(rawImage.bandNames().get(0))
+    minVal    = ee.Number(minmax.get(bandName.cat('_min')))
+    maxVal    = ee.Number(minmax.get(bandName.cat('_max')))
+    radarImage = rawImage.unitScale(minVal, maxVal).multiply(procMaxVal)
     # Also implement the median filter used in the paper
     radarImage = radarImage.focal_median(kernelType='square')
 
     # - Because we can only call reduceResolution on 64x64 tiles,
     #  downsample the input images to get the correct size.
-    gray     = radarImage.reproject(radarImage.projection(), scale=BASE_RES);
+    gray     = radarImage.reproject(radarImage.projection(), scale=baseRes);
     grayProj = gray.projection();
 
     # Compute mean at S- level, and standard deviation at S+ level.
-    s2Mean   = gray.reduceResolution(  ee.Reducer.mean(),   True).reproject(grayProj.scale(S2_DS, S2_DS));
-    s1StdDev = s2Mean.reduceResolution(ee.Reducer.stdDev(), True).reproject(grayProj.scale(S1_DS, S1_DS));
+    s2Mean   = gray.reduceResolution(  ee.Reducer.mean(),   True).reproject(grayProj.scale(s2Ds, s2Ds));
+    s1StdDev = s2Mean.reduceResolution(ee.Reducer.stdDev(), True).reproject(grayProj.scale(s1Ds, s1Ds));
 
     #addToMap(gray,     {'min': PROC_MIN_VAL, 'max': PROC_MAX_VAL, 'opacity': 1.0, 'palette': GRAY_PALETTE}, 'gray',   False)
     #addToMap(s2Mean,   {'min': PROC_MIN_VAL, 'max': PROC_MAX_VAL, 'opacity': 1.0, 'palette': GRAY_PALETTE}, 's2Mean', False)
     #addToMap(s1StdDev, {'min':   PROC_MIN_VAL, 'max': PROC_MAX_VAL, 'opacity': 1.0, 'palette': GRAY_PALETTE}, 's1StdDev',  False)
 
     # Pick the highest STD grid locations
-    p = s1StdDev.reduceRegion(ee.Reducer.percentile([95]), domain.bounds);
-    if not p:
-        raise Exception('Failed to find high STD tiles!')
-    thresh = ee.Number(p.getInfo().values()[0]);
-    print 'Computed 95% std threshold: ' + str(thresh.getInfo())
-    kept = s1StdDev.gt(ee.Image(thresh));
+    p      = ee.Dictionary(s1StdDev.reduceRegion(ee.Reducer.percentile([95]), bounds))
+    thresh = ee.Number(p.values().get(0))
+    kept   = s1StdDev.gt(ee.Image(thresh));
     #addToMap(kept, {'min': 0, 'max': 1, 'opacity': 0.5, 'palette': GREEN_PALETTE}, 'top_std_dev',  False)
 
     # Add lonlat bands to the tile STD values and get a nice list of kept
     #  tile STD values with the center coordinate of the tile.
     augStdDev  = s1StdDev.addBands(ee.Image.pixelLonLat()).mask(kept);
-    stdDevInfo = augStdDev.reduceRegion(ee.Reducer.toList(3), domain.bounds);
+    stdDevInfo = augStdDev.reduceRegion(ee.Reducer.toList(3), bounds);
     stdDevList = ee.List(stdDevInfo.get('list')); # A necessary bit of casting
 
-    print 'Selected ' + str(len(stdDevList.getInfo())) + ' tiles to compute thresholds from.'
-
-
     # Define a function to get a S+ tile bounding box from the tile center in stdDevList.
+    s1WidthMeters = baseRes*s1Ds
     def getTileBoundingBox(p):
         pixel  = ee.List(p);
         center = ee.Geometry.Point([pixel.get(1), pixel.get(2)]);
-        buff   = center.buffer(S1_WIDTH_METERS/2-1);
+        buff   = center.buffer(s1WidthMeters/2-1);
         box    = buff.bounds();
-        return ee.Feature(box);
+        return ee.Feature(box, {'std': pixel.get(0), 'lon': pixel.get(1), 'lat': pixel.get(2)});
 
     # Get the bounding box of each chosen grid location as a Geometry type
     # using the function defined above.
@@ -527,20 +499,57 @@ def sar_martinis2(domain):
     features = ee.FeatureCollection(boxes);
     hists    = gray.reduceRegions(features, ee.Reducer.histogram())
 
-
     # This is the point where we had to leave Earth Engine behind, hopefully it is not too slow.
+    pyramid = TilePyramid(safe_get_info(ee.Dictionary({'minmax': minmax, 'std_threshold': thresh, 'tiles': hists})))
+    if key is not None:
+        _pyramid_cache[key] = pyramid
+    return pyramid
+
+def sar_martinis2(domain):
+    '''Main function of algorithm from "A fully automated TerraSAR-X based flood service"'''
+
+    # Set up the grid sizes we will use
+    # TODO: Compute these based on the region size and input resolution!
+    BASE_RES = 40; # Input meters per pixel
+    S2_DS    = 32; # Size of the smaller grid S-
+    S1_DS    = 64; # Size of the larger grid S+
+
+    sensor = domain.get_radar()
+
+    # Select the radar layer we want to work in
+    if 'water_detect_radar_channel' in domain.algorithm_params:
+        channelName = domain.algorithm_params['water_detect_radar_channel']
+    else: # Just use the first radar channel
+        channelName = sensor.band_names[0]   
+
+    # Get the channel and specify higher quality image resampling method    
+    rawImage = sensor.image.select(channelName)
+
+    # EE does most of the same preprocessing as the paper but we still need to
+    #  duplicate the 0 to 400 scale they used.
+    PROC_MIN_VAL =   0.0
+    PROC_MAX_VAL = 400.0
+
+    # The tile statistics only depend on the input, so they are reused when the same scene is
+    #  processed again with different thresholds.
+    reusePyramid = str(domain.algorithm_params.get('martinis_reuse_pyramid', 'true')).lower() != 'false'
+    pyramid = computeTilePyramid(rawImage, domain.bounds, BASE_RES, S2_DS, S1_DS, PROC_MAX_VAL, reusePyramid)
+    (minVal, maxVal) = (pyramid.minVal, pyramid.maxVal)
+    print 'Computed 95% std threshold: ' + str(pyramid.stdThreshold)
+
+    radarImage = rawImage.unitScale(minVal, maxVal).multiply(PROC_MAX_VAL)
+    # Also implement the median filter used in the paper
+    radarImage = radarImage.focal_median(kernelType='square')
+
+    print 'Selected ' + str(len(pyramid)) + ' tiles to compute thresholds from.'
 
     # At each selected grid location, compute a threshold
     tileThresholds = []
-    #print('\n\n======= HistProc ========\n')
-    #histProc = hists.map(histCheck)
-    histData  = hists.getInfo()['features']
-    mergeHist = []
-    for feature in histData:
-        # TODO: Improve/test the splitter?
-        hist     = feature['properties']['histogram']
-        splitVal = histogram.splitHistogramKittlerIllingworth(hist['histogram'], hist['bucketMeans'])
-        
+    # TODO: Improve/test the splitter?
+    splitVals = histogram.splitHistogramsKittlerIllingworth(pyramid.histograms, pyramid.bucketMeans)
+    for splitVal in splitVals:
+        splitVal = float(splitVal)
+
         # Display these values in the original unscaled units.
         splitValDb = rescaleNumber(splitVal, PROC_MIN_VAL, PROC_MAX_VAL, minVal, maxVal)        
         print 'Computed split value (DB): ' + str(splitValDb)
@@ -552,10 +561,10 @@ def sar_martinis2(domain):
 
     # If the standard deviation of the local thresholds in DB are greater than this,
     #  the result is probably bad (number from the paper)
-    MAX_STD_DB = 5.0
+    MAX_STD_DB = float(domain.algorithm_params.get('martinis_max_std_db', 5.0))
 
     # The maximum allowed value, from the paper.
-    MAX_THRESHOLD_DB = 10.0
+    MAX_THRESHOLD_DB = float(domain.algorithm_params.get('martinis_max_threshold_db', 10.0))
 
     # TODO: Some method do discard outliers
     threshMean = numpy.mean(tileThresholds)
@@ -577,7 +586,7 @@ def sar_martinis2(domain):
 
     if threshMeanDb > MAX_THRESHOLD_DB:
         threshMean = rescaleNumber(MAX_THRESHOLD_DB, minVal, maxVal, PROC_MIN_VAL, PROC_MAX_VAL)
-        print 'Saturating the computed threshold at 10 DB!'
+        print 'Saturating the computed threshold at ' + str(MAX_THRESHOLD_DB) + ' DB!'
     
     initialThresh = threshMean
 
@@ -586,7 +595,9 @@ def sar_martinis2(domain):
 
     # Get information needed for fuzzy logic results filtering
 
-    meanRawValue = radarImage.mask(rawWater).reduceRegion(ee.Reducer.mean(), domain.bounds, scale=BASE_RES).getInfo().values()[0]
+    # - The statistics are all independent so they are fetched with a single request
+    batch        = EeBatch()
+    meanRawValue = batch.add(radarImage.mask(rawWater).reduceRegion(ee.Reducer.mean(), domain.bounds, scale=BASE_RES))
 
     # Compute the number of pixels in each blob, up to the maximum we care about (1000m*m)
     maxBlobSize = 1000/BASE_RES
@@ -601,8 +612,12 @@ def sar_martinis2(domain):
     
     # Compute mean and std of the elevations of the pixels we marked as water
     waterHeights = dem.mask(rawWater)
-    meanWaterHeight = waterHeights.reduceRegion(ee.Reducer.mean(),   domain.bounds, scale=BASE_RES).getInfo()['elevation']
-    stdWaterHeight  = waterHeights.reduceRegion(ee.Reducer.stdDev(), domain.bounds, scale=BASE_RES).getInfo()['elevation']
+    meanWaterHeight = batch.add(waterHeights.reduceRegion(ee.Reducer.mean(),   domain.bounds, scale=BASE_RES))
+    stdWaterHeight  = batch.add(waterHeights.reduceRegion(ee.Reducer.stdDev(), domain.bounds, scale=BASE_RES))
+    batch.execute()
+    meanRawValue    = meanRawValue.result().values()[0]
+    meanWaterHeight = meanWaterHeight.result()['elevation']
+    stdWaterHeight  = stdWaterHeight.result()['elevation']
     
     # Compute fuzzy classifications on four categories:
     
@@ -635,13 +650,13 @@ def sar_martinis2(domain):
     #addToMap(finalFuzz, {'min': 0, 'max': 1, 'opacity': 1.0, 'palette': GRAY_PALETTE }, 'final fuzz',  False)
     
     # Apply fixed threshold to get updated flooded pixels
-    defuzz = finalFuzz.gt(ee.Image(0.6))
+    defuzz = finalFuzz.gt(ee.Image(float(domain.algorithm_params.get('martinis_defuzz_threshold', 0.6))))
     #addToMap(defuzz, {'min': 0, 'max': 1, 'opacity': 1.0, 'palette': BLUE_PALETTE }, 'defuzz',  False)
     
     # Expand water classification outwards using a lower fuzzy threshold.
     # - This step is a little tough for EE so we approximate using a dilation step.
     dilatedWater = defuzz.focal_max(radius=1000, units='meters')
-    finalWater   = dilatedWater.And(finalFuzz.gt(ee.Image(0.45)))
+    finalWater   = dilatedWater.And(finalFuzz.gt(ee.Image(float(domain.algorithm_params.get('martinis_expand_threshold', 0.45)))))
     
     #addToMap(dilatedWater, {'min': 0, 'max': 1, 'opacity': 1.0, 'palette': GRAY_PALETTE }, 'dilatedWater',  False)
     
@@ -0,0 +1,337 @@
+# -----------------------------------------------------------------------------
+# Copyright * 2014, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration. All
+# rights reserved.
+#
+# The Crisis Mapping Toolkit (CMT) v1 platform is licensed under the Apache
+# License, Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+# -----------------------------------------------------------------------------
+
+import os
+import copy
+import threading
+import cPickle as pickle
+import xml.etree.ElementTree as ET
+
+from cmt.util.download_cache import write_atomic
+
+'''
+Compiled sensor descriptions.
+
+A <sensor> XML element (from a sensor definition file in config/sensors or from
+a domain file) is parsed once into a read-only SensorDescriptor which holds
+everything SensorObservation needs: the value range, scaling, display settings,
+default source, and the source, resolution and water distribution of each band.
+
+Sensor definition files are compiled once per process and reused until the
+file changes.  If CMT_SENSOR_CACHE is set to a file path the compiled
+descriptors are also pickled there so that later processes skip the XML too.
+'''
+
+# Optional file to store compiled sensor definitions in
+DEFAULT_PICKLE_PATH = os.environ.get('CMT_SENSOR_CACHE')
+
+# Resolution of bands which do not specify one, in meters
+DEFAULT_RESOLUTION = 10
+
+
+class _Descriptor(object):
+    '''Base class for read-only objects with slots'''
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            object.__setattr__(self, name, kwargs.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(self.__class__.__name__ + ' objects are read-only')
+
+    def __getstate__(self):
+        return dict([(name, getattr(self, name)) for name in self.__slots__])
+
+    def __setstate__(self, state):
+        for name in self.__slots__:
+            object.__setattr__(self, name, state.get(name))
+
+class BandDescriptor(_Descriptor):
+    '''One <band> of a sensor.
+       - source, resolution and water are None if the band does not specify them.'''
+    __slots__ = ('name', 'source', 'resolution', 'water')
+
+    def get_source(self):
+        return dict(self.source or {})
+
+    def get_water(self):
+        return copy.deepcopy(self.water or {})
+
+class SensorDescriptor(_Descriptor):
+    '''A compiled <sensor> element.  Values which were not in the XML are None.'''
+    __slots__ = ('name',               # Lower case sensor name
+                 'minimum_value',      # From <range>
+                 'maximum_value',
+                 'log_scale',          # From <scaling>
+                 'default_water',      # Top level water distribution
+                 'has_bands',          # False if there is no <bands> element
+                 'display_bands',
+                 'display_gains',
+                 'default_source',     # From <bands><source>
+                 'default_resolution', # From <bands><resolution>
+                 'bands',              # Tuple of BandDescriptors
+                 'mask')               # Dictionary from <bands><mask>
+
+    def get_default_source(self):
+        return dict(self.default_source or {})
+
+    def get_default_water(self):
+        return copy.deepcopy(self.default_water or {})
+
+    def get_mask(self):
+        return None if self.mask is None else dict(self.mask)
+
+
+#=================================================================================
+# Parsing
+
+def load_range(tag):
+    '''read a <range> tag'''
+    a = None
+    b = None
+    if tag != None:
+        try:
+            a = tag.find('minimum').text
+            b = tag.find('maximum').text
+            try:
+                a = int(a)
+                b = int(b)
+            except:
+                a = float(a)
+                b = float(b)
+        except:
+            raise Exception('Failed to load range tag.')
+    return (a, b)
+
+def _loadPieceOfSourceInfo(source_band, info_name, dictionary):
+    '''Helper function - Look for and load source info about a band'''
+    result = source_band.find(info_name)
+    if result != None:
+        dictionary[info_name] = result.text
+
+def load_source(source_element):
+    '''load a data source for a band or mask, represented by the <source> tag.'''
+    # A source is stored like this: {'mosaic', 'source', 'eeid'}
+    d = dict()
+    source_band = source_element.find('source')
+    if source_band == None:
+        return d # Source not specified, leave the dictionary empty!
+
+    # if it's a mosaic, combine the images in an EE ImageCollection
+    mosaic = source_band.get('mosaic')
+    if mosaic != None:
+        if mosaic.lower() == 'true':
+            d['mosaic'] = True
+        elif mosaic.lower() == 'false':
+            d['mosaic'] = False
+        else:
+            raise Exception('Unexpected value of mosaic, %s.' % (source_band.get('mosaic')))
+
+    # The name of the band in the source data, maybe not what we will call it in the output image.
+    name = source_band.find('name')
+    if name != None:
+        # the name of the band in the original image
+        d['source'] = name.text
+
+    # Load more information about the band source
+    _loadPieceOfSourceInfo(source_band, 'eeid',       d) # The id of the image to load, if a single image.
+    _loadPieceOfSourceInfo(source_band, 'collection', d) # The ImageCollection name of the data, if any.
+    _loadPieceOfSourceInfo(source_band, 'start_date', d)    # Start and end dates used to filter an ImageCollection.
+    _loadPieceOfSourceInfo(source_band, 'end_date',   d)
+
+    return d
+
+def load_distribution(root):
+    '''load a probability distribution into a python dictionary, which may, for
+        example, represent the expected distribution of water pixels'''
+    d     = dict()
+    model = root.find('model')
+    if model != None:
+        d['model'] = model.text
+    mode = root.find('mode')
+    if mode != None:
+        d['mode'] = dict()
+        if mode.find('range') != None:
+            (d['mode']['min'], d['mode']['max']) = load_range(mode.find('range'))
+    r = root.find('range')
+    if r != None:
+        d['range'] = load_range(r)
+    b = root.find('buckets')
+    if b != None:
+        try:
+            d['buckets'] = int(b.text)
+        except:
+            raise Exception('Buckets in distribution must be integer.')
+    return d
+
+def _load_water(element):
+    '''Merge the water distributions directly inside an element, None if there are none'''
+    water = None
+    for d in element.findall('distribution'):
+        if d.get('name').lower() == 'water':
+            if water is None:
+                water = dict()
+            water.update(load_distribution(d))
+    return water
+
+def compile_sensor(xml_root):
+    '''Parse a <sensor> element into a SensorDescriptor'''
+
+    if (xml_root.tag != "sensor"):
+        raise Exception("Sensor XML file required!")
+
+    # Read the sensor name
+    name = xml_root.find('name')
+    if name == None:
+        raise Exception('Sensor name not found!')
+
+    # Search for the min and max values of the sensor
+    (minimum_value, maximum_value) = load_range(xml_root.find('range'))
+
+    # If scaling tag with type log10 present, take the log of the image
+    log_scale = None
+    scale = xml_root.find('scaling')
+    if scale != None:
+        log_scale = (scale.get('type') == 'log10')
+
+    # Look for default water distribution info at the top level
+    default_water = None
+    for d in xml_root.findall('distribution'):
+        if d.get('name').lower() == 'water': # Only the last one is used
+            default_water = load_distribution(d)
+
+    values = {'name': name.text.lower(), 'minimum_value': minimum_value, 'maximum_value': maximum_value,
+              'log_scale': log_scale, 'default_water': default_water, 'has_bands': False, 'bands': ()}
+
+    # Read bands, represented by <band> tag
+    bands = xml_root.find('bands')
+    if bands == None:
+        return SensorDescriptor(**values)
+    values['has_bands'] = True
+
+    # Look for display bands at the top band level
+    display_bands = bands.find('display_bands')
+    if display_bands != None:
+        display_band_list = display_bands.text.replace(' ','').split(',') # The band names are comma seperated
+        if len(display_band_list) > 3:
+            raise Exception('Cannot have more than three display bands!')
+        values['display_bands'] = tuple(display_band_list)
+
+    # Looks for display band gains at the top level
+    display_gains = bands.find('display_gains')
+    if display_gains != None:
+        display_gain_list = display_gains.text.split(',') # The band names are comma seperated
+        if len(display_gain_list) > 3:
+            raise Exception('Cannot have more than three display band gains!')
+        values['display_gains'] = tuple(display_gain_list)
+
+    # Shared information (e.g., all bands have same eeid) is loaded directly in <bands>
+    values['default_source'] = load_source(bands) # Located in <bands><source>
+    resolution = bands.find('resolution')
+    if resolution != None: # <bands><resolution>
+        values['default_resolution'] = float(resolution.text)
+
+    # load individual <band> tags
+    band_list = []
+    for b in bands.findall('band'):
+        try:
+            band_name = b.find('name').text
+        except:
+            raise Exception('Unnamed band.')
+        resolution = b.find('resolution')
+        band_list.append(BandDescriptor(name=band_name, source=load_source(b), water=_load_water(b),
+                                        resolution=float(resolution.text) if resolution != None else None))
+    values['bands'] = tuple(band_list)
+
+    # read mask, in <mask> tag
+    mask = bands.find('mask')
+    if mask != None:
+        if mask.get('self') == 'true': # Self mask means that zero-valued pixels in the source will be masked out.
+            values['mask'] = {'self': True}
+        else: # Otherwise there must be an external source
+            if mask.find('source') == None: # Read in source information about the mask
+                raise Exception('Mask specified with no source!')
+            values['mask'] = {'self': False}
+            values['mask'].update(load_source(mask))
+
+    return SensorDescriptor(**values)
+
+
+#=================================================================================
+# Caching of the sensor definition files
+
+class SensorDescriptorCache(object):
+    '''Compiled sensor definition files, recompiled when a file changes'''
+
+    def __init__(self, pickle_path=DEFAULT_PICKLE_PATH):
+        self.pickle_path  = pickle_path
+        self._descriptors = None # Path -> (mtime, SensorDescriptor), loaded on first use
+        self._lock        = threading.Lock()
+
+    def _read_pickle(self):
+        if not self.pickle_path:
+            return dict()
+        try:
+            with open(self.pickle_path, 'rb') as f:
+                return pickle.load(f)
+        except Exception: # Missing or from an incompatible version, start over
+            return dict()
+
+    def _write_pickle(self):
+        '''Write the descriptors to the pickle file.
+           - Entries other processes wrote since the file was read are merged in, if two processes
+             compiled the same sensor file the last one to write wins.'''
+        if not self.pickle_path:
+            return
+        descriptors = self._read_pickle()
+        descriptors.update(self._descriptors)
+        self._descriptors = descriptors
+        def write(temp_path):
+            with open(temp_path, 'wb') as f:
+                pickle.dump(descriptors, f, pickle.HIGHEST_PROTOCOL)
+        try:
+            write_atomic(self.pickle_path, write)
+        except Exception as e: # The cache is only an optimization
+            print 'Unable to write sensor cache %s: %s' % (self.pickle_path, str(e))
+
+    def get(self, xml_path):
+        '''Returns the SensorDescriptor for a sensor definition file'''
+        xml_path = os.path.realpath(xml_path)
+        mtime    = os.path.getmtime(xml_path)
+        with self._lock:
+            if self._descriptors is None:
+                self._descriptors = self._read_pickle()
+            entry = self._descriptors.get(xml_path)
+            if entry and (entry[0] == mtime):
+                return entry[1]
+
+            descriptor = compile_sensor(ET.parse(xml_path).getroot())
+            self._descriptors[xml_path] = (mtime, descriptor)
+            self._write_pickle()
+            return descriptor
+
+_default_cache      = None
+_default_cache_lock = threading.Lock()
+
+def get_sensor_descriptor(xml_path):
+    '''Returns the compiled SensorDescriptor for a sensor definition file using the process wide cache'''
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = SensorDescriptorCache()
+    return _default_cache.get(xml_path)
@@ -0,0 +1,164 @@
+# -----------------------------------------------------------------------------
+# Copyright * 2014, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration. All
+# rights reserved.
+#
+# The Crisis Mapping Toolkit (CMT) v1 platform is licensed under the Apache
+# License, Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import threading
+import urllib2
+
+'''
+Persistent on-disk cache for Earth Engine image downloads.
+
+Downloads are keyed by a hash of the serialized EE expression and the download
+parameters (name, region, scale, crs) so the same computation is only fetched
+once, even across processes and runs.  Files are written atomically and the
+least recently used files are removed when the cache grows past its size limit.
+'''
+
+# The cache location and size can be set through the environment
+DEFAULT_CACHE_DIR = os.environ.get('CMT_CACHE_DIR',
+                                   os.path.join(tempfile.gettempdir(), 'cmt_download_cache'))
+DEFAULT_MAX_MB    = int(os.environ.get('CMT_CACHE_MAX_MB', 2048))
+
+def download_url(url, file_path):
+    '''Download a URL to a file in chunks'''
+    data = urllib2.urlopen(url)
+    with open(file_path, 'wb') as fp:
+        while True:
+            chunk = data.read(16 * 1024)
+            if not chunk:
+                break
+            fp.write(chunk)
+
+def write_atomic(path, write_function):
+    '''Call write_function(temp_path) on a unique temporary file in the folder of path and
+       rename it to path so readers never see a partial file.  The temporary file is
+       removed if the write or the rename fails.'''
+    (handle, temp_path) = tempfile.mkstemp(suffix='.part', dir=os.path.dirname(path) or '.')
+    os.close(handle)
+    try:
+        write_function(temp_path)
+        os.rename(temp_path, path)
+    except:
+        error = sys.exc_info()
+        try:
+            os.remove(temp_path)
+        except OSError: # Don't hide the original error
+            pass
+        raise error[0], error[1], error[2]
+
+class DownloadCache(object):
+    '''Content addressed cache of downloaded Earth Engine files'''
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_mb=DEFAULT_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self._lock     = threading.Lock()
+        try:
+            os.makedirs(cache_dir)
+        except OSError: # Already exists, possibly created by another process
+            if not os.path.isdir(cache_dir):
+                raise
+
+    def make_key(self, ee_object, params):
+        '''Hash the serialized EE expression together with the download parameters'''
+        h = hashlib.sha1()
+        h.update(ee_object.serialize())
+        h.update(json.dumps(params, sort_keys=True))
+        return h.hexdigest()
+
+    def get_path(self, key, suffix='.zip'):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def fetch(self, ee_object, params, suffix='.zip'):
+        '''Return the path to the downloaded file for ee_object.getDownloadUrl(params),
+           downloading it only if it is not already in the cache.'''
+        key  = self.make_key(ee_object, params)
+        path = self.get_path(key, suffix)
+        if os.path.isfile(path):
+            try:
+                os.utime(path, None) # Mark as recently used
+            except OSError: # Evicted by another process, fall through and download again
+                pass
+            else:
+                with self._lock:
+                    self.hits += 1
+                return path
+
+        with self._lock:
+            self.misses += 1
+        url = ee_object.getDownloadUrl(params)
+        print 'Downloading image...'
+        write_atomic(path, lambda temp_path: download_url(url, temp_path))
+        print 'Download complete!'
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        '''Delete the least recently used files until the cache fits in its size limit'''
+        entries = []
+        total   = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.part'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+            total += info.st_size
+        entries.sort()
+        for (mtime, size, path) in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError: # Another process got to it first
+                pass
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def get_stats(self):
+        '''Returns a dictionary of cache hit/miss statistics'''
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def __str__(self):
+        s = self.get_stats()
+        return 'DownloadCache(%s): %d hits, %d misses, %d evictions' % (
+                    self.cache_dir, s['hits'], s['misses'], s['evictions'])
+
+_default_cache      = None
+_default_cache_lock = threading.Lock()
+
+def get_download_cache():
+    '''Returns the process wide DownloadCache'''
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = DownloadCache()
+        return _default_cache
@@ -0,0 +1,142 @@
+# -----------------------------------------------------------------------------
+# Copyright * 2014, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration. All
+# rights reserved.
+#
+# The Crisis Mapping Toolkit (CMT) v1 platform is licensed under the Apache
+# License, Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+# -----------------------------------------------------------------------------
+
+import ee
+
+import cmt.util.ee_request_pool
+
+'''
+Batches independent Earth Engine computations into a single getInfo() request.
+
+Each getInfo() call is a blocking round trip to the EE servers, so instead of
+resolving computations one at a time they are added to an EeBatch which hands
+back an EeFuture for each of them.  When the batch is executed all of the
+computations are packed into one ee.List and fetched together.  If the combined
+request fails the objects are resolved one at a time so that each future gets
+its own result or exception, the same as calling getInfo() on it directly.
+All of the requests go through the shared EeRequestPool so they are rate
+limited and transient errors are retried.
+
+    batch   = EeBatch()
+    means   = batch.add(image.reduceRegion(ee.Reducer.mean(),   region, 30))
+    stdDevs = batch.add(image.reduceRegion(ee.Reducer.stdDev(), region, 30))
+    batch.execute()
+    print means.result(), stdDevs.result()
+'''
+
+
+class EeFuture(object):
+    '''The pending result of a computation added to an EeBatch'''
+
+    def __init__(self, ee_object, batch):
+        self.ee_object  = ee_object
+        self._batch     = batch
+        self._done      = False
+        self._value     = None
+        self._exception = None
+
+    def done(self):
+        '''Returns True if the computation has been resolved'''
+        return self._done
+
+    def result(self):
+        '''Returns the value of the computation, executing the batch if needed.
+           - Raises the exception from the server if the computation failed.'''
+        if not self._done:
+            self._batch.execute()
+        if self._exception is not None:
+            raise self._exception
+        return self._value
+
+    def exception(self):
+        '''Returns the exception raised by the computation, or None'''
+        if not self._done:
+            self._batch.execute()
+        return self._exception
+
+    def _set_result(self, value):
+        self._value = value
+        self._done  = True
+
+    def _set_exception(self, exception):
+        self._exception = exception
+        self._done      = True
+
+
+class EeBatch(object):
+    '''Collects independent EE computations and resolves them in one request.
+       - Can be used as a context manager, the batch is executed on exit.
+       - max_attempts is passed to EeRequestPool.get_info, the default is the pool setting.'''
+
+    def __init__(self, max_attempts=None):
+        self._pending     = []
+        self.max_attempts = max_attempts
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.execute()
+        return False
+
+    def add(self, ee_object):
+        '''Add a computed EE object to the batch and return an EeFuture for its value'''
+        future = EeFuture(ee_object, self)
+        self._pending.append(future)
+        return future
+
+    def execute(self):
+        '''Resolve all pending computations'''
+        pending       = self._pending
+        self._pending = []
+        if not pending:
+            return
+
+        pool = cmt.util.ee_request_pool.get_request_pool()
+        if len(pending) > 1:
+            try:
+                values = pool.get_info(ee.List([f.ee_object for f in pending]), self.max_attempts)
+            except Exception: # At least one computation failed, find out which ones
+                values = None
+            if values is not None:
+                for (f, v) in zip(pending, values):
+                    f._set_result(v)
+                return
+
+        for f in pending:
+            try:
+                f._set_result(pool.get_info(f.ee_object, self.max_attempts))
+            except Exception as e:
+                f._set_exception(e)
+
+
+def get_info_batch(ee_objects):
+    '''Resolve a list of EE objects in a single request, returning a list of values.
+       - Raises the first exception if any of the computations failed.'''
+    batch   = EeBatch()
+    futures = [batch.add(o) for o in ee_objects]
+    batch.execute()
+    return [f.result() for f in futures]
+
+def get_info_dict(ee_objects):
+    '''Resolve a dictionary of EE objects in a single request, returning a dictionary of values'''
+    keys = list(ee_objects.keys())
+    return dict(zip(keys, get_info_batch([ee_objects[k] for k in keys])))
@@ -0,0 +1,209 @@
+# -----------------------------------------------------------------------------
+# Copyright * 2014, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration. All
+# rights reserved.
+#
+# The Crisis Mapping Toolkit (CMT) v1 platform is licensed under the Apache
+# License, Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+import ee
+
+import cmt.util.download_cache
+from cmt.util.ee_request_pool import is_retryable_error
+
+'''
+Record and replay Earth Engine responses.
+
+Once installed, every request sent through ee.data (getInfo() calls, getValue
+requests and download ID requests) is keyed by a hash of its serialized payload
+and the response is stored in the cassette folder.  Files downloaded from the
+resulting URLs are stored too.  Reruns of the same computation are then answered
+from disk, which makes them fast and repeatable and lets them run offline.
+
+    record       Replay recorded responses, send and record anything else.
+    replay       Only replay, a request that was never recorded raises CassetteMiss.
+    passthrough  Send every request and record nothing.
+
+The cassette is configured through the CMT_EE_CASSETTE (folder) and
+CMT_EE_CASSETTE_MODE environment variables, which are read when the EE
+connection is initialized, by the --cassette options of the command line tools,
+or by calling install() directly.
+
+Transient errors are never recorded since they are retried by the request pool,
+but errors which would fail the same way on every run are replayed as EEExceptions.
+'''
+
+MODES = ['record', 'replay', 'passthrough']
+
+DEFAULT_CASSETTE_DIR  = os.environ.get('CMT_EE_CASSETTE')
+DEFAULT_CASSETTE_MODE = os.environ.get('CMT_EE_CASSETTE_MODE', 'record')
+
+# The ee.data functions which send requests, getAlgorithms is called by ee.Initialize()
+PATCHED_FUNCTIONS = ['getValue', 'computeValue', 'getDownloadId', 'getAlgorithms']
+
+
+class CassetteMiss(Exception):
+    '''Raised in replay mode for a request that was never recorded'''
+    pass
+
+class EeCassette(object):
+    '''Folder of recorded Earth Engine responses keyed by request content'''
+
+    def __init__(self, cassette_dir, mode='record'):
+        if mode not in MODES:
+            raise Exception('Unrecognized cassette mode "%s", must be one of: %s' % (mode, ', '.join(MODES)))
+        self.cassette_dir = cassette_dir
+        self.mode         = mode
+        self.hits         = 0
+        self.misses       = 0
+        self._lock        = threading.Lock()
+        try:
+            os.makedirs(cassette_dir)
+        except OSError: # Already exists, possibly created by another process
+            if not os.path.isdir(cassette_dir):
+                raise
+
+    def make_key(self, kind, payload):
+        '''Hash the request type together with its serialized payload'''
+        h = hashlib.sha1()
+        h.update(kind)
+        h.update(json.dumps(payload, sort_keys=True, default=str))
+        return h.hexdigest()
+
+    def get_path(self, key, suffix='.json'):
+        return os.path.join(self.cassette_dir, key + suffix)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits   += 1
+            else:
+                self.misses += 1
+
+    def _load(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError): # Missing, or written by an older run that crashed
+            return None
+
+    def _store(self, path, entry):
+        def write(temp_path):
+            with open(temp_path, 'w') as f:
+                json.dump(entry, f)
+        cmt.util.download_cache.write_atomic(path, write)
+
+    def call(self, kind, function, *args, **kwargs):
+        '''Return the recorded response to function(*args, **kwargs), making the request if needed'''
+        if self.mode == 'passthrough':
+            return function(*args, **kwargs)
+
+        path  = self.get_path(self.make_key(kind, [args, kwargs]))
+        entry = self._load(path)
+        self._count(entry is not None)
+        if entry is not None:
+            if 'error' in entry:
+                raise ee.EEException(entry['error'])
+            return entry['response']
+        if self.mode == 'replay':
+            raise CassetteMiss('No recorded response for %s request %s' % (kind, os.path.basename(path)))
+
+        try:
+            response = function(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable_error(e):
+                self._store(path, {'kind': kind, 'error': str(e)})
+            raise
+        self._store(path, {'kind': kind, 'response': response})
+        return response
+
+    def download(self, function, url, file_path):
+        '''Copy the recorded contents of url to file_path, calling function(url, file_path) if needed'''
+        if self.mode == 'passthrough':
+            return function(url, file_path)
+
+        path = self.get_path(self.make_key('download', url), '.bin')
+        hit  = os.path.isfile(path)
+        self._count(hit)
+        if not hit:
+            if self.mode == 'replay':
+                raise CassetteMiss('No recorded download for ' + url)
+            cmt.util.download_cache.write_atomic(path, lambda temp_path: function(url, temp_path))
+        shutil.copyfile(path, file_path)
+
+    def get_stats(self):
+        '''Returns a dictionary of cassette hit/miss statistics'''
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def __str__(self):
+        s = self.get_stats()
+        return 'EeCassette(%s, %s): %d hits, %d misses' % (self.cassette_dir, self.mode, s['hits'], s['misses'])
+
+
+_cassette        = None
+_real_functions  = dict()
+
+def get_cassette():
+    '''Returns the installed EeCassette, or None'''
+    return _cassette
+
+def _make_wrapper(kind, function):
+    def wrapper(*args, **kwargs):
+        return _cassette.call(kind, function, *args, **kwargs)
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__  = function.__doc__
+    return wrapper
+
+def install(cassette_dir, mode='record'):
+    '''Send all Earth Engine requests through a cassette in cassette_dir'''
+    global _cassette
+    _cassette = EeCassette(cassette_dir, mode)
+    if _real_functions: # Already patched, just switch cassettes
+        return _cassette
+
+    for name in PATCHED_FUNCTIONS:
+        function = getattr(ee.data, name, None)
+        if function is None: # Not present in every version of the API
+            continue
+        _real_functions[name] = function
+        setattr(ee.data, name, _make_wrapper(name, function))
+
+    real_download = cmt.util.download_cache.download_url
+    _real_functions['download_url'] = real_download
+    cmt.util.download_cache.download_url = lambda url, file_path: _cassette.download(real_download, url, file_path)
+    return _cassette
+
+def uninstall():
+    '''Restore the original request functions'''
+    global _cassette
+    for (name, function) in _real_functions.items():
+        if name == 'download_url':
+            cmt.util.download_cache.download_url = function
+        else:
+            setattr(ee.data, name, function)
+    _real_functions.clear()
+    _cassette = None
+
+def install_default(cassette_dir=None, mode=None):
+    '''Install a cassette if one is configured, the environment settings are used by default'''
+    cassette_dir = cassette_dir or DEFAULT_CASSETTE_DIR
+    mode         = mode         or DEFAULT_CASSETTE_MODE
+    if cassette_dir and (mode != 'passthrough'):
+        return install(cassette_dir, mode)
+    return None
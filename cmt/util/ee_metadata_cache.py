@@ -0,0 +1,120 @@
+# -----------------------------------------------------------------------------
+# Copyright * 2014, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration. All
+# rights reserved.
+#
+# The Crisis Mapping Toolkit (CMT) v1 platform is licensed under the Apache
+# License, Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import hashlib
+import threading
+
+from cmt.util.download_cache import DEFAULT_CACHE_DIR, write_atomic
+
+'''
+Persistent sidecar file of small facts about Earth Engine objects.
+
+Loading a domain checks that each band can be retrieved and looks up source
+band names, which costs a round trip per check.  The results of successful
+checks are stored here keyed by a hash of the serialized EE expression, so
+later runs which build the same expressions can skip the requests.  Only facts
+which do not change over time should be stored (a band that exists now will
+still exist later, but a missing band may be added).
+'''
+
+# Stored next to the download cache, not inside it, where it would be evicted with the downloads
+DEFAULT_METADATA_PATH = os.environ.get('CMT_EE_METADATA_CACHE',
+                                       os.path.normpath(DEFAULT_CACHE_DIR) + '_ee_metadata.json')
+
+class EeMetadataCache(object):
+    '''JSON file mapping EE expressions to previously fetched values'''
+
+    def __init__(self, path=DEFAULT_METADATA_PATH):
+        self.path    = path
+        self.hits    = 0
+        self.misses  = 0
+        self._values = None # Loaded on first use
+        self._lock   = threading.Lock()
+
+    def make_key(self, ee_object, kind):
+        '''Hash the serialized EE expression together with the kind of fact stored for it.
+           - Returns None for objects which cannot be serialized (the local backend).'''
+        if not hasattr(ee_object, 'serialize'):
+            return None
+        h = hashlib.sha1()
+        h.update(kind)
+        h.update(ee_object.serialize())
+        return h.hexdigest()
+
+    def _read_file(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError): # Not created yet or unreadable, start over
+            return dict()
+
+    def get(self, ee_object, kind, default=None):
+        '''Returns the stored value for an EE object, or default'''
+        key = self.make_key(ee_object, kind)
+        with self._lock:
+            if self._values is None:
+                self._values = self._read_file()
+            if (key is None) or (key not in self._values):
+                self.misses += 1
+                return default
+            self.hits += 1
+            return self._values[key]
+
+    def set_many(self, items):
+        '''Store a list of (ee_object, kind, value) entries and update the file'''
+        new_values = dict()
+        for (ee_object, kind, value) in items:
+            key = self.make_key(ee_object, kind)
+            if key is not None:
+                new_values[key] = value
+        if not new_values:
+            return
+        with self._lock:
+            # Merge with the file contents in case another process updated it
+            values = self._read_file()
+            values.update(self._values or {})
+            values.update(new_values)
+            self._values = values
+            folder = os.path.dirname(self.path) or '.'
+            try:
+                if not os.path.isdir(folder):
+                    os.makedirs(folder)
+                def write(temp_path):
+                    with open(temp_path, 'w') as f:
+                        json.dump(values, f)
+                write_atomic(self.path, write)
+            except (IOError, OSError) as e: # The cache is only an optimization
+                print 'Unable to update EE metadata cache %s: %s' % (self.path, str(e))
+
+    def set(self, ee_object, kind, value):
+        self.set_many([(ee_object, kind, value)])
+
+    def __str__(self):
+        return 'EeMetadataCache(%s): %d hits, %d misses' % (self.path, self.hits, self.misses)
+
+_default_cache      = None
+_default_cache_lock = threading.Lock()
+
+def get_metadata_cache():
+    '''Returns the process wide EeMetadataCache'''
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EeMetadataCache()
+        return _default_cache
@@ -0,0 +1,246 @@
+# -----------------------------------------------------------------------------
+# Copyright * 2014, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration. All
+# rights reserved.
+#
+# The Crisis Mapping Toolkit (CMT) v1 platform is licensed under the Apache
+# License, Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+# -----------------------------------------------------------------------------
+
+import os
+import re
+import time
+import random
+import socket
+import httplib
+import urllib2
+import threading
+import multiprocessing.pool
+
+import cmt.util.ee_trace
+
+'''
+Shared scheduler for Earth Engine requests.
+
+All requests go through one EeRequestPool which caps the number of requests in
+flight and the rate at which they are started.  Failed requests are retried
+with exponential backoff and jitter unless the error is one of the Earth Engine
+errors in FATAL_PATTERNS (too many pixels, missing asset or band, ...), which
+are raised immediately.
+When a quota error is seen every thread backs off, not just the one that got it.
+
+Work can be submitted to the pool's worker threads so that independent requests
+run concurrently:
+
+    pool    = get_request_pool()
+    results = pool.map_get_info([a, b, c])          # Blocks until all finish
+    pending = pool.get_info_async(d)                # Returns an AsyncResult
+    value   = pending.get()
+'''
+
+# The pool limits can be set through the environment
+DEFAULT_MAX_IN_FLIGHT  = int(  os.environ.get('CMT_EE_MAX_IN_FLIGHT', 8))
+DEFAULT_MAX_PER_SECOND = float(os.environ.get('CMT_EE_MAX_PER_SECOND', 20))
+
+# Earth Engine errors matching these patterns will never succeed on a retry
+FATAL_PATTERNS     = [r'Too many pixels in the region', r'User memory limit exceeded',
+                      r"[Aa]sset (?:'[^']*' )?not found", r"Pattern '[^']*' did not match any bands",
+                      r"Parameter '[^']*' is required", r'Invalid GeoJSON geometry']
+
+# Errors containing these messages mean the servers want us to slow down
+QUOTA_MESSAGES     = ['429', 'Too Many Requests', 'Too many concurrent', 'Quota exceeded',
+                      'quota', 'rate limit', 'Rate limit']
+
+# Other errors containing these messages are transient
+TRANSIENT_MESSAGES = ['timed out', 'Timed out', 'timeout', 'Deadline exceeded', 'Internal error',
+                      'Service Unavailable', 'HTTP Error 500', 'HTTP Error 502', 'HTTP Error 503',
+                      'HTTP Error 504', 'Connection reset', 'Connection refused', 'capacity exceeded']
+
+
+def _message_matches(message, message_list):
+    for m in message_list:
+        if m in message:
+            return True
+    return False
+
+_fatal_regex = re.compile('|'.join(['(?:%s)' % p for p in FATAL_PATTERNS]))
+
+def is_quota_error(exception):
+    '''Returns True if the error means we are sending requests too quickly'''
+    return _message_matches(str(exception), QUOTA_MESSAGES)
+
+def is_retryable_error(exception):
+    '''Returns True if the request that raised this error may succeed if it is tried again'''
+    if isinstance(exception, (socket.error, httplib.HTTPException, urllib2.URLError)):
+        return True
+    message = str(exception)
+    if _message_matches(message, QUOTA_MESSAGES) or _message_matches(message, TRANSIENT_MESSAGES):
+        return True
+    if _fatal_regex.search(message):
+        return False
+    # Anything else is retried, like safe_get_info always has
+    return True
+
+
+class _CompletedResult(object):
+    '''Result of a function that was run in the calling thread, with the AsyncResult interface'''
+
+    def __init__(self, function, args, kwds):
+        self._value     = None
+        self._exception = None
+        try:
+            self._value = function(*args, **kwds)
+        except Exception as e:
+            self._exception = e
+
+    def ready(self):
+        return True
+
+    def successful(self):
+        return self._exception is None
+
+    def get(self, timeout=None):
+        if self._exception is not None:
+            raise self._exception
+        return self._value
+
+
+class EeRequestPool(object):
+    '''Thread pool which schedules and retries Earth Engine requests'''
+
+    def __init__(self, max_in_flight=DEFAULT_MAX_IN_FLIGHT, max_per_second=DEFAULT_MAX_PER_SECOND,
+                 max_attempts=5, base_delay=1.0, max_delay=60.0):
+        self.max_in_flight = max_in_flight
+        self.min_interval  = 1.0 / max_per_second if max_per_second else 0.0
+        self.max_attempts  = max_attempts
+        self.base_delay    = base_delay
+        self.max_delay     = max_delay
+
+        self._slots       = threading.BoundedSemaphore(max_in_flight)
+        self._lock        = threading.Lock()
+        self._next_start  = 0.0 # Earliest time the next request may start
+        self._resume_time = 0.0 # All requests wait until this time after a quota error
+        self._thread_pool = None
+        self._local       = threading.local()
+
+        self.num_requests = 0
+        self.num_retries  = 0
+        self.num_failures = 0
+
+    def _get_thread_pool(self):
+        with self._lock:
+            if self._thread_pool is None:
+                self._thread_pool = multiprocessing.pool.ThreadPool(self.max_in_flight)
+            return self._thread_pool
+
+    def _wait_for_turn(self):
+        '''Sleep until the rate limit allows another request to start'''
+        with self._lock:
+            now   = time.time()
+            start = max(now, self._next_start, self._resume_time)
+            self._next_start = start + self.min_interval
+            self.num_requests += 1
+        if start > now:
+            time.sleep(start - now)
+
+    def _get_backoff_delay(self, attempt):
+        '''Exponential backoff with jitter so retrying threads do not all wake up together'''
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * (0.5 + 0.5 * random.random())
+
+    def call(self, function, args=(), kwds=None, max_attempts=None):
+        '''Call function(*args, **kwds) in this thread, retrying transient errors.
+           - max_attempts defaults to the pool setting, zero means no limit.'''
+        if kwds is None:
+            kwds = {}
+        if max_attempts is None:
+            max_attempts = self.max_attempts
+
+        attempt = 0
+        while True:
+            self._wait_for_turn()
+            cmt.util.ee_trace.set_attempt(attempt)
+            try:
+                with self._slots:
+                    return function(*args, **kwds)
+            except Exception as e:
+                attempt += 1
+                if (not is_retryable_error(e)) or (max_attempts and (attempt >= max_attempts)):
+                    with self._lock:
+                        self.num_failures += 1
+                    raise
+
+                delay = self._get_backoff_delay(attempt - 1)
+                with self._lock:
+                    self.num_retries += 1
+                    if is_quota_error(e): # Slow everyone down, not just this thread
+                        self._resume_time = max(self._resume_time, time.time() + delay)
+                print 'Earth Engine Error: %s. Waiting %.1fs and then retrying.' % (e, delay)
+                time.sleep(delay)
+
+    def get_info(self, ee_object, max_attempts=None):
+        '''Call getInfo() on an EE object, retrying transient errors'''
+        return self.call(ee_object.getInfo, max_attempts=max_attempts)
+
+    def _run_in_worker(self, stage, function, args, kwds):
+        self._local.is_worker = True
+        cmt.util.ee_trace.set_stage(stage) # Label requests with the stage that submitted them
+        return function(*args, **kwds)
+
+    def submit(self, function, args=(), kwds=None):
+        '''Run function(*args, **kwds) on a worker thread, returns an AsyncResult.
+           - The function should make its requests through this pool.
+           - Called from a worker thread the function is run immediately, since waiting
+             on other workers from inside a worker could deadlock the pool.'''
+        if kwds is None:
+            kwds = {}
+        if getattr(self._local, 'is_worker', False):
+            return _CompletedResult(function, args, kwds)
+        return self._get_thread_pool().apply_async(self._run_in_worker,
+                                                   (cmt.util.ee_trace.get_stage(), function, args, kwds))
+
+    def get_info_async(self, ee_object, max_attempts=None):
+        '''Call getInfo() on an EE object from a worker thread, returns an AsyncResult'''
+        return self.submit(self.get_info, (ee_object, max_attempts))
+
+    def map(self, function, arg_list):
+        '''Call function on each item of arg_list concurrently and return the list of results'''
+        if getattr(self._local, 'is_worker', False):
+            # Waiting on other workers from inside a worker could deadlock the pool
+            return [function(a) for a in arg_list]
+        results = [self.submit(function, (a,)) for a in arg_list]
+        return [r.get() for r in results]
+
+    def map_get_info(self, ee_objects, max_attempts=None):
+        '''Call getInfo() on each EE object concurrently and return the list of results'''
+        return self.map(lambda o: self.get_info(o, max_attempts), ee_objects)
+
+    def get_stats(self):
+        '''Returns a dictionary of request statistics'''
+        with self._lock:
+            return {'requests': self.num_requests, 'retries': self.num_retries,
+                    'failures': self.num_failures}
+
+    def __str__(self):
+        s = self.get_stats()
+        return 'EeRequestPool(%d in flight): %d requests, %d retries, %d failures' % (
+                    self.max_in_flight, s['requests'], s['retries'], s['failures'])
+
+_default_pool      = None
+_default_pool_lock = threading.Lock()
+
+def get_request_pool():
+    '''Returns the process wide EeRequestPool'''
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = EeRequestPool()
+        return _default_pool
@@ -0,0 +1,291 @@
+# -----------------------------------------------------------------------------
+# Copyright * 2014, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration. All
+# rights reserved.
+#
+# The Crisis Mapping Toolkit (CMT) v1 platform is licensed under the Apache
+# License, Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import contextlib
+
+'''
+Tracing of Earth Engine round trips.
+
+When enabled, every request sent through ee.data (which includes all getInfo()
+calls) and every file download is timed and logged together with the code that
+made it, the size of the request and response, the current stage of the run
+and the retry attempt.  When the process exits a summary table is printed and
+the events are written as a Chrome trace file which can be opened in
+chrome://tracing or https://ui.perfetto.dev.
+
+Tracing is turned on by setting CMT_EE_TRACE to the output file path (or to 1
+to write ee_trace_<pid>.json) before the EE connection is initialized.  Scripts
+can label the parts of a run with set_stage() or the stage() context manager:
+
+    cmt.util.ee_trace.set_stage('Loading sensors')
+    with cmt.util.ee_trace.stage('Evaluation'):
+        ...
+
+Multiprocessing workers do not run exit handlers, so they write their own trace
+files (<trace>_<pid>.json) when they call write_process_trace().
+'''
+
+DEFAULT_TRACE_PATH = os.environ.get('CMT_EE_TRACE')
+
+# The ee.data functions which send requests
+TRACED_FUNCTIONS = ['getValue', 'computeValue', 'getDownloadId', 'getAlgorithms', 'getMapId']
+
+# Frames in these modules are request plumbing, the caller is the first frame outside of them
+_PLUMBING_MODULES   = ['cmt.util.ee_trace', 'cmt.util.ee_cassette', 'cmt.util.ee_request_pool',
+                       'cmt.util.ee_batch', 'cmt.util.download_cache', 'threading', 'multiprocessing.pool']
+_PLUMBING_FUNCTIONS = ['safe_get_info', 'safe_get_info_list', 'safeEeImageDownload', 'downloadEeImage']
+
+
+class EeTracer(object):
+    '''Collects timing events for Earth Engine requests'''
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.pid         = os.getpid()
+        self.start_time  = time.time()
+        self.events      = []
+        self._lock       = threading.Lock()
+        self._local      = threading.local()
+
+    # ----- Context for each thread
+
+    def get_stage(self):
+        return getattr(self._local, 'stage', None) or 'main'
+
+    def set_stage(self, name):
+        self._local.stage = name
+        self._add_event({'name': name, 'ph': 'i', 's': 'p', 'ts': self._now_us(), 'tid': self._thread_id()})
+
+    def get_attempt(self):
+        return getattr(self._local, 'attempt', 0)
+
+    def set_attempt(self, attempt):
+        self._local.attempt = attempt
+
+    # ----- Recording
+
+    def _now_us(self):
+        return int((time.time() - self.start_time) * 1e6)
+
+    def _thread_id(self):
+        return threading.current_thread().ident % 100000
+
+    def _add_event(self, event):
+        event['pid'] = os.getpid()
+        with self._lock:
+            self.events.append(event)
+
+    def trace(self, kind, function, payload_size, args, kwargs, response_size_function=None):
+        '''Call function(*args, **kwargs) and record how long it took'''
+        caller  = find_caller()
+        stage   = self.get_stage()
+        attempt = self.get_attempt()
+        self.set_attempt(0) # Only applies to the next request
+        start   = time.time()
+        error   = None
+        result  = None
+        try:
+            result = function(*args, **kwargs)
+            return result
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            elapsed  = time.time() - start
+            response = 0
+            if error is None:
+                response = response_size_function() if response_size_function else _get_size(result)
+            self._add_event({'name': kind, 'cat': stage, 'ph': 'X', 'tid': self._thread_id(),
+                             'ts': int((start - self.start_time) * 1e6), 'dur': int(elapsed * 1e6),
+                             'args': {'caller': caller, 'request_bytes': payload_size,
+                                      'response_bytes': response, 'attempt': attempt, 'error': error}})
+
+    # ----- Output
+
+    def _get_events(self):
+        '''Events recorded by this process, forked worker processes inherit their parent's events'''
+        pid = os.getpid()
+        with self._lock:
+            return [e for e in self.events if e['pid'] == pid]
+
+    def get_summary(self):
+        '''Returns a list of totals for each (stage, caller, request type), slowest first'''
+        totals = dict()
+        events = [e for e in self._get_events() if e['ph'] == 'X']
+        for e in events:
+            args = e['args']
+            key  = (e['cat'], args['caller'], e['name'])
+            if key not in totals:
+                totals[key] = {'stage': key[0], 'caller': key[1], 'kind': key[2], 'count': 0, 'seconds': 0.0,
+                               'max_seconds': 0.0, 'request_bytes': 0, 'response_bytes': 0, 'retries': 0, 'errors': 0}
+            t = totals[key]
+            seconds = e['dur'] / 1e6
+            t['count']          += 1
+            t['seconds']        += seconds
+            t['max_seconds']     = max(t['max_seconds'], seconds)
+            t['request_bytes']  += args['request_bytes']
+            t['response_bytes'] += args['response_bytes']
+            t['retries']        += 1 if args['attempt'] else 0
+            t['errors']         += 1 if args['error'] else 0
+        return sorted(totals.values(), key=lambda t: -t['seconds'])
+
+    def print_summary(self):
+        summary = self.get_summary()
+        if not summary:
+            return
+        print '\nEarth Engine requests (%d):' % sum([t['count'] for t in summary])
+        print '%-24s %-44s %-14s %6s %9s %9s %9s %10s %10s %7s %6s' % (
+                'stage', 'caller', 'request', 'count', 'total s', 'mean ms', 'max ms',
+                'sent KB', 'recv KB', 'retries', 'errors')
+        for t in summary:
+            print '%-24s %-44s %-14s %6d %9.2f %9.1f %9.1f %10.1f %10.1f %7d %6d' % (
+                    t['stage'][:24], t['caller'][-44:], t['kind'], t['count'], t['seconds'],
+                    1000.0 * t['seconds'] / t['count'], 1000.0 * t['max_seconds'],
+                    t['request_bytes'] / 1024.0, t['response_bytes'] / 1024.0, t['retries'], t['errors'])
+
+    def write_chrome_trace(self, path=None):
+        '''Write the events in the Chrome trace event format'''
+        if path is None:
+            path = self.output_path
+            if os.getpid() != self.pid: # A worker process, don't overwrite the main trace
+                (root, ext) = os.path.splitext(path)
+                path = '%s_%d%s' % (root, os.getpid(), ext)
+        events = self._get_events()
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        print 'Wrote Earth Engine trace to ' + path
+
+    def finish(self):
+        '''Print the summary and write the trace file'''
+        self.print_summary()
+        try:
+            self.write_chrome_trace()
+        except IOError as e:
+            print 'Unable to write the Earth Engine trace: ' + str(e)
+
+
+def _get_size(value):
+    '''Approximate size of a request payload or response in bytes'''
+    if value is None:
+        return 0
+    if isinstance(value, basestring):
+        return len(value)
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+def find_caller():
+    '''Returns "module.function" of the code which made the current request'''
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if not ((module in _PLUMBING_MODULES) or module == 'ee' or module.startswith('ee.') or
+                (frame.f_code.co_name in _PLUMBING_FUNCTIONS)):
+            return module + '.' + frame.f_code.co_name
+        frame = frame.f_back
+    return 'unknown'
+
+
+#=================================================================================
+
+_tracer         = None
+_real_functions = dict()
+
+def get_tracer():
+    '''Returns the installed EeTracer, or None if tracing is off'''
+    return _tracer
+
+def set_stage(name):
+    '''Label the requests made by this thread from now on'''
+    if _tracer:
+        _tracer.set_stage(name)
+
+def get_stage():
+    return _tracer.get_stage() if _tracer else None
+
+@contextlib.contextmanager
+def stage(name):
+    '''Label the requests made by this thread inside the with block'''
+    if not _tracer:
+        yield
+        return
+    previous = getattr(_tracer._local, 'stage', None)
+    _tracer.set_stage(name)
+    try:
+        yield
+    finally:
+        _tracer._local.stage = previous
+
+def write_process_trace():
+    '''Write the trace of a multiprocessing worker, which does not run exit handlers'''
+    if _tracer and (os.getpid() != _tracer.pid):
+        _tracer.write_chrome_trace()
+
+def set_attempt(attempt):
+    '''Called by the request pool so that retried requests can be counted'''
+    if _tracer:
+        _tracer.set_attempt(attempt)
+
+def _make_wrapper(kind, function):
+    def wrapper(*args, **kwargs):
+        return _tracer.trace(kind, function, _get_size([args, kwargs]), args, kwargs)
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__  = function.__doc__
+    return wrapper
+
+def install(output_path):
+    '''Trace all Earth Engine requests and write the results when the process exits'''
+    global _tracer
+    import ee
+    import cmt.util.download_cache
+
+    _tracer = EeTracer(output_path)
+    if _real_functions: # Already patched, just start a new trace
+        return _tracer
+
+    for name in TRACED_FUNCTIONS:
+        function = getattr(ee.data, name, None)
+        if function is None: # Not present in every version of the API
+            continue
+        _real_functions[name] = function
+        setattr(ee.data, name, _make_wrapper(name, function))
+
+    real_download = cmt.util.download_cache.download_url
+    _real_functions['download_url'] = real_download
+    def download_url(url, file_path):
+        return _tracer.trace('download', real_download, len(url), (url, file_path), {},
+                             lambda: os.path.getsize(file_path) if os.path.exists(file_path) else 0)
+    cmt.util.download_cache.download_url = download_url
+
+    atexit.register(lambda: _tracer and _tracer.finish())
+    return _tracer
+
+def install_default():
+    '''Start tracing if CMT_EE_TRACE is set'''
+    if not DEFAULT_TRACE_PATH:
+        return None
+    path = DEFAULT_TRACE_PATH
+    if path == '1':
+        path = 'ee_trace_%d.json' % os.getpid()
+    return install(path)
@@ -20,6 +20,7 @@ import threading
 import functools
 import time
 import cmt.util.miscUtilities
+import cmt.util.ee_request_pool
 #import cmt.mapclient_qt
 
 
@@ -34,8 +35,9 @@ def countNumBlobs(classifiedImage, region, maxBlobSize, evalResolution=500): # I
                                          geometryType='centroid', bestEffort=True)
     vectorsOff = offBlobs.reduceToVectors(scale=evalResolution, geometry=region,
                                          geometryType='centroid', bestEffort=True)
-    numOnBlobs  = len(vectorsOn.getInfo()['features'])
-    numOffBlobs = len(vectorsOff.getInfo()['features'])
+    (infoOn, infoOff) = cmt.util.miscUtilities.safe_get_info_list([vectorsOn, vectorsOff])
+    numOnBlobs  = len(infoOn['features'])
+    numOffBlobs = len(infoOff['features'])
     return (numOnBlobs, numOffBlobs)
     
 
@@ -63,8 +65,9 @@ def evaluate_result_quality(resultIn, region):
     # Make sure enough of the water mask has been filled in
     MIN_PERCENT_MASK_FILL = 0.60
     filledWaterMask      = waterMask.And(result)
-    filledWaterCount     = filledWaterMask.reduceRegion(ee.Reducer.sum(), region, EVAL_RESOLUTION).getInfo()['b1']
-    waterMaskCount       = waterMask.reduceRegion(ee.Reducer.sum(), region, EVAL_RESOLUTION).getInfo()['b1']
+    (filledWaterCount, waterMaskCount) = [c['b1'] for c in cmt.util.miscUtilities.safe_get_info_list(
+                                                [filledWaterMask.reduceRegion(ee.Reducer.sum(), region, EVAL_RESOLUTION),
+                                                 waterMask.reduceRegion(      ee.Reducer.sum(), region, EVAL_RESOLUTION)])]
     if waterMaskCount == 0: # Can't do much without the water mask!
         return 1.0 # Give it the benefit of the doubt.
     waterMaskPercentFill = filledWaterCount / waterMaskCount
@@ -126,9 +129,13 @@ def evaluate_approach(result, ground_truth, region, fractional=False):
             #truth_sum   = ground_truth.reduceRegion(ee.Reducer.sum(), region, eval_res, 'EPSG:4326' ).getInfo()['b1'] # Total water
     
             # Evaluate the results at a large number of random sample points
-            correct_sum = ee.data.getValue({'image': correct.stats(     eval_points, region, 'EPSG:4326').serialize(), 'fields': 'b1'})['properties']['b1']['values']['sum']
-            result_sum  = ee.data.getValue({'image': result.stats(      eval_points, region, 'EPSG:4326').serialize(), 'fields': 'b1'})['properties']['b1']['values']['sum']
-            truth_sum   = ee.data.getValue({'image': ground_truth.stats(eval_points, region, 'EPSG:4326').serialize(), 'fields': 'b1'})['properties']['b1']['values']['sum']
+            # - The three requests are independent so they are made concurrently.  Failures
+            #   are not retried here since we respond to them by lowering the resolution.
+            pool = cmt.util.ee_request_pool.get_request_pool()
+            def get_sum(image):
+                params = {'image': image.stats(eval_points, region, 'EPSG:4326').serialize(), 'fields': 'b1'}
+                return pool.call(ee.data.getValue, (params,), max_attempts=1)['properties']['b1']['values']['sum']
+            (correct_sum, result_sum, truth_sum) = pool.map(get_sum, [correct, result, ground_truth])
             
             break # Quit the loop if the calculations were successful
         except Exception,e: # On failure coursen the resolution and try again
@@ -17,9 +17,11 @@
 
 import ee
 import os
+import datetime
 import functools
 import cmt.modis.modis_utilities
 import cmt.util.landsat_functions
+import cmt.util.ee_request_pool
 import miscUtilities
 
 
@@ -30,9 +32,6 @@ def get_image_collection_landsat(bounds, start_date, end_date, collectionName='L
     '''Retrieve Landsat imagery for the selected location and dates.'''
 
     ee_bounds  = bounds
-    ee_points  = ee.List(bounds.bounds().coordinates().get(0))
-    points     = ee_points.getInfo()
-    points     = map(functools.partial(apply, ee.Geometry.Point), points)
 #    collection = ee.ImageCollection(collectionName).filterDate(start_date, end_date) \
 #                                    .filterBounds(points[0]).filterBounds(points[1]) \
 #                                    .filterBounds(points[2]).filterBounds(points[3])
@@ -95,29 +94,28 @@ def get_image_collection_sentinel1(bounds, start_date, end_date, min_images=1):
     angleList      = ['ASCENDING', 'DESCENDING']
 
     ee_bounds  = bounds
-    ee_points  = ee.List(bounds.bounds().coordinates().get(0))
-    points     = ee_points.getInfo()
-    points     = map(functools.partial(apply, ee.Geometry.Point), points)
     print 'Searching for S1 centroid: ' + str(bounds.centroid().getInfo())
     
-    # Loop through the variable combinations
-    for resolution in resolutionList:
-        print 'Searching S1 resolution: ' + str(resolution)
-        for angle in angleList:
-            print 'Searching S1 angle: ' + str(angle)
-            collection = ee.ImageCollection('COPERNICUS/S1_GRD').filterDate(start_date, end_date) \
-                          .filterBounds(bounds.centroid()) \
-                          .filter(ee.Filter.eq('resolution_meters',    resolution)) \
-                          .filter(ee.Filter.eq('orbitProperties_pass', angle))
-#                                            .filterBounds(points[0]).filterBounds(points[1]) \
-#                                            .filterBounds(points[2]).filterBounds(points[3]) \
-
-            # Accept the result if we got as many images as the user requested.
-            numFound = collection.size().getInfo()
-            print 'Found ' + str(numFound) + ' images'
-            if numFound >= min_images:
-                # Switch band names to lower case to be consistent with domain notation               
-                return cmt.util.miscUtilities.safeRename(collection, ['VV', 'VH'], ['vv', 'vh'])
+    # Count the images for all of the variable combinations concurrently
+    combinations = [(resolution, angle) for resolution in resolutionList for angle in angleList]
+    collections  = []
+    for (resolution, angle) in combinations:
+        collection = ee.ImageCollection('COPERNICUS/S1_GRD').filterDate(start_date, end_date) \
+                      .filterBounds(bounds.centroid()) \
+                      .filter(ee.Filter.eq('resolution_meters',    resolution)) \
+                      .filter(ee.Filter.eq('orbitProperties_pass', angle))
+        collections.append(collection)
+    counts = miscUtilities.safe_get_info_list([c.size() for c in collections])
+
+    # Loop through the variable combinations in order of preference
+    for ((resolution, angle), collection, numFound) in zip(combinations, collections, counts):
+        print 'Searching S1 resolution: ' + str(resolution) + ', angle: ' + str(angle)
+
+        # Accept the result if we got as many images as the user requested.
+        print 'Found ' + str(numFound) + ' images'
+        if numFound >= min_images:
+            # Switch band names to lower case to be consistent with domain notation               
+            return cmt.util.miscUtilities.safeRename(collection, ['VV', 'VH'], ['vv', 'vh'])
 
                                             
     return collection # Failed to find anything!
@@ -126,11 +124,78 @@ def get_image_collection_sentinel1(bounds, start_date, end_date, min_images=1):
 #=================================================================================
 # A set of functions to find a cloud free image near a date
 
+def _getSearchIndices(numFound, searchMethod):
+    '''Returns the order in which to check the candidate images'''
+    if searchMethod == 'spiral':
+        return miscUtilities.getExpandingIndices(numFound)
+    elif searchMethod == 'increasing':
+        return range(0,numFound)
+    else:
+        return range(numFound-1, -1, -1)
+
+def _findFirstCloudFree(imageList, searchMethod, bounds, cloudFunction, maxCloudPercentage, sensorName):
+    '''Returns the first image in search order with a low cloud percentage, or None.
+       - The cloud percentages are computed concurrently, one group of pool.max_in_flight images at
+         a time.  Requests for the rest of the group are still sent after a match is found.'''
+    numFound = len(miscUtilities.safe_get_info(imageList))
+    images   = [ee.Image(imageList.get(i)).resample('bicubic') for i in _getSearchIndices(numFound, searchMethod)]
+
+    pool      = cmt.util.ee_request_pool.get_request_pool()
+    groupSize = pool.max_in_flight
+    for start in range(0, len(images), groupSize):
+        group   = images[start:start+groupSize]
+        results = [pool.submit(cloudFunction, (image, bounds)) for image in group]
+        for (image, result) in zip(group, results):
+            cloudPercentage = result.get()
+            print 'Detected ' + sensorName + ' cloud percentage: ' + str(cloudPercentage)
+            if cloudPercentage < maxCloudPercentage:
+                return image
+    return None
+
+def _findFirstCloudFreeOnServer(imageList, searchMethod, bounds, cloudFunction, maxCloudPercentage,
+                                sensorName, resolutions=None):
+    '''Returns the first image in search order with a low cloud percentage, or None.
+       - cloudFunction(image, bounds) returns an ee.Number, it is mapped over all of the candidates
+         so that their cloud percentages and dates are fetched in a single request.
+       - If resolutions are given the function is called as cloudFunction(image, bounds, resolution)
+         and the request is repeated at each resolution in turn until it succeeds.'''
+
+    def getRequest(resolution):
+        def computeCandidate(image):
+            image = ee.Image(image)
+            if resolution is None:
+                percentage = cloudFunction(image.resample('bicubic'), bounds)
+            else:
+                percentage = cloudFunction(image.resample('bicubic'), bounds, resolution)
+            return ee.List([image.get('system:time_start'), percentage])
+        return imageList.map(computeCandidate)
+
+    for resolution in (resolutions or [None]):
+        try:
+            candidateInfo = miscUtilities.safe_get_info(getRequest(resolution))
+            break
+        except Exception as e:
+            # Keep trying with lower resolution until we succeed
+            if (resolutions is None) or (resolution == resolutions[-1]):
+                raise e
+
+    for i in _getSearchIndices(len(candidateInfo), searchMethod):
+        (timeStart, cloudPercentage) = candidateInfo[i]
+        date = datetime.datetime.utcfromtimestamp(timeStart / 1000.0).strftime('%Y-%m-%d') if timeStart else '?'
+        print 'Detected ' + sensorName + ' cloud percentage on ' + date + ': ' + str(cloudPercentage)
+        if (cloudPercentage is not None) and (cloudPercentage < maxCloudPercentage):
+            return ee.Image(imageList.get(i)).resample('bicubic')
+    return None
+
 def getCloudFreeModis(bounds, targetDate, maxRangeDays=10, maxCloudPercentage=0.05,
-                      searchMethod='spiral'):
+                      searchMethod='spiral', serverSide=True):
     '''Search for the closest cloud-free MODIS image near the target date.
        The result preference is determined by searchMethod and can be  set to:
-       spiral, increasing, or decreasing'''
+       spiral, increasing, or decreasing
+       If serverSide is set the cloud percentages of all candidates are computed in one request,
+       otherwise the candidates are searched in concurrent groups of the request pool size.  The
+       rest of a group is still computed after a cloud-free image is found, so a few more requests
+       than needed may be sent.'''
     
     # Get the date range to search
     if searchMethod == 'spiral':
@@ -143,31 +208,31 @@ def getCloudFreeModis(bounds, targetDate, maxRangeDays=10, maxCloudPercentage=0.
     # Get a list of candidate images
     imageCollection = get_image_collection_modis(bounds, dateStart, dateEnd)
     imageList       = imageCollection.toList(100)
-    imageInfo       = imageList.getInfo()
     
     # Find the first image with a low cloud percentage
-    numFound = len(imageInfo)
-    if searchMethod == 'spiral':
-        searchIndices = miscUtilities.getExpandingIndices(numFound)
-    elif searchMethod == 'increasing':
-        searchIndices = range(0,numFound)
+    if serverSide:
+        thisImage = _findFirstCloudFreeOnServer(imageList, searchMethod, bounds,
+                                                cmt.modis.modis_utilities.computeCloudPercentage,
+                                                maxCloudPercentage, 'MODIS')
     else:
-        searchIndices = range(numFound-1, -1, -1)
-    for i in searchIndices:
-        thisImage       = ee.Image(imageList.get(i)).resample('bicubic')
-        cloudPercentage = cmt.modis.modis_utilities.getCloudPercentage(thisImage, bounds)
-        print 'Detected MODIS cloud percentage: ' + str(cloudPercentage)
-        if cloudPercentage < maxCloudPercentage:
-            return thisImage
+        thisImage = _findFirstCloudFree(imageList, searchMethod, bounds,
+                                        cmt.modis.modis_utilities.getCloudPercentage,
+                                        maxCloudPercentage, 'MODIS')
+    if thisImage:
+        return thisImage
 
     raise Exception('Could not find a nearby cloud-free MODIS image for date ' + str(targetDate.getInfo()))
 
 
 def getCloudFreeLandsat(bounds, targetDate, maxRangeDays=10, maxCloudPercentage=0.05,
-                        searchMethod='spiral'):
+                        searchMethod='spiral', serverSide=True):
     '''Search for the closest cloud-free Landsat image near the target date.
        The result preference is determined by searchMethod and can be  set to:
-       spiral, increasing, or decreasing'''
+       spiral, increasing, or decreasing
+       If serverSide is set the cloud percentages of all candidates are computed in one request,
+       otherwise the candidates are searched in concurrent groups of the request pool size.  The
+       rest of a group is still computed after a cloud-free image is found, so a few more requests
+       than needed may be sent.'''
 
     # Get the date range to search
     if searchMethod == 'spiral':
@@ -184,22 +249,19 @@ def getCloudFreeLandsat(bounds, targetDate, maxRangeDays=10, maxCloudPercentage=
         # Get candidate images for this sensor
         imageCollection = get_image_collection_landsat(bounds, dateStart, dateEnd, name)
         imageList       = imageCollection.toList(100)
-        imageInfo       = imageList.getInfo()
         
         # Find the first image with a low cloud percentage
-        numFound = len(imageInfo)
-        if searchMethod == 'spiral':
-            searchIndices = miscUtilities.getExpandingIndices(numFound)
-        elif searchMethod == 'increasing':
-            searchIndices = range(0,numFound)
+        if serverSide:
+            thisImage = _findFirstCloudFreeOnServer(imageList, searchMethod, bounds,
+                                                    cmt.util.landsat_functions.computeCloudPercentage,
+                                                    maxCloudPercentage, 'Landsat',
+                                                    cmt.util.landsat_functions.CLOUD_RESOLUTIONS)
         else:
-            searchIndices = range(numFound-1, -1, -1)
-        for i in searchIndices:
-            thisImage       = ee.Image(imageList.get(i)).resample('bicubic')
-            cloudPercentage = cmt.util.landsat_functions.getCloudPercentage(thisImage, bounds)
-            print 'Detected Landsat cloud percentage: ' + str(cloudPercentage)
-            if cloudPercentage < maxCloudPercentage:
-                return thisImage
+            thisImage = _findFirstCloudFree(imageList, searchMethod, bounds,
+                                            cmt.util.landsat_functions.getCloudPercentage,
+                                            maxCloudPercentage, 'Landsat')
+        if thisImage:
+            return thisImage
         # If we got here this satellite did not produce a good image, try the next satellite.
 
     raise Exception('Could not find a nearby cloud-free Landsat image for date ' + str(targetDate.getInfo()))
@@ -224,7 +286,7 @@ def getNearestSentinel1(bounds, targetDate, maxRangeDays=10, searchMethod='spira
     # Get a list of candidate images
     imageCollection = get_image_collection_sentinel1(bounds, dateStart, dateEnd)
     imageList       = imageCollection.toList(100)
-    imageInfo       = imageList.getInfo()
+    imageInfo       = miscUtilities.safe_get_info(imageList)
     
     if len(imageInfo) == 0:
         raise Exception('Could not find a nearby Sentinel1 image for date ' + str(targetDate.getInfo()))
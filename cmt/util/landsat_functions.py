@@ -103,27 +103,26 @@ def detect_clouds(img):
     CLOUD_THRESHOLD = 0.35
     return score.gt(CLOUD_THRESHOLD)
 
+# getCloudPercentage tries these resolutions in order until the calculation succeeds
+# - Native Landsat resolution is 30
+CLOUD_RESOLUTIONS = [60, 120, 240, 480, 960]
+
+def computeCloudPercentage(image, region, resolution):
+    '''Returns an ee.Number with the cloud cover percentage of a Landsat image'''
+    oneMask    = ee.Image(1.0)
+    cloudScore = detect_clouds(image)
+    areaCount  = oneMask.reduceRegion(  ee.Reducer.sum(), region, resolution)
+    cloudCount = cloudScore.reduceRegion(ee.Reducer.sum(), region, resolution)
+    return ee.Number(cloudCount.get('constant')).divide(areaCount.get('constant'))
+
 def getCloudPercentage(image, region):
     '''Estimates the cloud cover percentage in a Landsat image'''
-    
-    # The function will attempt the calculation in these ranges
-    # - Native Landsat resolution is 30
-    MIN_RESOLUTION = 60
-    MAX_RESOLUTION = 1000
-    
-    resolution = MIN_RESOLUTION
-    while True:
+    for resolution in CLOUD_RESOLUTIONS:
         try:
-            oneMask     = ee.Image(1.0)
-            cloudScore  = detect_clouds(image)
-            areaCount   = oneMask.reduceRegion(  ee.Reducer.sum(),  region, resolution)
-            cloudCount  = cloudScore.reduceRegion(ee.Reducer.sum(), region, resolution)
-            percentage  = safe_get_info(cloudCount)['constant'] / safe_get_info(areaCount)['constant']
-            return percentage
+            return safe_get_info(computeCloudPercentage(image, region, resolution))
         except Exception as e:
             # Keep trying with lower resolution until we succeed
-            resolution = 2*resolution
-            if resolution > MAX_RESOLUTION:
+            if resolution == CLOUD_RESOLUTIONS[-1]:
                 raise e
 
 def compute_water_threshold(sun_angle):
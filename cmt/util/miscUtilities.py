@@ -18,12 +18,15 @@
 import ee
 import os
 import json
+import shutil
 import threading
 import time
 import xml.etree.cElementTree as ET
 import tempfile
 import zipfile
-import urllib2
+
+import cmt.util.download_cache
+import cmt.util.ee_request_pool
 
 # Location of the sensor config files
 SENSOR_FILE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../config/sensors')
@@ -80,26 +83,15 @@ def safeRename(collection, inputNames, outputNames):
         
 
 def safe_get_info(ee_object, max_num_attempts=5):
-    '''Keep trying to call getInfo() on an Earth Engine object until it succeeds.'''
-    
-    # Do not try again if we get one of these exceptions
-    fail_messages = ['Too many pixels']
-    
-    num_attempts = 0
-    while True:
-        try:
-            return ee_object.getInfo()
-        except Exception as e:
-            # Rethrow the exception if it is not timeout related
-            for message in fail_messages:
-                if message in str(e):
-                    raise e
-                    
-            print 'Earth Engine Error: %s. Waiting 10s and then retrying.' % (e)
-            time.sleep(10)
-            num_attempts += 1
-        if max_num_attempts and (num_attempts >= max_num_attempts):
-            raise Exception('safe_get_info failed to succeed after ' +str(num_attempts)+ ' attempts!')
+    '''Keep trying to call getInfo() on an Earth Engine object until it succeeds.
+       - Transient errors are retried with backoff by the shared request pool.'''
+    pool = cmt.util.ee_request_pool.get_request_pool()
+    return pool.get_info(ee_object, max_attempts=(max_num_attempts or 0))
+
+def safe_get_info_list(ee_objects, max_num_attempts=5):
+    '''Call safe_get_info() on a list of Earth Engine objects concurrently'''
+    pool = cmt.util.ee_request_pool.get_request_pool()
+    return pool.map_get_info(ee_objects, max_attempts=(max_num_attempts or 0))
 
 
 class waitForEeResult(threading.Thread):
@@ -336,27 +328,14 @@ def downloadEeImage(eeObject, bbox, scale, file_path, vis_params=None):
         eeRect = bbox
     eeGeom = eeRect.toGeoJSONString()
     
-    # Retrieve a download URL from Earth Engine
+    # Retrieve the packed file from Earth Engine, or from the download cache
     dummy_name = 'EE_image'
-    url = download_object.getDownloadUrl({'name' : dummy_name, 'scale': scale, 'crs': 'EPSG:4326', 'region': eeGeom})
-    #print 'Got download URL: ' + url
-      
+    params     = {'name' : dummy_name, 'scale': scale, 'crs': 'EPSG:4326', 'region': eeGeom}
+    zip_path   = cmt.util.download_cache.get_download_cache().fetch(download_object, params)
     
-    # Generate a temporary path for the packed download file
+    # Use a private working folder so that concurrent downloads do not overwrite each other
+    temp_dir    = tempfile.mkdtemp(prefix='CMT_temp_download_', dir=TEMP_FILE_DIR)
     temp_prefix = 'CMT_temp_download_' + dummy_name
-    zip_name    = temp_prefix + '.zip'
-    zip_path    = os.path.join(TEMP_FILE_DIR, zip_name) 
-    
-    # Download the packed file
-    print 'Downloading image...'
-    data = urllib2.urlopen(url)
-    with open(zip_path, 'wb') as fp:
-        while True:
-            chunk = data.read(16 * 1024)
-            if not chunk:
-                break
-            fp.write(chunk)
-    print 'Download complete!'
     
     # Each band get packed seperately in the zip file.
     z = zipfile.ZipFile(zip_path, 'r')
@@ -377,15 +356,15 @@ def downloadEeImage(eeObject, bbox, scale, file_path, vis_params=None):
         color_names = ['vis-red', 'vis-green', 'vis-blue']
     for b in color_names:
         band_filename  = dummy_name + '.' + b + '.tif'
-        extracted_path = os.path.join(TEMP_FILE_DIR, band_filename)
+        extracted_path = os.path.join(temp_dir, band_filename)
         #print band_filename
         #print extracted_path
-        z.extract(band_filename, TEMP_FILE_DIR)
+        z.extract(band_filename, temp_dir)
         temp_band_files.append(extracted_path)
         band_files_string += ' ' + extracted_path
         
     # Generate an intermediate vrt file
-    vrt_path = os.path.join(TEMP_FILE_DIR, temp_prefix + '.vrt')
+    vrt_path = os.path.join(temp_dir, temp_prefix + '.vrt')
     cmd = 'gdalbuildvrt -separate -resolution highest ' + vrt_path +' '+ band_files_string
     print cmd
     os.system(cmd)
@@ -397,17 +376,13 @@ def downloadEeImage(eeObject, bbox, scale, file_path, vis_params=None):
     print cmd
     os.system(cmd)
     
-    ### Clean up vrt file
-    ##os.remove(vrt_path)
+    # Clean up the extracted bands and vrt file, the zip file stays in the download cache
+    z.close()
+    shutil.rmtree(temp_dir, ignore_errors=True)
     
     # Check for output file
     if not os.path.exists(file_path):
         raise Exception('Failed to create output image file!')
-        
-    ### Clean up temporary files
-    ##for b in temp_band_files:
-    ##    os.remove(b)
-    ##os.remove(zip_path)
     
     print 'Finished saving ' + file_path
     return True
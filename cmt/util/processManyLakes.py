@@ -40,6 +40,9 @@ import functools
 import traceback
 import ee
 
+import cmt.util.ee_cassette
+import cmt.util.ee_trace
+
 #---------------------------------------------------------------------------
 
 class LakeDataLoggerBase(object):
@@ -152,6 +155,7 @@ def process_lake(lake, ee_lake, start_date, end_date, output_directory,
         ee_bounds = ee_lake.geometry().bounds().buffer(1000).bounds()
         
         print 'Processing lake: ' + name
+        cmt.util.ee_trace.set_stage('Lake ' + name)
         
         # Set up logging object for this lake
         logger = logging_class(output_directory, ee_lake, name)
@@ -201,6 +205,7 @@ def process_lake(lake, ee_lake, start_date, end_date, output_directory,
         traceback.print_exc(file=sys.stdout)
 
     print 'Finished processing lake: ' + name
+    cmt.util.ee_trace.write_process_trace()
 
 #======================================================================================================
 def main(processing_function, logging_class, image_fetching_function=get_image_collection_landsat5):
@@ -213,7 +218,12 @@ def main(processing_function, logging_class, image_fetching_function=get_image_c
     parser.add_argument('--results-dir', dest='results_dir', action='store', required=False, default='results')
     parser.add_argument('--max-lakes',   dest='max_lakes',   type=int,     required=False, default=100, help='Limit to this many lakes')
     parser.add_argument('--threads',     dest='num_threads', type=int,     required=False, default=4)
+    parser.add_argument('--cassette',    dest='cassette_dir', action='store', required=False, default=None, help='Record EE responses in this folder and replay them on later runs')
+    parser.add_argument('--cassette-mode', dest='cassette_mode', required=False, default=None, choices=cmt.util.ee_cassette.MODES)
     args = parser.parse_args()
+
+    if args.cassette_dir or args.cassette_mode:
+        cmt.util.ee_cassette.install_default(args.cassette_dir, args.cassette_mode)
        
     if args.start_date == None: # Use a large date range
         start_date = ee.Date('1984-01-01')
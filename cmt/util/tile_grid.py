@@ -0,0 +1,120 @@
+# -----------------------------------------------------------------------------
+# Copyright * 2014, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration. All
+# rights reserved.
+#
+# The Crisis Mapping Toolkit (CMT) v1 platform is licensed under the Apache
+# License, Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+# -----------------------------------------------------------------------------
+
+import math
+import threading
+import numpy
+
+import ee
+
+'''
+Local computation of tile grids over a region.
+
+Splitting a domain into boxes of a given size in meters only needs the
+distances across its bounding box, which are computed here with the haversine
+formula instead of Earth Engine requests.  The grid is kept as NumPy arrays and
+EE geometries are only created for the tiles if they are asked for.  Grids are
+cached by (bounding box, box size, box limit).
+'''
+
+# Mean radius of the WGS84 ellipsoid in meters
+EARTH_RADIUS_METERS = 6371008.8
+
+def haversine_distance(lon1, lat1, lon2, lat2):
+    '''Great circle distance in meters between points in degrees, works on NumPy arrays'''
+    lon1, lat1, lon2, lat2 = map(numpy.radians, (lon1, lat1, lon2, lat2))
+    a = numpy.sin((lat2 - lat1) / 2)**2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS_METERS * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
+
+def get_bounding_box(bounds):
+    '''Returns (minLon, minLat, maxLon, maxLat) from an ee.Geometry, a GeoJSON
+       dictionary, or a list of four values which is returned as a tuple'''
+    if hasattr(bounds, 'toGeoJSON'):
+        bounds = bounds.toGeoJSON()
+    if not isinstance(bounds, dict):
+        return tuple(bounds)
+    coords = numpy.array(bounds['coordinates'][0], dtype=numpy.float64)
+    return (coords[:, 0].min(), coords[:, 1].min(), coords[:, 0].max(), coords[:, 1].max())
+
+
+class TileGrid(object):
+    '''A grid of equally sized boxes covering a bounding box.
+       - corners is an N x 4 array of (minLon, minLat, maxLon, maxLat), row by row from the bottom left.
+       - centers is an N x 2 array of (lat, lon).'''
+
+    def __init__(self, bbox, num_boxes_x, num_boxes_y, box_size_meters):
+        self.bbox            = bbox
+        self.num_boxes_x     = num_boxes_x
+        self.num_boxes_y     = num_boxes_y
+        self.box_size_meters = box_size_meters
+
+        (minLon, minLat, maxLon, maxLat) = bbox
+        lons = numpy.linspace(minLon, maxLon, num_boxes_x + 1)
+        lats = numpy.linspace(minLat, maxLat, num_boxes_y + 1)
+        (left,   bottom) = numpy.meshgrid(lons[:-1], lats[:-1])
+        (right,  top)    = numpy.meshgrid(lons[1:],  lats[1:])
+        self.corners = numpy.column_stack([left.ravel(), bottom.ravel(), right.ravel(), top.ravel()])
+        self.centers = numpy.column_stack([(self.corners[:, 1] + self.corners[:, 3]) / 2,
+                                           (self.corners[:, 0] + self.corners[:, 2]) / 2])
+        self._rectangles = None
+        self._points     = None
+
+    def __len__(self):
+        return len(self.corners)
+
+    def get_rectangles(self):
+        '''Returns a list of ee.Geometry.Rectangle objects for the boxes'''
+        if self._rectangles is None:
+            self._rectangles = [ee.Geometry.Rectangle(*[float(v) for v in c]) for c in self.corners]
+        return self._rectangles
+
+    def get_center_points(self):
+        '''Returns a list of ee.Geometry.Point objects at the box centers'''
+        if self._points is None:
+            self._points = [ee.Geometry.Point(float(lon), float(lat)) for (lat, lon) in self.centers]
+        return self._points
+
+
+_grid_cache      = dict()
+_grid_cache_lock = threading.Lock()
+
+def get_tile_grid(bounds, box_size_meters, max_boxes_per_side):
+    '''Divide a region into a grid of boxes of approximately box_size_meters,
+       using at most max_boxes_per_side boxes in each direction.
+       - The box size is increased to cover the region when the box limit is reached.'''
+
+    bbox = tuple([float(v) for v in get_bounding_box(bounds)])
+    key  = (bbox, box_size_meters, max_boxes_per_side)
+    with _grid_cache_lock:
+        grid = _grid_cache.get(key)
+    if grid is not None:
+        return grid
+
+    # Side widths in meters
+    (minLon, minLat, maxLon, maxLat) = bbox
+    height = float(haversine_distance(minLon, minLat, minLon, maxLat))
+    width  = float(haversine_distance(minLon, minLat, maxLon, minLat))
+
+    # Determine the number of boxes
+    num_boxes_x = max(1, min(int(math.ceil(width  / box_size_meters)), max_boxes_per_side))
+    num_boxes_y = max(1, min(int(math.ceil(height / box_size_meters)), max_boxes_per_side))
+    actual_size = ((width/num_boxes_x) + (height/num_boxes_y)) / 2
+
+    grid = TileGrid(bbox, num_boxes_x, num_boxes_y, actual_size)
+    with _grid_cache_lock:
+        _grid_cache[key] = grid
+    return grid